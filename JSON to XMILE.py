@@ -1,258 +1,178 @@
+import argparse
+import glob
 import json
-import re
-import xml.etree.ElementTree as ET
-
-def extract_variable_names(model_data):
-    """Extracts variable names from stocks, flows, and auxiliaries."""
-    names = []
-    for category in ["stocks", "flows", "auxiliaries"]:
-        for item in model_data.get(category, []):
-            names.append(item["name"])
-    return names
-
-def clean_eqn(eqn, variable_names):
-    """
-    Replace spaces in known variable names with underscores in the given equation.
-    Ensures correct matching by sorting longer names first.
-    """
-    # Sort by length (longest names first to avoid partial replacements)
-    variable_names = sorted(variable_names, key=len, reverse=True)
-
-    for name in variable_names:
-        underscored = name.replace(" ", "_")
-        pattern = r'\b' + re.escape(name) + r'\b'
-        eqn = re.sub(pattern, underscored, eqn)
-
-    return eqn
+import os
+import time
+
+# The XMILE conversion itself lives in sdmodel.xmile (standard library only), shared with the image script
+from sdmodel.xmile import (IncrementalExporter, generate_xmile as generate_xmile_from_json, print_summary,
+                           write_xmile_from_json)
+from sdmodel.graph import print_issues, validate_model
+from sdmodel.model import load_model
+from sdmodel.layout import LAYOUTS, apply_layout
+
+# JSON files larger than this are read a block at a time instead of loaded whole (see write_xmile_from_json)
+STREAM_JSON_BYTES = 64 * 1024 * 1024
+
+def find_json_files(inputs):
+    """Expands directories (all *.json files inside) and glob patterns into a sorted list of files."""
+    files = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            files.update(glob.glob(os.path.join(item, "*.json")))
+        else:
+            files.update(path for path in glob.glob(item, recursive=True) if os.path.isfile(path))
+    return sorted(files)
 
-def generate_xmile_from_json(model_data, filename):
+def convert_json_file(json_filename, xmile_filename, strict=False, incremental=False, layout=None, layout_seed=0,
+                      stream=None):
     """
-    Converts the structured model data into an XMILE file.
-    Builds the required XML structure and writes it to the specified file.
+    Converts one JSON model file to XMILE for batch runs.
+    The file is written under a temporary name and renamed when complete, so an
+    interrupted run never leaves a half-written file that looks converted.
+    With `strict`, models that fail validation (undefined names, algebraic loops,
+    unparsable equations, unknown flows) are not converted.
+    With `incremental`, the serialized variables are kept in a "<xmile>.fragments"
+    file and only the variables that changed since the last conversion are rebuilt.
+    With a `layout` engine name (see sdmodel.layout) the diagram is laid out again first.
+    With `stream` the JSON is read a block at a time and never held in memory whole;
+    by default files over STREAM_JSON_BYTES are. Validation, incremental export and
+    layout need the whole model, so they always load the file.
+    Returns (json_filename, seconds, error message or None) instead of raising.
     """
-    # Create the root XMILE element
-    xmile = ET.Element("xmile", {"version": "1.0"})
-
-    # Add header information
-    header = ET.SubElement(xmile, "header")
-    model_name = ET.SubElement(header, "name")
-    model_name.text = "Converted System Dynamics Model"
-
-    # Simulation specifications - subject to change by users
-    sim_specs = ET.SubElement(xmile, "sim_specs")
-    start = ET.SubElement(sim_specs, "start")
-    start.text = "0"
-    stop = ET.SubElement(sim_specs, "stop")
-    stop.text = "100"
-    dt = ET.SubElement(sim_specs, "dt")
-    dt.text = "1/4"
-
-    # Model section
-    model = ET.SubElement(xmile, "model")
-    variables = ET.SubElement(model, "variables")
-    names = extract_variable_names(model_data)
-
-    # Add stocks
-    for stock in model_data.get("stocks", []):
-        stock_el = ET.SubElement(variables, "stock", {"name": stock["name"]})
-
-        if "description" in stock and stock["description"]:
-            doc_el = ET.SubElement(stock_el, "doc")
-            doc_el.text = stock["description"]
-
-        if "eqn" in stock and stock["eqn"]:
-            eqn_el = ET.SubElement(stock_el, "eqn")
-            eqn_el.text = stock["eqn"]
-
-        # Add corresponding flow tags if available
-        for inflow in stock.get("inflows", []):
-            ET.SubElement(stock_el, "inflow").text = inflow.replace(" ", "_")
-        for outflow in stock.get("outflows", []):
-            ET.SubElement(stock_el, "outflow").text = outflow.replace(" ", "_")
-
-        if "unit" in stock and stock["unit"]:
-            doc_el = ET.SubElement(stock_el, "units")
-            doc_el.text = stock["unit"]
-
-    # Add flows
-    for flow in model_data.get("flows", []):
-        flow_el = ET.SubElement(variables, "flow", {"name": flow["name"]})
-
-        if "description" in flow and flow["description"]:
-            doc_el = ET.SubElement(flow_el, "doc")
-            doc_el.text = flow["description"]
-
-        if "eqn" in flow and flow["eqn"]:
-            eqn_el = ET.SubElement(flow_el, "eqn")
-            eqn_el.text = clean_eqn(flow["eqn"], names)
-
-        if "unit" in flow and flow["unit"]:
-            doc_el = ET.SubElement(flow_el, "units")
-            doc_el.text = flow["unit"]
-
-    # Add auxiliary variables
-    for aux in model_data.get("auxiliaries", []):
-        aux_el = ET.SubElement(variables, "aux", {"name": aux["name"]})
-
-        if "description" in aux and aux["description"]:
-            doc_el = ET.SubElement(aux_el, "doc")
-            doc_el.text = aux["description"]
-
-        if "eqn" in aux and aux["eqn"]:
-            eqn_el = ET.SubElement(aux_el, "eqn")
-            eqn_el.text = clean_eqn(aux["eqn"], names)
-
-        if "unit" in aux and aux["unit"]:
-            doc_el = ET.SubElement(aux_el, "units")
-            doc_el.text = aux["unit"]
-
-    # Create views element and a single view element
-    views = ET.SubElement(model, "views")
-    view = ET.SubElement(views, "view")
-
-    # Grid layout settings
-    grid_spacing_x = 300
-    grid_spacing_y = 200
-    stock_start_x = 400
-    stock_start_y = 400
-
-    # Position trackers
-    stock_positions = {}
-    flow_positions = {}
-    aux_positions = {}
-    var_positions = {}
-
-    # Add connector elements in the view with sequential "uid" starting from 1
-    connectors = model_data.get("connectors", [])
-    for i, conn in enumerate(connectors, start=1):
-        connector_attribs = {
-            "uid": str(i),  # Sequential uid starting from 1
-            "angle": str(conn.get("angle", "0"))
-        }
-        connector_el = ET.SubElement(view, "connector", attrib=connector_attribs)
-        from_el = ET.SubElement(connector_el, "from")
-        from_el.text = conn["src"]
-        to_el = ET.SubElement(connector_el, "to")
-        to_el.text = conn["tgt"]
-
-    # Output display objects for variables
-    for i, stock in enumerate(model_data.get("stocks", [])):
-        x = stock_start_x + (i % 4) * grid_spacing_x
-        y = stock_start_y + (i // 4) * grid_spacing_y
-        stock_positions[stock["name"]] = (x, y)
-        var_positions[stock["name"]] = (x, y)
-        attribs = {
-            "x": str(stock.get("x", str(x))),
-            "y": str(stock.get("y", str(y))),
-            "name": stock["name"]
-        }
-        ET.SubElement(view, "stock", attrib=attribs)
-
-    for i, flow in enumerate(model_data.get("flows", [])):
-        name = flow["name"]
-
-        # Try to find connected stocks
-        from_stock = next((s["name"] for s in model_data["stocks"] if name in s.get("outflows", [])), None)
-        to_stock = next((s["name"] for s in model_data["stocks"] if name in s.get("inflows", [])), None)
-
-        if from_stock and to_stock:
-            x1, y1 = stock_positions[from_stock]
-            x2, y2 = stock_positions[to_stock]
-            x = (x1 + x2) // 2
-            y = (y1 + y2) // 2
-        elif to_stock:
-            x, y = stock_positions[to_stock]
-            x -= 100
-        elif from_stock:
-            x, y = stock_positions[from_stock]
-            x += 100
+    started = time.perf_counter()
+    tmp_filename = xmile_filename + ".tmp"
+    try:
+        if stream is None:
+            stream = os.path.getsize(json_filename) > STREAM_JSON_BYTES
+        if stream and not (strict or incremental or layout):
+            write_xmile_from_json(json_filename, tmp_filename)
         else:
-            x = 100 + (i * 150)
-            y = 500
-
-        flow_positions[name] = (x, y)
-        var_positions[name] = (x, y)
-
-        attribs = {
-            "x": str(flow.get("x", str(x))),
-            "y": str(flow.get("y", str(y))),
-            "name": flow["name"]
-        }
-        # ET.SubElement(view, "flow", attrib=attribs)
-        flow_view = ET.SubElement(view, "flow", attrib=attribs)
-        # Generate <pts> in view as well using the same rule:
-        try:
-            flow_x = float(flow.get("x", str(x)))
-        except ValueError:
-            flow_x = 0.0
-        flow_y = flow.get("y", str(y))
-        pts_el = ET.SubElement(flow_view, "pts")
-        ET.SubElement(pts_el, "pt", attrib={"x": str(flow_x - 60), "y": str(flow_y)})
-        ET.SubElement(pts_el, "pt", attrib={"x": str(flow_x + 60), "y": str(flow_y)})
-
-    aux_indices = {}
-    for i, aux in enumerate(model_data.get("auxiliaries", [])):
-        name = aux["name"]
-
-        # Find what this auxiliary connects to
-        target = next((c["tgt"] for c in model_data.get("connectors", []) if c["src"] == name), None)
-        base_x, base_y = var_positions.get(target, (100 + (i * 200), 700))
-
-        # Offset for visual clarity
-        offset = aux_indices.get(target, 0)
-        x = base_x
-        y = base_y - 100 - (offset * 30)
-        aux_indices[target] = offset + 1
-
-        aux_positions[name] = (x, y)
-        var_positions[name] = (x, y)
-
-        attribs = {
-            "x": str(aux.get("x", str(x))),
-            "y": str(aux.get("y", str(y))),
-            "name": aux["name"]
-        }
-        ET.SubElement(view, "aux", attrib=attribs)
-
-    # Write the XMILE file
-    tree = ET.ElementTree(xmile)
-    tree.write(filename, encoding="utf-8", xml_declaration=True)
-
-def print_summary(model_data):
+            with open(json_filename, "r") as f:
+                model_data = json.load(f)
+            if strict:
+                errors = [issue["message"] for issue in validate_model(model_data) if issue["severity"] == "error"]
+                if errors:
+                    raise ValueError(f"{len(errors)} validation error(s), first: {errors[0]}")
+            if layout:
+                model_data = apply_layout(model_data, layout, layout_seed)
+            if incremental:
+                IncrementalExporter(xmile_filename + ".fragments").export(model_data, tmp_filename)
+            else:
+                generate_xmile_from_json(model_data, tmp_filename, streaming=True)
+        os.replace(tmp_filename, xmile_filename)
+        error = None
+    except Exception as e:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        error = f"{type(e).__name__}: {e}"
+    return json_filename, time.perf_counter() - started, error
+
+def _convert_job(job):
+    return convert_json_file(*job)
+
+def batch_convert(inputs, output_dir=None, workers=None, chunksize=16, force=False, strict=False,
+                  incremental=False, layout=None, layout_seed=0, stream=None):
     """
-    Prints a summary of the model data, including the number of stocks, flows,
-    and auxiliary variables, as well as their names.
+    Converts every JSON file matched by `inputs` (directories or glob patterns)
+    across a pool of worker processes.
+    Each XMILE file is written next to its JSON file, or under `output_dir` with
+    the same relative layout. Files whose XMILE output is already newer than the
+    JSON are skipped unless `force` is set. Failed files are reported and the
+    run carries on. With `strict`, models that fail validation count as failed.
+    With `incremental`, edited models only rebuild their changed variables.
+    With `layout`, every diagram is laid out again with that engine and seed.
+    With `stream`, every JSON file is read a block at a time (by default only large ones).
+    Returns the list of (json file, error message) failures.
     """
-    stocks = model_data.get("stocks", [])
-    flows = model_data.get("flows", [])
-    auxiliaries = model_data.get("auxiliaries", [])
-    connectors = model_data.get("connectors", [])
-
-    print("\nModel Summary:")
-    print(f"Number of stocks: {len(stocks)}")
-    print("Stocks:", ", ".join([stock["name"] for stock in stocks]))
-
-    print(f"\nNumber of flows: {len(flows)}")
-    print("Flows:", ", ".join([flow["name"] for flow in flows]))
-
-    print(f"\nNumber of auxiliary variables: {len(auxiliaries)}")
-    print("Auxiliaries:", ", ".join([aux["name"] for aux in auxiliaries]))
-
-    print(f"\nNumber of connectors: {len(connectors)}")
-
+    started = time.perf_counter()
+    json_files = find_json_files(inputs)
+    base_dir = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in json_files]) if json_files else ""
+
+    jobs = []
+    skipped = 0
+    for json_filename in json_files:
+        stem = os.path.splitext(json_filename)[0]
+        if output_dir:
+            relative = os.path.relpath(os.path.abspath(stem), base_dir)
+            xmile_filename = os.path.join(output_dir, relative + ".xmile")
+            os.makedirs(os.path.dirname(xmile_filename), exist_ok=True)
+        else:
+            xmile_filename = stem + ".xmile"
+        if not force and os.path.exists(xmile_filename) and \
+                os.path.getmtime(xmile_filename) >= os.path.getmtime(json_filename):
+            skipped += 1
+            continue
+        jobs.append((json_filename, xmile_filename, strict, incremental, layout, layout_seed, stream))
+
+    print(f"Found {len(json_files)} JSON files: {len(jobs)} to convert, {skipped} already converted")
+    failures = []
+    busy = 0.0
+    if jobs:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for json_filename, seconds, error in pool.map(_convert_job, jobs, chunksize=chunksize):
+                busy += seconds
+                if error:
+                    failures.append((json_filename, error))
+                    print(f"FAILED  {json_filename} ({seconds:.3f} s): {error}")
+                else:
+                    print(f"ok      {json_filename} ({seconds:.3f} s)")
+
+    elapsed = time.perf_counter() - started
+    converted = len(jobs) - len(failures)
+    print(f"\nConverted {converted}, skipped {skipped}, failed {len(failures)} in {elapsed:.2f} s")
+    if jobs:
+        print(f"Throughput: {len(jobs) / elapsed:.1f} files/s, average {busy / len(jobs):.3f} s per file")
+    return failures
 
 def main():
+    parser = argparse.ArgumentParser(description="Convert JSON stock and flow models into XMILE files.")
+    parser.add_argument("inputs", nargs="*", help="JSON files, directories or glob patterns to convert in batch")
+    parser.add_argument("-o", "--output-dir", help="write XMILE files here instead of next to the JSON files")
+    parser.add_argument("-j", "--workers", type=int, help="worker processes (default: number of CPUs)")
+    parser.add_argument("--chunksize", type=int, default=16, help="files handed to a worker at a time (default 16)")
+    parser.add_argument("--force", action="store_true", help="convert files even if they are already converted")
+    parser.add_argument("--strict", action="store_true", help="do not convert models that fail validation")
+    parser.add_argument("--incremental", action="store_true",
+                        help="keep <file>.xmile.fragments and only rebuild variables that changed")
+    parser.add_argument("--layout", choices=sorted(LAYOUTS),
+                        help="lay out the diagrams again: grid (remove overlaps), layered or force")
+    parser.add_argument("--layout-seed", type=int, default=0, help="seed of the layout engine (default 0)")
+    parser.add_argument("--stream", action="store_true", default=None,
+                        help=f"read every JSON file a block at a time (default: files over "
+                             f"{STREAM_JSON_BYTES // (1024 * 1024)} MB)")
+    args = parser.parse_args()
+
+    if args.inputs:
+        failures = batch_convert(args.inputs, args.output_dir, args.workers, args.chunksize, args.force,
+                                 args.strict, args.incremental, args.layout, args.layout_seed, args.stream)
+        raise SystemExit(1 if failures else 0)
+
     # Replace "YOUR_LOCAL_JSON_FILE_PATH" with the path to your sample JSON file.
     json_filename = "YOUR_LOCAL_JSON_FILE_PATH"
+    # Set the filename to save - subject to change by users
+    xmile_filename = "Exported_SD_Model.xmile"
+
+    if args.stream or os.path.getsize(json_filename) > STREAM_JSON_BYTES:
+        # Too large to load whole: convert while reading, then summarize the outline kept for the view.
+        # Validation needs every equation, so it is skipped; run --strict on the file to validate it.
+        outline = write_xmile_from_json(json_filename, xmile_filename)
+        print_summary(outline)
+        print(f"XMILE file '{xmile_filename}' generated successfully!")
+        return
+
     with open(json_filename, "r") as f:
         model_data = json.load(f)
+    # Walk the JSON once; the summary and the XMILE generation both use the loaded model
+    model = load_model(model_data)
 
     # Print summary of the extracted model data
-    print_summary(model_data)
+    print_summary(model)
+    print_issues(validate_model(model_data))
 
-    # Set the filename to save - subject to change by users
-    xmile_filename = "Exported_SD_Model.xmile"
-    generate_xmile_from_json(model_data, xmile_filename)
+    generate_xmile_from_json(model, xmile_filename)
     print(f"XMILE file '{xmile_filename}' generated successfully!")
 
 if __name__ == "__main__":
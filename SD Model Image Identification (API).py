@@ -1,12 +1,14 @@
-from openai import OpenAI
-from google import genai
-from google.genai.types import GenerateContentConfig
-import PIL.Image
 import base64
 import json
-import re
+import os
 from datetime import datetime
-import xml.etree.ElementTree as ET
+
+# The XMILE conversion only needs the standard library. Everything used for the API calls
+# (asyncio, sqlite3, the provider SDKs and Pillow) is imported on first use inside
+# extract_components_from_image, so importing this script to reuse generate_xmile stays fast.
+from sdmodel.xmile import generate_xmile, print_summary
+from sdmodel.graph import print_issues, validate_model
+from sdmodel import instrument
 
 
 # Set your OpenAI API key (ensure this is kept secure)
@@ -14,366 +16,289 @@ openai_api_key = "YOUR_API_KEY"
 # Set your Gemini API key (ensure this is kept secure)
 GEMINI_API_KEY = "YOUR_API_KEY"
 
-# set up the model configuration to reduce the unnecessary randomness produced each time.
-gemini_config = GenerateContentConfig(
-temperature=0.2,
-top_p=0.95,
-top_k=20,
-)
+# Models used for the extraction
+openai_model = "gpt-4o"
+gemini_model = "gemini-2.0-flash"
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+# API endpoints; None uses the public APIs. Point both at a local test server, e.g. python -m sdmodel.mockserver:
+# openai_base_url = "http://127.0.0.1:8080/v1" and gemini_base_url = "http://127.0.0.1:8080"
+openai_base_url = None
+gemini_base_url = None
+
+# set up the model configuration to reduce the unnecessary randomness produced each time.
+openai_config = {"temperature": 1, "top_p": 0.1}
+gemini_config = {
+    "temperature": 0.2,
+    "top_p": 0.95,
+    "top_k": 20,
+}
+
+# Cache of extraction results, keyed on the image, prompt, provider, model and configuration.
+# Repeated runs over the same images then skip the API call entirely.
+use_extraction_cache = True
+extraction_cache_max_bytes = 512 * 1024 * 1024
+extraction_cache_max_age = 30 * 24 * 3600  # seconds
+
+# Shrink images before upload: limit the longest edge, convert to grayscale and re-encode.
+# Set preprocess_images = False to send the original file.
+preprocess_images = True
+image_settings = {"max_edge": 2048, "grayscale": True, "levels": 16, "format": "PNG", "quality": 85}
+
+# Hedged mode (choice "Hedged"): ask the primary provider first, and the other one as well if no
+# valid answer has arrived after hedge_delay seconds ("auto": the primary's 95th percentile latency).
+hedge_primary = "OPENAI"
+hedge_delay = "auto"
+
+# Consensus mode (choice "Consensus"): send consensus_samples requests at once, spread over consensus_providers,
+# and keep the variables and connectors most answers agree on, each with a "confidence". The other requests
+# are cancelled as soon as consensus_min_samples answers agree on consensus_threshold of the model.
+consensus_samples = 5
+consensus_providers = ("OPENAI",)
+consensus_threshold = 0.9
+consensus_min_samples = 3
+
+# Stream the response and parse each stock, flow, auxiliary and connector as it arrives.
+# Malformed output is detected early and the request is retried up to stream_retries times.
+stream_responses = True
+stream_retries = 2
+
+# Re-lay out the diagram before writing XMILE: None keeps the LLM's positions (and the default grid for
+# the rest); "grid" removes overlaps from those, "layered" or "force" compute a new layout (sdmodel.layout).
+diagram_layout = None
+layout_seed = 0
+
+# Record how long each stage takes (image preparation, API call, parsing, JSON output, XMILE), the bytes sent,
+# the tokens used and the retries, one JSON line per stage. None records nothing. Summarize a file with
+# python -m sdmodel.instrument trace.jsonl
+trace_file = None
+
+def output_filename(image_path, extension):
+    """The output file of an image: its file name with `extension`, so every image keeps its own results."""
+    return os.path.splitext(os.path.basename(image_path))[0] + extension
+
+def save_output(model_data, image_path):
+    # Written under a temporary name and renamed, so an interrupted run never leaves a truncated file
+    json_filename = output_filename(image_path, ".json")
+    with instrument.span("write_output") as span:
+        with open(json_filename + ".tmp", 'w') as outfile:
+            json.dump(model_data, outfile, indent=2)
+            span.set(output_bytes=outfile.tell())
+        os.replace(json_filename + ".tmp", json_filename)
 
-def extract_components_from_image(image_path, choice_of_LLM):
+def extract_components_from_image(image_path, choice_of_LLM, use_cache=None):
     """
     Extracts the components of a stock and flow diagram using the OpenAI/Gemini API.
     The function reads an image file, encodes it in base64, and sends it to the API
     with a prompt to extract stocks, flows, auxiliaries, and connectors.
     Each variable may now also include location keys "x" and "y".
     Expected output is a JSON object with keys: 'stocks', 'flows', 'auxiliaries', 'connectors'.
+    The image is downsampled and re-encoded first (see image_settings).
+    Results are cached on disk; pass use_cache=False to always call the API.
+    With choice_of_LLM "HEDGED" both APIs are raced and the first valid answer is kept.
+    With choice_of_LLM "CONSENSUS" several answers are sampled in parallel and merged.
     """
-    # Construct the prompt
-    prompt = (
-        "Analyze the following image of a stock and flow diagram in System Dynamics. "
-        "Extract the following information in JSON format: stocks, flows, auxiliaries, and connectors. "
-        "Return a JSON object with keys: 'stocks', 'flows', 'auxiliaries', 'connectors'. "
-        "Each of 'stocks', 'flows', and 'auxiliaries' should be an array of objects with a 'name' property, a 'description' property for adding documentation and explanation for each variable suggested by you, a 'unit' property for reasonable units that you suggest, and an 'eqn' property for sound equations that you suggest. (Note: you should suggest numbers instead of formulas in 'string' type for all the stocks)"
-        "As well as their relative location information in the given image: 'x' and 'y' coordinates (in pixels). "
-        "For stocks, also extract 'inflows' and 'outflows' as lists of flow names. "
-        "List all the names as original. "
-        "Each connector should be an object with properties 'src' and 'tgt' and ONLY take the arrow links between model variables into account. "
-        "You need to add the causal links from 'stock' to 'flow' in the 'connectors' part if the variable name of 'stock' is used in the suggested 'flow' equation. "
-        "To avoid any omissions, make sure and check every object with properties 'src' and 'tgt' in 'connectors' has been classified as either 'stocks', or 'flows', or 'auxiliaries'. "
-        "Add their causal relationships in 'connectors' part if any variable is used as part of the equation of another variable. "
-    )
-    # Construct the LLM: OpeanAI or Gemini?
+    from sdmodel.cache import ExtractionCache, cache_key
+    from sdmodel.extraction import EXTRACTION_PROMPT, parse_model_json, parse_model_stream, validate_model_data
+    from sdmodel.images import preprocess_file, sniff_mime_type
+    from sdmodel.jsonstream import JSONStreamError
+
+    if use_cache is None:
+        use_cache = use_extraction_cache
+    if choice_of_LLM == "HEDGED":
+        import asyncio
+
+        from sdmodel.hedging import extract_hedged
+
+        model_data, provider = asyncio.run(extract_hedged(
+            image_path, primary=hedge_primary, hedge_delay=hedge_delay,
+            api_keys={"OPENAI": openai_api_key, "GEMINI": GEMINI_API_KEY},
+            models={"OPENAI": openai_model, "GEMINI": gemini_model},
+            configs={"OPENAI": openai_config, "GEMINI": gemini_config},
+            base_urls={"OPENAI": openai_base_url, "GEMINI": gemini_base_url},
+            use_cache=use_cache, preprocess=image_settings if preprocess_images else None,
+            streaming=stream_responses,
+        ))
+        print(f"Using the answer from {provider}")
+        save_output(model_data, image_path)
+        return model_data
+    if choice_of_LLM == "CONSENSUS":
+        import asyncio
+
+        from sdmodel.consensus import extract_consensus
+
+        # Every sample calls the API: cached answers would all be the same
+        model_data, summary = asyncio.run(extract_consensus(
+            image_path, samples=consensus_samples, providers=consensus_providers, threshold=consensus_threshold,
+            min_samples=consensus_min_samples,
+            api_keys={"OPENAI": openai_api_key, "GEMINI": GEMINI_API_KEY},
+            models={"OPENAI": openai_model, "GEMINI": gemini_model},
+            configs={"OPENAI": openai_config, "GEMINI": gemini_config},
+            base_urls={"OPENAI": openai_base_url, "GEMINI": gemini_base_url},
+            preprocess=image_settings if preprocess_images else None, streaming=stream_responses,
+        ))
+        print(f"Merged {summary['merged']} of {summary['requested']} answers ({summary['cancelled']} cancelled), "
+              f"agreement {summary['agreement']:.2f}")
+        save_output(model_data, image_path)
+        return model_data
+
+    prompt = EXTRACTION_PROMPT
+    with instrument.span("preprocess", preprocess=preprocess_images) as span:
+        if preprocess_images:
+            image_bytes, mime_type = preprocess_file(image_path, **image_settings)
+        else:
+            with open(image_path, "rb") as image_file:
+                image_bytes = image_file.read()
+            mime_type = sniff_mime_type(image_bytes)
+        span.set(image_bytes=len(image_bytes))
+
+    # Look up the same request in the cache before loading any API client
     if choice_of_LLM == "OpenAI".upper():
-        # Extract the components using the OpenAI API
-        # Read and encode the image file
-        base64_image = encode_image(image_path)
-        client = OpenAI(api_key=openai_api_key)
-
-        response = client.responses.create(
-            model="gpt-4o",
-            input=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "input_text", "text": prompt},
-                        {
-                            "type": "input_image",
-                            "image_url": f"data:image/jpeg;base64,{base64_image}",
-                        },
-                    ],
-                }
-            ],
-            text={"format": {"type": "json_object"}},
-            temperature=1,
-            top_p=0.1
-        )
-
-        # Debug: Print the entire API response to see its structure
-        print("Raw API response:")
-        print(response)
-
-        # Extract and check the response content
-        structured_data = response.output_text
-        # with open("structured_data_OpenAI.txt", "w", encoding="utf-8") as text_file:
-        #     text_file.write(structured_data)
-        if not structured_data.strip():
-            raise ValueError("API returned an empty response. Check your model access, prompt, and image input.")
+        key = cache_key(image_bytes, prompt, "OPENAI", openai_model, openai_config)
     else:
-        image = PIL.Image.open(image_path)
-        client = genai.Client(api_key=GEMINI_API_KEY)
-        response = client.models.generate_content(
-            model="gemini-2.0-flash",
-            contents=[prompt, image],
-            config=gemini_config
-        )
-
-        # Debug: Print the entire API response to see its structure
-        print("Raw API response:")
-        print(response)
-
-        # Extract and check the response content
-        structured_data = response.candidates[0].content.parts[0].text
-        # Step 1: Clean up raw response
-        structured_data = re.sub(r"```(?:json)?", "", structured_data).strip()
-        # Step 2: Extract JSON portion
-        json_match = re.search(r'\{.*\}', structured_data, re.DOTALL)
-        if json_match:
-            structured_data = json_match.group()
-            # with open("structured_data_Gemini.txt", "w", encoding="utf-8") as text_file:
-            #     text_file.write(structured_data)
-        else:
-            raise ValueError("No valid JSON found in API response")
+        key = cache_key(image_bytes, prompt, "GEMINI", gemini_model, gemini_config)
+    cache = ExtractionCache(max_bytes=extraction_cache_max_bytes, max_age=extraction_cache_max_age) if use_cache else None
+    if cache is not None:
+        with instrument.span("cache_lookup") as span:
+            model_data = cache.get(key)
+            span.set(hit=model_data is not None)
+        if model_data is not None:
+            print("Using cached extraction result")
+            save_output(model_data, image_path)
+            cache.close()
+            return model_data
 
-    # Parse the JSON from the API response
-    try:
-        model_data = json.loads(structured_data)
-        with open('output.json', 'w') as outfile:
-            json.dump(model_data, outfile, indent=2)
-    except json.JSONDecodeError as e:
-        print("Failed to parse JSON. The extracted content is:")
-        print(structured_data)
-        raise e
+    # Construct the LLM: OpeanAI or Gemini?
+    if choice_of_LLM == "OpenAI".upper():
+        from openai import OpenAI
 
+        # Extract the components using the OpenAI API
+        # Encode the image file
+        with instrument.span("encode_image") as span:
+            base64_image = base64.b64encode(image_bytes).decode("utf-8")
+            span.set(payload_bytes=len(base64_image))
+        client = OpenAI(api_key=openai_api_key, base_url=openai_base_url)
+        provider, model = "OPENAI", openai_model
+
+        def request(stream):
+            return client.responses.create(
+                model=openai_model,
+                input=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "input_text", "text": prompt},
+                            {
+                                "type": "input_image",
+                                "image_url": f"data:{mime_type};base64,{base64_image}",
+                            },
+                        ],
+                    }
+                ],
+                text={"format": {"type": "json_object"}},
+                stream=stream,
+                **openai_config
+            )
+
+        def stream_text():
+            with request(stream=True) as events:
+                for event in events:
+                    if event.type == "response.output_text.delta":
+                        yield event.delta
+                    elif event.type == "response.completed":
+                        instrument.record_usage(event.response.usage)
+
+        def full_text():
+            response = request(stream=False)
+            instrument.record_usage(response.usage)
+            return response.output_text
+    else:
+        from google import genai
+        from google.genai.types import GenerateContentConfig, HttpOptions, Part
+
+        # Send the preprocessed bytes as they are instead of a full-resolution PIL image
+        image = Part.from_bytes(data=image_bytes, mime_type=mime_type)
+        client = genai.Client(api_key=GEMINI_API_KEY,
+                              http_options=HttpOptions(base_url=gemini_base_url) if gemini_base_url else None)
+        request_args = {"model": gemini_model, "contents": [prompt, image],
+                        "config": GenerateContentConfig(**gemini_config)}
+        provider, model = "GEMINI", gemini_model
+
+        def stream_text():
+            for chunk in client.models.generate_content_stream(**request_args):
+                instrument.record_usage(chunk.usage_metadata)
+                if chunk.text:
+                    yield chunk.text
+
+        def full_text():
+            response = client.models.generate_content(**request_args)
+            instrument.record_usage(response.usage_metadata)
+            return response.text
+
+    if stream_responses:
+        # Entries are parsed and checked while the response arrives. Malformed output
+        # stops the stream at once, and the request is sent again.
+        # Each api_call span is labelled with its attempt; the retries are counted once, on the enclosing span
+        for attempt in range(stream_retries + 1):
+            try:
+                with instrument.span("api_call", provider=provider, model=model, streaming=True, attempt=attempt,
+                                     payload_bytes=len(image_bytes)):
+                    model_data = parse_model_stream(stream_text())
+                break
+            except JSONStreamError as e:
+                if attempt == stream_retries:
+                    instrument.annotate(retries=attempt)
+                    raise
+                print(f"Malformed response ({e}), retrying")
+        instrument.annotate(retries=attempt)
+    else:
+        with instrument.span("api_call", provider=provider, model=model, streaming=False,
+                             payload_bytes=len(image_bytes)) as span:
+            text = full_text()
+            span.set(response_chars=len(text or ""))
+        # Parse the JSON from the API response, without code fences or surrounding text
+        with instrument.span("parse"):
+            model_data = parse_model_json(text)
+            validate_model_data(model_data)
+    save_output(model_data, image_path)
+
+    if cache is not None:
+        cache.put(key, model_data)
+        cache.close()
     return model_data
 
-def extract_variable_names(model_data):
-    names = []
-    for category in ["stocks", "flows", "auxiliaries"]:
-        for item in model_data.get(category, []):
-            names.append(item["name"])
-    return names
-
-def clean_eqn(eqn, variable_names):
-    """
-    Replace spaces in known variable names with underscores in the given equation.
-    """
-    # Sort by length (longest names first to avoid partial replacements)
-    variable_names = sorted(variable_names, key=len, reverse=True)
-
-    for name in variable_names:
-        underscored = name.replace(" ", "_")
-        pattern = r'\b' + re.escape(name) + r'\b'
-        eqn = re.sub(pattern, underscored, eqn)
-
-    return eqn
-
-def generate_xmile(model_data, filename):
-    """
-    Converts the structured model data into an XMILE file.
-    """
-    # Create the root XMILE element
-    xmile = ET.Element("xmile", {"version": "1.0"})
-
-    # Add header information
-    header = ET.SubElement(xmile, "header")
-    model_name = ET.SubElement(header, "name")
-    model_name.text = "Converted System Dynamics Model"
-
-    # Simulation specifications - subject to user change
-    sim_specs = ET.SubElement(xmile, "sim_specs")
-    start = ET.SubElement(sim_specs, "start")
-    start.text = "0"
-    stop = ET.SubElement(sim_specs, "stop")
-    stop.text = "100"
-    dt = ET.SubElement(sim_specs, "dt")
-    dt.text = "1/4"
-
-    # Model section
-    model = ET.SubElement(xmile, "model")
-    variables = ET.SubElement(model, "variables")
-    names = extract_variable_names(model_data)
-
-    # Add stocks
-    for stock in model_data.get("stocks", []):
-        stock_el = ET.SubElement(variables, "stock", {"name": stock["name"]})
-
-        if "description" in stock and stock["description"]:
-            doc_el = ET.SubElement(stock_el, "doc")
-            doc_el.text = stock["description"]
-
-        if "eqn" in stock and stock["eqn"]:
-            eqn_el = ET.SubElement(stock_el, "eqn")
-            eqn_el.text = stock["eqn"]
-
-        # Add inflow tags if available
-        for inflow in stock.get("inflows", []):
-            ET.SubElement(stock_el, "inflow").text = inflow.replace(" ", "_")
-        for outflow in stock.get("outflows", []):
-            ET.SubElement(stock_el, "outflow").text = outflow.replace(" ", "_")
-
-        if "unit" in stock and stock["unit"]:
-            doc_el = ET.SubElement(stock_el, "units")
-            doc_el.text = stock["unit"]
-
-    # Add flows
-    for flow in model_data.get("flows", []):
-        flow_el = ET.SubElement(variables, "flow", {"name": flow["name"]})
-
-        if "description" in flow and flow["description"]:
-            doc_el = ET.SubElement(flow_el, "doc")
-            doc_el.text = flow["description"]
-
-        if "eqn" in flow and flow["eqn"]:
-            eqn_el = ET.SubElement(flow_el, "eqn")
-            eqn_el.text = clean_eqn(flow["eqn"], names)
-
-        if "unit" in flow and flow["unit"]:
-            doc_el = ET.SubElement(flow_el, "units")
-            doc_el.text = flow["unit"]
-
-    # Add auxiliary variables
-    for aux in model_data.get("auxiliaries", []):
-        aux_el = ET.SubElement(variables, "aux", {"name": aux["name"]})
-
-        if "description" in aux and aux["description"]:
-            doc_el = ET.SubElement(aux_el, "doc")
-            doc_el.text = aux["description"]
-
-        if "eqn" in aux and aux["eqn"]:
-            eqn_el = ET.SubElement(aux_el, "eqn")
-            eqn_el.text = clean_eqn(aux["eqn"], names)
-
-        if "unit" in aux and aux["unit"]:
-            doc_el = ET.SubElement(aux_el, "units")
-            doc_el.text = aux["unit"]
-
-    # Create views element and a single view element
-    views = ET.SubElement(model, "views")
-    view = ET.SubElement(views, "view")
-
-    # Grid layout settings
-    grid_spacing_x = 300
-    grid_spacing_y = 200
-    stock_start_x = 400
-    stock_start_y = 400
-
-    # Position trackers
-    stock_positions = {}
-    flow_positions = {}
-    aux_positions = {}
-    var_positions = {}
-
-    # Add connector elements in the view with sequential uid starting from 1
-    connectors = model_data.get("connectors", [])
-    for i, conn in enumerate(connectors, start=1):
-        connector_attribs = {
-            "uid": str(i),  # Sequential uid starting from 1
-            "angle": str(conn.get("angle", "0"))
-        }
-        connector_el = ET.SubElement(view, "connector", attrib=connector_attribs)
-        from_el = ET.SubElement(connector_el, "from")
-        from_el.text = conn["src"]
-        to_el = ET.SubElement(connector_el, "to")
-        to_el.text = conn["tgt"]
-
-    # Output display objects for variables
-    for i, stock in enumerate(model_data.get("stocks", [])):
-        x = stock_start_x + (i % 4) * grid_spacing_x
-        y = stock_start_y + (i // 4) * grid_spacing_y
-        stock_positions[stock["name"]] = (x, y)
-        var_positions[stock["name"]] = (x, y)
-        attribs = {
-            "x": str(stock.get("x", str(x))),
-            "y": str(stock.get("y", str(y))),
-            "name": stock["name"]
-        }
-        ET.SubElement(view, "stock", attrib=attribs)
-
-    for i, flow in enumerate(model_data.get("flows", [])):
-        name = flow["name"]
-
-        # Try to find connected stocks
-        from_stock = next((s["name"] for s in model_data["stocks"] if name in s.get("outflows", [])), None)
-        to_stock = next((s["name"] for s in model_data["stocks"] if name in s.get("inflows", [])), None)
-
-        if from_stock and to_stock:
-            x1, y1 = stock_positions[from_stock]
-            x2, y2 = stock_positions[to_stock]
-            x = (x1 + x2) // 2
-            y = (y1 + y2) // 2
-        elif to_stock:
-            x, y = stock_positions[to_stock]
-            x -= 100
-        elif from_stock:
-            x, y = stock_positions[from_stock]
-            x += 100
-        else:
-            x = 100 + (i * 150)
-            y = 500
-
-        flow_positions[name] = (x, y)
-        var_positions[name] = (x, y)
-
-        attribs = {
-            "x": str(flow.get("x", str(x))),
-            "y": str(flow.get("y", str(y))),
-            "name": flow["name"]
-        }
-        # ET.SubElement(view, "flow", attrib=attribs)
-        flow_view = ET.SubElement(view, "flow", attrib=attribs)
-        # Generate <pts> in view as well using the same rule:
-        try:
-            flow_x = float(flow.get("x", str(x)))
-        except ValueError:
-            flow_x = 0.0
-        flow_y = flow.get("y", str(y))
-        pts_el = ET.SubElement(flow_view, "pts")
-        ET.SubElement(pts_el, "pt", attrib={"x": str(flow_x - 60), "y": str(flow_y)})
-        ET.SubElement(pts_el, "pt", attrib={"x": str(flow_x + 60), "y": str(flow_y)})
-
-    aux_indices = {}
-    for i, aux in enumerate(model_data.get("auxiliaries", [])):
-        name = aux["name"]
-
-        # Find what this auxiliary connects to
-        target = next((c["tgt"] for c in model_data.get("connectors", []) if c["src"] == name), None)
-        base_x, base_y = var_positions.get(target, (100 + (i * 200), 700))
-
-        # Offset for visual clarity
-        offset = aux_indices.get(target, 0)
-        x = base_x
-        y = base_y - 100 - (offset * 30)
-        aux_indices[target] = offset + 1
-
-        aux_positions[name] = (x, y)
-        var_positions[name] = (x, y)
-
-        attribs = {
-            "x": str(aux.get("x", str(x))),
-            "y": str(aux.get("y", str(y))),
-            "name": aux["name"]
-        }
-        ET.SubElement(view, "aux", attrib=attribs)
-
-    # Write the XMILE file
-    tree = ET.ElementTree(xmile)
-    tree.write(filename, encoding="utf-8", xml_declaration=True)
-
-def print_summary(model_data):
-    """
-    Prints a summary of the model data, including the number of stocks, flows,
-    and auxiliary variables, as well as their names.
-    """
-    stocks = model_data.get("stocks", [])
-    flows = model_data.get("flows", [])
-    auxiliaries = model_data.get("auxiliaries", [])
-    connectors = model_data.get("connectors", [])
-
-    print("\nModel Summary:")
-    print(f"Number of stocks: {len(stocks)}")
-    print("Stocks:", ", ".join([stock["name"] for stock in stocks]))
-
-    print(f"\nNumber of flows: {len(flows)}")
-    print("Flows:", ", ".join([flow["name"] for flow in flows]))
-
-    print(f"\nNumber of auxiliary variables: {len(auxiliaries)}")
-    print("Auxiliaries:", ", ".join([aux["name"] for aux in auxiliaries]))
-
-    print(f"\nNumber of connectors: {len(connectors)}")
-
 def main():
     # Replace with the path to your stock and flow diagram image file.
     image_path = "YOUR_LOCAL_IMAGE_PATH"
+    if trace_file:
+        instrument.add_sink(instrument.JSONLinesSink(trace_file))
+        collected = instrument.add_sink(instrument.MemorySink())
     # Step 1: Choose the LLM API
-    choice_of_LLM = input("OpenAI or Gemini?").upper().strip()
-    model_data = extract_components_from_image(image_path, choice_of_LLM)
+    choice_of_LLM = input("OpenAI, Gemini, Hedged or Consensus?").upper().strip()
+    with instrument.span("extract", provider=choice_of_LLM):
+        model_data = extract_components_from_image(image_path, choice_of_LLM)
 
     print("Extracted model data:")
     print(json.dumps(model_data, indent=2))
 
     # Print summary of the extracted model data
     print_summary(model_data)
+    # Undefined names, algebraic loops and connectors that do not match the equations
+    print_issues(validate_model(model_data))
 
     # Step 2: Generate the XMILE file from the extracted model data
     timestamp = datetime.now().strftime("%m-%d")
-    xmile_filename = f"SD_Model_{choice_of_LLM}_{timestamp}.xmile"
-    generate_xmile(model_data, xmile_filename)
+    xmile_filename = output_filename(image_path, f"_SD_Model_{choice_of_LLM}_{timestamp}.xmile")
+    if diagram_layout:
+        from sdmodel.layout import apply_layout
+
+        model_data = apply_layout(model_data, diagram_layout, layout_seed)
+    with instrument.span("generate_xmile") as span:
+        generate_xmile(model_data, xmile_filename + ".tmp")
+        os.replace(xmile_filename + ".tmp", xmile_filename)
+        span.set(output_bytes=os.path.getsize(xmile_filename))
     print(f"XMILE file '{xmile_filename}' generated successfully!")
+    if trace_file:
+        instrument.print_summary(collected.records)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+"""
+Benchmark for equation cleaning in sdmodel.xmile.
+Compares the original per-name re.sub loop with the compiled cleaner on
+synthetic models of increasing size and checks that both give the same output.
+Exits with a non-zero status if they differ, or if the compiled cleaner is
+less than MIN_SPEEDUP times faster from 500 variables up.
+
+Run from the repository root:
+    python benchmarks/bench_clean_eqn.py
+"""
+import os
+import random
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sdmodel.xmile import compile_eqn_cleaner  # noqa: E402
+
+# Smallest speed-up allowed from 500 variables up (over a hundred times today)
+MIN_SPEEDUP = 10
+
+WORDS = ["Population", "Birth", "Death", "Rate", "Average", "Life", "Time", "Capital",
+         "Investment", "Labor", "Force", "Demand", "Supply", "Price", "Inventory", "Order"]
+
+
+def legacy_clean_eqn(eqn, variable_names):
+    """The original implementation: one re.sub per variable name."""
+    variable_names = sorted(variable_names, key=len, reverse=True)
+    for name in variable_names:
+        underscored = name.replace(" ", "_")
+        pattern = r'\b' + re.escape(name) + r'\b'
+        eqn = re.sub(pattern, underscored, eqn)
+    return eqn
+
+
+def synthetic_names(n, rng):
+    names = set()
+    while len(names) < n:
+        words = rng.sample(WORDS, rng.randint(2, 3))
+        names.add(" ".join(words) + f" {len(names)}")
+    return list(names)
+
+
+def synthetic_equations(names, rng):
+    ops = [" + ", " - ", " * ", " / "]
+    eqns = []
+    for _ in names:
+        terms = rng.sample(names, min(len(names), rng.randint(2, 4)))
+        eqns.append("".join(term + rng.choice(ops) for term in terms) + "1")
+    return eqns
+
+
+def main():
+    rng = random.Random(42)
+    failed = False
+    print(f"{'variables':>10} {'legacy (s)':>12} {'compiled (s)':>13} {'speed-up':>9}")
+    for n in [100, 500, 1000, 2000, 5000]:
+        names = synthetic_names(n, rng)
+        eqns = synthetic_equations(names, rng)
+
+        # The legacy loop is quadratic, so time it on a sample and extrapolate for large models
+        sample = eqns[:min(len(eqns), 200)]
+        t0 = time.perf_counter()
+        expected = [legacy_clean_eqn(e, names) for e in sample]
+        legacy = (time.perf_counter() - t0) * len(eqns) / len(sample)
+
+        t0 = time.perf_counter()
+        clean = compile_eqn_cleaner(names)
+        cleaned = [clean(e) for e in eqns]
+        compiled = time.perf_counter() - t0
+
+        print(f"{n:>10} {legacy:>12.3f} {compiled:>13.4f} {legacy / compiled:>8.0f}x")
+        if cleaned[:len(sample)] != expected:
+            print("  THE COMPILED CLEANER OUTPUT DIFFERS FROM THE LEGACY LOOP")
+            failed = True
+        if n >= 500 and legacy / compiled < MIN_SPEEDUP:
+            print(f"  LESS THAN {MIN_SPEEDUP}x FASTER THAN THE LEGACY LOOP")
+            failed = True
+    if failed:
+        sys.exit("The compiled equation cleaner is wrong or not fast enough")
+
+
+if __name__ == "__main__":
+    main()
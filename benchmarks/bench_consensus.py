@@ -0,0 +1,178 @@
+"""
+Accuracy and latency of self-consistency sampling (sdmodel.consensus)
+against a single request, with fake providers in place of the APIs.
+
+Each fake answer is the true model (sdmodel.synthetic) read imperfectly:
+variables missed (with their connectors), names written in another case or
+with underscores, equations respaced, and made-up variables and connectors
+added. Latencies are lognormal. For each of a set of diagrams:
+
+    single      one request
+    serial      K requests one after another, then merged
+    parallel    K requests at once, waiting for all of them
+    early stop  K requests at once, stopping at the agreement threshold
+
+Precision and recall count the variables (by normalized name) and
+connectors of the result that are in the true model.
+
+Exits with a non-zero status if merging identical answers changes the
+model, if early stop is less accurate than a single request, or if it is
+not faster than waiting for every request.
+
+Run from the repository root:
+    python benchmarks/bench_consensus.py
+    python benchmarks/bench_consensus.py --samples 7 --threshold 0.8 --miss-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sdmodel.consensus import ConsensusExtractor, ConsensusMerger, normalize_name  # noqa: E402
+from sdmodel.model import CATEGORIES  # noqa: E402
+from sdmodel.synthetic import model_of_size  # noqa: E402
+
+
+class NoisyProvider:
+    """Answers with a noisy reading of `truth` after a lognormal delay."""
+
+    name = "FAKE"
+    model = "fake-model"
+    config = {}
+
+    def __init__(self, truth, rng, miss_rate, rename_rate, extra, latency):
+        self.truth = truth
+        self.rng = rng
+        self.miss_rate = miss_rate
+        self.rename_rate = rename_rate
+        self.extra = extra
+        self.latency = latency
+
+    def reading(self):
+        rng = self.rng
+        spelling = {}
+        model_data = {}
+        for _, category in CATEGORIES:
+            items = []
+            for item in self.truth[category]:
+                if rng.random() < self.miss_rate:
+                    continue
+                name = item["name"]
+                if rng.random() < self.rename_rate:
+                    name = rng.choice((name.lower(), name.replace(" ", "_"), name.upper()))
+                spelling[item["name"]] = name
+                item = dict(item, name=name)
+                if "eqn" in item and rng.random() < 0.2:
+                    item["eqn"] = item["eqn"].replace(" * ", "*")
+                items.append(item)
+            model_data[category] = items
+        for stock in model_data["stocks"]:
+            stock["inflows"] = [spelling.get(flow, flow) for flow in stock.get("inflows", [])]
+            stock["outflows"] = [spelling.get(flow, flow) for flow in stock.get("outflows", [])]
+        model_data["connectors"] = [dict(conn, src=spelling[conn["src"]], tgt=spelling[conn["tgt"]])
+                                    for conn in self.truth["connectors"]
+                                    if conn["src"] in spelling and conn["tgt"] in spelling]
+        names = [item["name"] for _, category in CATEGORIES for item in model_data[category]]
+        for i in range(self.extra):
+            made_up = f"Made Up Factor {rng.randrange(10 ** 6)}"
+            model_data["auxiliaries"].append({"name": made_up, "eqn": "0.5"})
+            model_data["connectors"].append({"src": made_up, "tgt": rng.choice(names)})
+            model_data["connectors"].append({"src": rng.choice(names), "tgt": rng.choice(names)})
+        return model_data
+
+    async def request(self, image_bytes, mime_type, prompt):
+        await asyncio.sleep(self.latency * self.rng.lognormvariate(0.0, 0.5))
+        return json.dumps(self.reading())
+
+
+def elements(model_data):
+    variables = {normalize_name(item["name"]) for _, category in CATEGORIES for item in model_data.get(category, [])}
+    connectors = {(normalize_name(c["src"]), normalize_name(c["tgt"])) for c in model_data.get("connectors", [])}
+    return variables | connectors
+
+
+def score(result, truth):
+    found, expected = elements(result), elements(truth)
+    right = len(found & expected)
+    return right / len(found) if found else 0.0, right / len(expected)
+
+
+async def run(method, truth, rng, args):
+    provider = NoisyProvider(truth, rng, args.miss_rate, args.rename_rate, args.extra, args.latency)
+    samples = 1 if method == "single" else args.samples
+    threshold = args.threshold if method == "early stop" else 2.0
+    started = time.perf_counter()
+    if method == "serial":
+        merger = ConsensusMerger()
+        extractor = ConsensusExtractor([provider], samples=1)
+        for _ in range(samples):
+            merger.add((await extractor.extract(b"image"))[0])
+        return merger.model_data(), time.perf_counter() - started, False
+    extractor = ConsensusExtractor([provider], samples=samples, threshold=threshold, min_samples=args.min_samples)
+    model_data, summary = await extractor.extract(b"image")
+    return model_data, time.perf_counter() - started, summary["stopped_early"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy and latency of self-consistency sampling.")
+    parser.add_argument("--diagrams", type=int, default=20, help="diagrams per method (default 20)")
+    parser.add_argument("--variables", type=int, default=40, help="variables per diagram (default 40)")
+    parser.add_argument("--samples", type=int, default=5, help="K, requests per diagram (default 5)")
+    parser.add_argument("--threshold", type=float, default=0.9, help="agreement to stop at (default 0.9)")
+    parser.add_argument("--min-samples", type=int, default=3, help="answers merged before stopping (default 3)")
+    parser.add_argument("--miss-rate", type=float, default=0.02, help="share of variables an answer misses")
+    parser.add_argument("--rename-rate", type=float, default=0.1, help="share of names written differently")
+    parser.add_argument("--extra", type=int, default=1, help="made-up variables per answer (default 1)")
+    parser.add_argument("--latency", type=float, default=0.2, help="median latency in seconds (default 0.2)")
+    args = parser.parse_args()
+
+    failed = False
+    truth = model_of_size(args.variables, seed=0)
+    merger = ConsensusMerger()
+    for _ in range(3):
+        merger.add(truth)
+    merged = merger.model_data()
+    for _, category in CATEGORIES:
+        for item in merged[category]:
+            item.pop("confidence")
+    for conn in merged["connectors"]:
+        conn.pop("confidence")
+    if merged != truth:
+        print("MERGING IDENTICAL ANSWERS CHANGED THE MODEL")
+        failed = True
+
+    print(f"{args.diagrams} diagrams of {args.variables} variables, K = {args.samples}, "
+          f"threshold {args.threshold}, median latency {args.latency} s")
+    print(f"{'method':>11} {'precision':>10} {'recall':>7} {'latency (s)':>12} {'stopped early':>14}")
+    results = {}
+    for method in ("single", "serial", "parallel", "early stop"):
+        rng = random.Random(1)
+        precision = recall = seconds = stopped = 0.0
+        for i in range(args.diagrams):
+            truth = model_of_size(args.variables, seed=i)
+            model_data, elapsed, early = asyncio.run(run(method, truth, rng, args))
+            p, r = score(model_data, truth)
+            precision, recall, seconds, stopped = precision + p, recall + r, seconds + elapsed, stopped + early
+        n = args.diagrams
+        results[method] = (precision / n, recall / n, seconds / n)
+        print(f"{method:>11} {precision / n:>10.3f} {recall / n:>7.3f} {seconds / n:>12.3f} {stopped / n:>14.0%}")
+
+    single, parallel, early = results["single"], results["parallel"], results["early stop"]
+    if early[0] + early[1] < single[0] + single[1]:
+        print("  EARLY STOP IS LESS ACCURATE THAN A SINGLE REQUEST")
+        failed = True
+    if early[2] >= parallel[2]:
+        print("  EARLY STOP IS NOT FASTER THAN WAITING FOR EVERY REQUEST")
+        failed = True
+    if failed:
+        sys.exit("Consensus sampling changed identical answers, lost accuracy or saved no time")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Bytes saved and encode time of the image preprocessing stage (sdmodel.images).
+
+Without arguments, a few synthetic diagram scans are drawn with Pillow; pass
+image files to measure your own diagrams instead. Each image is encoded with
+every output format.
+
+A 16-bit grayscale scan is also preprocessed; the script exits with a
+non-zero status if it comes out (almost) all white, as it does when the
+high bit depth is clipped instead of scaled.
+
+Run from the repository root:
+    python benchmarks/bench_image_preprocess.py [image ...]
+"""
+import io
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sdmodel.images import MIME_TYPES, PREPROCESS, preprocess_image  # noqa: E402
+
+
+def synthetic_diagram(width, height, n_boxes, seed=0):
+    """A scanned-looking stock and flow diagram: boxes, arrows and labels on a noisy background."""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    image = Image.effect_noise((width, height), 12).point(lambda v: 235 + v // 16).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    centres = []
+    for i in range(n_boxes):
+        x, y = rng.randrange(100, width - 400), rng.randrange(100, height - 200)
+        draw.rectangle([x, y, x + 300, y + 150], outline=(20, 20, 120), width=6)
+        draw.text((x + 20, y + 60), f"Stock {i}", fill=(0, 0, 0))
+        centres.append((x + 150, y + 75))
+    for (x0, y0), (x1, y1) in zip(centres, centres[1:]):
+        draw.line([x0, y0, x1, y1], fill=(160, 30, 30), width=4)
+    output = io.BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+def gradient_16_bit(width, height):
+    """A 16-bit grayscale ("I;16") PNG, dark to light from left to right."""
+    from PIL import Image
+
+    row = [round(x * 65535 / (width - 1)) for x in range(width)]
+    image = Image.new("I;16", (width, height))
+    image.putdata(row * height)
+    output = io.BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+def white_share(image_bytes):
+    from PIL import Image
+
+    histogram = Image.open(io.BytesIO(image_bytes)).convert("L").histogram()
+    return histogram[255] / sum(histogram)
+
+
+def main():
+    if len(sys.argv) > 1:
+        images = []
+        for path in sys.argv[1:]:
+            with open(path, "rb") as f:
+                images.append((os.path.basename(path), f.read()))
+    else:
+        images = [(f"synthetic {w}x{h}", synthetic_diagram(w, h, n)) for w, h, n in
+                  [(2000, 1500, 10), (6000, 4000, 40), (9000, 6000, 80)]]
+
+    print(f"{'image':>22} {'format':>6} {'input (MB)':>11} {'output (MB)':>12} {'saved':>7} {'encode (s)':>11}")
+    for label, data in images:
+        for format in MIME_TYPES:
+            started = time.perf_counter()
+            output, mime_type = preprocess_image(data, **{**PREPROCESS, "format": format})
+            elapsed = time.perf_counter() - started
+            saved = 1 - len(output) / len(data)
+            print(f"{label[:22]:>22} {format:>6} {len(data) / 1e6:>11.2f} {len(output) / 1e6:>12.3f} "
+                  f"{saved:>7.1%} {elapsed:>11.2f}")
+
+    failed = False
+    print()
+    for format in MIME_TYPES:
+        output, _ = preprocess_image(gradient_16_bit(3000, 200), **{**PREPROCESS, "format": format})
+        white = white_share(output)
+        print(f"16-bit gradient {format:>4}: {white:.1%} white")
+        if white > 0.5:
+            print("  THE 16-BIT IMAGE WAS CLIPPED")
+            failed = True
+    if failed:
+        sys.exit("A 16-bit grayscale image was clipped to white")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Import-time budget for the XMILE core and the two scripts.
+
+Each target is imported in a fresh interpreter with `python -X importtime`.
+The self time of every module that a bare interpreter does not already load
+is added up, and the best of several runs is reported. A target can name a
+baseline of standard library imports it cannot do without (asyncio for the
+extraction pipeline); the modules the baseline loads are left out too, so
+the budget covers this repository's code and does not fail on a slow machine. The check fails (non-zero
+exit status) if a target goes over its budget or pulls in one of the heavy
+provider modules (openai, google.genai, PIL, numpy, httpx) at import time.
+
+Run from the repository root:
+    python benchmarks/bench_import_time.py [--runs 5] [--scale 1.0]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be loaded on first use
+HEAVY_MODULES = ("openai", "google", "PIL", "numpy", "httpx")
+
+_LOAD_SCRIPT = (
+    "import importlib.util as u; s = u.spec_from_file_location('script', {path!r}); "
+    "s.loader.exec_module(u.module_from_spec(s))"
+)
+
+# (label, code run with -X importtime, baseline code whose modules are not counted, budget in milliseconds)
+TARGETS = [
+    ("sdmodel.xmile", "import sdmodel.xmile", "pass", 50),
+    ("sdmodel.extraction", "import sdmodel.extraction", "import asyncio", 60),
+    ("JSON to XMILE.py", _LOAD_SCRIPT.format(path=os.path.join(ROOT, "JSON to XMILE.py")), "pass", 80),
+    ("SD Model Image Identification (API).py",
+     _LOAD_SCRIPT.format(path=os.path.join(ROOT, "SD Model Image Identification (API).py")), "pass", 80),
+]
+
+
+def import_times(code):
+    """Returns {module: self time in microseconds} for the imports made while running `code`."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(self_us)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="runs per target, the best one counts (default 5)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply every budget, e.g. for slow machines")
+    args = parser.parse_args()
+
+    baselines = {}
+    failed = False
+    print(f"{'target':>40} {'import (ms)':>12} {'budget (ms)':>12}  heavy modules")
+    for label, code, baseline, budget in TARGETS:
+        if baseline not in baselines:
+            baselines[baseline] = set(import_times(baseline))
+        startup = baselines[baseline]
+        best = None
+        heavy = set()
+        for _ in range(args.runs):
+            times = import_times(code)
+            added = {name: us for name, us in times.items() if name not in startup}
+            heavy.update(name for name in added if name.split(".")[0] in HEAVY_MODULES)
+            total = sum(added.values()) / 1000
+            best = total if best is None else min(best, total)
+        limit = budget * args.scale
+        ok = best <= limit and not heavy
+        failed = failed or not ok
+        print(f"{label:>40} {best:>12.1f} {limit:>12.0f}  {', '.join(sorted(heavy)) or '-'}"
+              f"{'' if ok else '  FAILED'}{'' if baseline == 'pass' else f'  (beyond {baseline})'}")
+
+    if failed:
+        print("Import-time budget exceeded or heavy modules imported eagerly")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
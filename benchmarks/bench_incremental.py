@@ -0,0 +1,91 @@
+"""
+Incremental re-export (IncrementalExporter in sdmodel.xmile) against a full
+generate_xmile, on a synthetic 5,000-variable model. After a first export,
+the model is edited one way at a time (one equation, one stock position, one
+added inflow, one renamed auxiliary) and exported again. Every output must be
+byte-for-byte the file generate_xmile writes for the edited model. Exits with
+a non-zero status if an output differs or a one-equation edit is not at
+least 3x faster than a full export.
+
+Run from the repository root:
+    python benchmarks/bench_incremental.py
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_layout import synthetic_model  # noqa: E402
+from sdmodel.xmile import IncrementalExporter, generate_xmile  # noqa: E402
+
+
+def edit_equation(model_data):
+    model_data["flows"][10]["eqn"] = "Stock 3 * Rate 7 + 1"
+
+
+def move_stock(model_data):
+    model_data["stocks"][5]["x"] = 999
+
+
+def add_inflow(model_data):
+    model_data["stocks"][6]["inflows"].append("Flow 1")
+
+
+def rename_auxiliary(model_data):
+    model_data["auxiliaries"][0]["name"] = "Rate Zero"
+
+
+def best_of(func, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    model_data = synthetic_model(5000, random.Random(0))
+    failed = False
+    with tempfile.TemporaryDirectory() as tmp:
+        full_path = os.path.join(tmp, "full.xmile")
+        incremental_path = os.path.join(tmp, "incremental.xmile")
+        full = best_of(lambda: generate_xmile(model_data, full_path))
+        exporter = IncrementalExporter()
+        t0 = time.perf_counter()
+        exporter.export(model_data, incremental_path)
+        first = time.perf_counter() - t0
+        print(f"Full export {full * 1000:.1f} ms, first incremental export {first * 1000:.1f} ms")
+        print(f"{'edit':>18} {'export (ms)':>12} {'rebuilt':>8} {'reused':>8}  output")
+
+        speedup = None
+        for edit in [edit_equation, move_stock, add_inflow, rename_auxiliary]:
+            edit(model_data)
+            t0 = time.perf_counter()
+            stats = exporter.export(model_data, incremental_path)
+            elapsed = time.perf_counter() - t0
+            if edit is edit_equation:
+                # Repeat the unchanged export for a steadier time
+                elapsed = min(elapsed, best_of(lambda: exporter.export(model_data, incremental_path)))
+                speedup = full / elapsed
+            generate_xmile(model_data, full_path)
+            with open(full_path, "rb") as f, open(incremental_path, "rb") as g:
+                same = f.read() == g.read()
+            failed = failed or not same
+            print(f"{edit.__name__:>18} {elapsed * 1000:>12.1f} {stats['rebuilt']:>8} {stats['reused']:>8}"
+                  f"  {'identical' if same else 'DIFFERS'}")
+
+    print(f"One-equation edit is {speedup:.1f}x faster than a full export")
+    if failed:
+        sys.exit("Incremental export differs from a full export")
+    if speedup < 3:
+        sys.exit("Incremental export of a one-equation edit is not faster than a full export")
+
+
+if __name__ == "__main__":
+    main()
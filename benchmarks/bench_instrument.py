@@ -0,0 +1,178 @@
+"""
+Overhead and records of the instrumentation layer (sdmodel.instrument).
+
+1. The cost of a span with no sink registered, and with a MemorySink,
+   measured against an empty loop, and the cost of the least any hook can
+   do: calling a function that returns a do-nothing context manager.
+2. A batch of extractions through BatchExtractor (sdmodel.extraction) with a
+   fake provider that reports token usage and fails every third first
+   attempt with a connection error. The run is repeated with a MemorySink
+   and a JSONLinesSink, and the records are checked: one image, preprocess
+   and extract span per image, api_call spans nested under extract, the
+   retries and the tokens adding up.
+
+Exits with a non-zero status if a span costs more than MAX_DISABLED_RATIO
+times that do-nothing hook with instrumentation off, or if the records are
+wrong. Both costs are measured in the same run, so the check does not
+depend on the speed of the machine.
+
+Run from the repository root:
+    python benchmarks/bench_instrument.py [--scale 1.0]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sdmodel import instrument  # noqa: E402
+from sdmodel.extraction import BatchExtractor  # noqa: E402
+
+# How many times a do-nothing hook a span may cost while nothing is recording (about 1 today)
+MAX_DISABLED_RATIO = 2.0
+
+RESPONSE = json.dumps({"stocks": [{"name": "Population", "eqn": "100"}], "flows": [], "auxiliaries": [],
+                       "connectors": []})
+
+
+class FakeProvider:
+    """Answers after a short delay; the first request for every third image fails."""
+
+    name = "FAKE"
+    model = "fake-model"
+    config = {}
+
+    def __init__(self):
+        self.seen = set()
+
+    async def request(self, image_bytes, mime_type, prompt):
+        await asyncio.sleep(0.001)
+        if int.from_bytes(image_bytes[-2:], "big") % 3 == 0 and image_bytes not in self.seen:
+            self.seen.add(image_bytes)
+            raise ConnectionError("connection reset")
+        instrument.record_usage({"input_tokens": 800, "output_tokens": 120})
+        return RESPONSE
+
+
+class _DoNothing:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_DO_NOTHING = _DoNothing()
+
+
+def do_nothing_hook(name, **attrs):
+    return _DO_NOTHING
+
+
+def span_cost(n, span=instrument.span, repeats=5):
+    """Nanoseconds per `with span(...)` block beyond an empty loop, the best of several rounds."""
+    best = float("inf")
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            pass
+        empty = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for _ in range(n):
+            with span("stage", size=1):
+                pass
+        best = min(best, (time.perf_counter() - t0 - empty) / n * 1e9)
+    return best
+
+
+def run_batch(paths):
+    async def batch():
+        extractor = BatchExtractor(FakeProvider(), concurrency=16, cache=None, preprocess=None, backoff=0.001)
+        try:
+            return await extractor.extract_many(paths)
+        finally:
+            await extractor.aclose()
+
+    t0 = time.perf_counter()
+    results = asyncio.run(batch())
+    return results, time.perf_counter() - t0
+
+
+def check_records(records, n_images, failures):
+    """Returns a list of problems with the records of one batch."""
+    problems = []
+    by_name = {}
+    for record in records:
+        by_name.setdefault(record["name"], []).append(record)
+    for name in ("image", "preprocess", "extract", "parse"):
+        if len(by_name.get(name, [])) != n_images:
+            problems.append(f"{len(by_name.get(name, []))} '{name}' spans for {n_images} images")
+    calls = by_name.get("api_call", [])
+    if len(calls) != n_images + failures:
+        problems.append(f"{len(calls)} api_call spans, expected {n_images + failures}")
+    extract_ids = {record["id"] for record in by_name.get("extract", [])}
+    if any(record["parent"] not in extract_ids for record in calls):
+        problems.append("api_call spans are not nested in extract spans")
+    if sum(record["status"] == "error" for record in calls) != failures:
+        problems.append("failed api_call spans are not marked as errors")
+    retries = sum(record.get("retries", 0) for record in by_name.get("extract", []))
+    if retries != failures:
+        problems.append(f"{retries} retries recorded, expected {failures}")
+    tokens = sum(record.get("prompt_tokens", 0) for record in calls)
+    if tokens != 800 * n_images:
+        problems.append(f"{tokens} prompt tokens recorded, expected {800 * n_images}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Overhead and records of the instrumentation layer.")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the allowed ratio, e.g. on noisy machines")
+    args = parser.parse_args()
+
+    failed = False
+    n = 200_000
+    hook = span_cost(n, do_nothing_hook)
+    disabled = span_cost(n)
+    with instrument.recording():
+        enabled = span_cost(n, repeats=1)
+    limit = MAX_DISABLED_RATIO * args.scale
+    print(f"Span cost: {disabled:.0f} ns with instrumentation off ({disabled / hook:.2f}x a do-nothing hook of "
+          f"{hook:.0f} ns), {enabled:.0f} ns recording to memory")
+    if disabled > limit * hook:
+        print(f"  DISABLED SPANS COST MORE THAN {limit:g}x A DO-NOTHING HOOK")
+        failed = True
+
+    n_images = 300
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for i in range(n_images):
+            path = os.path.join(tmp, f"diagram{i}.png")
+            with open(path, "wb") as f:
+                f.write(b"\x89PNG\r\n\x1a\n" + i.to_bytes(2, "big"))
+            paths.append(path)
+        failures = sum(1 for i in range(n_images) if i % 3 == 0)
+
+        _, off = run_batch(paths)
+        trace = os.path.join(tmp, "trace.jsonl")
+        with instrument.recording(instrument.MemorySink(), instrument.JSONLinesSink(trace)) as sink:
+            results, on = run_batch(paths)
+        print(f"{n_images} extractions: {off:.3f} s with instrumentation off, {on:.3f} s recording")
+        errors = [r["error"] for r in results if r["error"]]
+        problems = check_records(sink.records, n_images, failures) + errors
+        if instrument.load(trace) != json.loads(json.dumps(sink.records)):
+            problems.append("the JSON lines file does not hold the same records")
+        instrument.print_summary(sink.records)
+
+    for problem in problems:
+        print(f"  {problem}")
+    if failed or problems:
+        sys.exit("Instrumentation is too slow when disabled or recorded the wrong spans")
+
+
+if __name__ == "__main__":
+    main()
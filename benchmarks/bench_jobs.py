@@ -0,0 +1,181 @@
+"""
+Throughput and recovery of the resumable job runner (sdmodel.jobs), with a
+fake provider in place of the API:
+
+1. A batch of images through 3 worker processes: every image must be done,
+   claimed once, and have its JSON and XMILE file (and no temporary file).
+2. A worker process that dies in the middle of a batch with jobs in flight,
+   then a second run on the same queue: it must extract only the images the
+   first run did not finish, taking over the crashed worker's jobs once their
+   lease runs out.
+3. 4 processes claiming one job at a time from the same queue as fast as
+   they can: no job may be claimed twice.
+
+Exits with a non-zero status if any check fails.
+
+Run from the repository root:
+    python benchmarks/bench_jobs.py
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sdmodel.jobs import DONE, JobQueue, run_jobs, worker_name  # noqa: E402
+
+RESPONSE = json.dumps({"stocks": [{"name": "Population", "eqn": "100", "inflows": ["Births"], "outflows": []}],
+                       "flows": [{"name": "Births", "eqn": "Population * Birth Rate"}],
+                       "auxiliaries": [{"name": "Birth Rate", "eqn": "0.05"}],
+                       "connectors": [{"src": "Birth Rate", "tgt": "Births"}]})
+
+# Requests the crashing provider answers before its process exits
+CRASH_AFTER = 60
+
+
+class FakeProvider:
+    """Answers every image after a short delay and counts its requests."""
+
+    name = "FAKE"
+    model = "fake-model"
+    config = {}
+
+    def __init__(self):
+        self.requests = 0
+
+    async def request(self, image_bytes, mime_type, prompt):
+        self.requests += 1
+        await asyncio.sleep(0.002)
+        return RESPONSE
+
+
+class CrashingProvider(FakeProvider):
+    """Kills its process, with requests still in flight, after CRASH_AFTER answers."""
+
+    async def request(self, image_bytes, mime_type, prompt):
+        if self.requests == CRASH_AFTER:
+            os._exit(1)
+        return await super().request(image_bytes, mime_type, prompt)
+
+
+def make_images(directory, n):
+    os.makedirs(directory)
+    paths = []
+    for i in range(n):
+        path = os.path.join(directory, f"diagram{i}.png")
+        with open(path, "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\n" + i.to_bytes(4, "big"))
+        paths.append(path)
+    return paths
+
+
+def check_outputs(queue_path, output_dir, n):
+    problems = []
+    queue = JobQueue(queue_path)
+    jobs = queue.jobs()
+    done = [job for job in jobs if job["state"] == DONE]
+    if len(done) != n:
+        problems.append(f"{len(done)} of {n} jobs done")
+    for job in done:
+        if not (job["json_path"] and os.path.exists(job["json_path"]) and os.path.exists(job["xmile_path"])):
+            problems.append(f"missing output for {job['image']}")
+            break
+        with open(job["json_path"]) as f:
+            if json.load(f) != queue.model_data(job["image"]):
+                problems.append(f"JSON file and queue disagree for {job['image']}")
+                break
+    queue.close()
+    if any(name.endswith(".tmp") for name in os.listdir(output_dir)):
+        problems.append("temporary files left in the output directory")
+    return problems, jobs
+
+
+def crash_run(queue_path, output_dir):
+    run_jobs(queue_path, (), output_dir, CrashingProvider, concurrency=8, use_cache=False, preprocess=None,
+             verbose=False)
+
+
+def claim_all(queue_path):
+    queue = JobQueue(queue_path)
+    worker = worker_name()
+    claimed = []
+    while True:
+        jobs = queue.claim(worker, 1)
+        if not jobs:
+            break
+        claimed.append(jobs[0]["image"])
+    queue.close()
+    return claimed
+
+
+def main():
+    problems = []
+    with tempfile.TemporaryDirectory() as tmp:
+        # 1. A clean run with several worker processes
+        n = 600
+        paths = make_images(os.path.join(tmp, "images"), n)
+        queue_path = os.path.join(tmp, "out", "jobs.sqlite3")
+        t0 = time.perf_counter()
+        run_jobs(queue_path, paths, os.path.join(tmp, "out"), FakeProvider, workers=3, concurrency=8,
+                 use_cache=False, preprocess=None, verbose=False)
+        seconds = time.perf_counter() - t0
+        found, jobs = check_outputs(queue_path, os.path.join(tmp, "out"), n)
+        if any(job["attempts"] != 1 for job in jobs):
+            found.append("some images were claimed more than once")
+        print(f"{n} images, 3 workers: {seconds:.2f} s ({n / seconds:.0f} images/s)")
+        problems += found
+
+        # 2. A worker that crashes, then a resumed run
+        queue_path = os.path.join(tmp, "resume", "jobs.sqlite3")
+        output_dir = os.path.join(tmp, "resume")
+        queue = JobQueue(queue_path)
+        queue.add(paths)
+        queue.close()
+        process = multiprocessing.Process(target=crash_run, args=(queue_path, output_dir))
+        process.start()
+        process.join()
+        queue = JobQueue(queue_path)
+        counts = queue.counts()
+        queue.close()
+        print(f"Crashed worker: exit code {process.exitcode}, {counts[DONE]} done, "
+              f"{counts['in_flight']} left in flight")
+        if counts["in_flight"] == 0:
+            problems.append("the crashed worker left no jobs in flight")
+
+        provider = FakeProvider()
+        t0 = time.perf_counter()
+        run_jobs(queue_path, paths, output_dir, lambda: provider, concurrency=8, use_cache=False, preprocess=None,
+                 lease=0.5, verbose=False)
+        print(f"Resumed run: {provider.requests} requests in {time.perf_counter() - t0:.2f} s")
+        if provider.requests != n - counts[DONE]:
+            problems.append(f"the resumed run made {provider.requests} requests, expected {n - counts[DONE]}")
+        problems += check_outputs(queue_path, output_dir, n)[0]
+
+        # 3. Racing claims from several processes
+        queue_path = os.path.join(tmp, "race.sqlite3")
+        queue = JobQueue(queue_path)
+        queue.add(f"image{i}.png" for i in range(2000))
+        queue.close()
+        t0 = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=4) as pool:
+            claimed = [image for batch in pool.map(claim_all, [queue_path] * 4) for image in batch]
+        seconds = time.perf_counter() - t0
+        print(f"4 processes claimed {len(claimed)} jobs one at a time in {seconds:.2f} s "
+              f"({len(claimed) / seconds:.0f} claims/s), {len(claimed) - len(set(claimed))} twice")
+        if len(claimed) != 2000 or len(set(claimed)) != 2000:
+            problems.append("jobs were claimed twice or not at all")
+
+    for problem in problems:
+        print(f"  {problem}")
+    if problems:
+        sys.exit("The job runner lost, repeated or half-wrote jobs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Peak memory and time of converting large JSON model files to XMILE:
+
+    load        json.load of the whole file, then generate_xmile(streaming=True)
+    model       read_model(streaming=True) (sdmodel.model), then generate_xmile(streaming=True)
+    stream      write_xmile_from_json (sdmodel.xmile), two passes over the file
+
+and the speed of the incremental parser (sdmodel.jsonstream) with and
+without batch decoding. The files are synthetic models (sdmodel.synthetic)
+with a paragraph of description per variable, as merged models have.
+
+Exits with a non-zero status if the streamed conversion writes a different
+file or takes more memory than loading the whole file, or if the parser
+gives a different result for a small model split in two at any offset.
+
+Run from the repository root:
+    python benchmarks/bench_json_stream.py
+    python benchmarks/bench_json_stream.py --sizes 200000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sdmodel import jsonstream  # noqa: E402
+from sdmodel.jsonstream import ModelStreamParser, stream_items  # noqa: E402
+from sdmodel.model import read_model  # noqa: E402
+from sdmodel.synthetic import model_of_size  # noqa: E402
+from sdmodel.xmile import generate_xmile, write_xmile_from_json  # noqa: E402
+
+SIZES = [5000, 30000]
+
+DESCRIPTION = ("Counts the people in this part of the model; it is fed by the flows listed in the model and "
+               "drained by the others, with the rates taken from the survey data of the sector. ") * 2
+
+
+def convert_load(json_filename, xmile_filename):
+    with open(json_filename, "r") as f:
+        model_data = json.load(f)
+    generate_xmile(model_data, xmile_filename, streaming=True)
+
+
+def convert_model(json_filename, xmile_filename):
+    generate_xmile(read_model(json_filename, streaming=True), xmile_filename, streaming=True)
+
+
+def convert_stream(json_filename, xmile_filename):
+    write_xmile_from_json(json_filename, xmile_filename)
+
+
+METHODS = {"load": convert_load, "model": convert_model, "stream": convert_stream}
+
+
+def peak_memory(func, *args):
+    gc.collect()
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def best_time(func, *args, repeats=3):
+    best = float("inf")
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def parse_all(json_filename):
+    for _ in stream_items(json_filename):
+        pass
+
+
+def split_failures(model_data):
+    """Offsets where feeding the JSON text in two pieces does not give model_data back."""
+    text = json.dumps(model_data)
+    failures = []
+    for offset in range(1, len(text)):
+        parser = ModelStreamParser()
+        try:
+            parser.feed(text[:offset])
+            parser.feed(text[offset:])
+            if parser.close() != model_data:
+                failures.append(offset)
+        except ValueError:
+            failures.append(offset)
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak memory and time of streamed JSON to XMILE conversion.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="model sizes in variables")
+    args = parser.parse_args()
+
+    try:
+        import orjson  # noqa: F401
+        backend = "orjson"
+    except ImportError:
+        backend = "json"
+    failed = False
+    # Numbers such as 1.25 and 2.5e3 can be cut after their "." or "e" by a piece boundary
+    model_data = dict(model_of_size(8, seed=2), version=1.25, scale=-2.5e3)
+    model_data["stocks"][0]["x"] = 12.75
+    failures = split_failures(model_data)
+    print(f"parser split at every offset of a {len(json.dumps(model_data))}-character model: "
+          f"{len(failures)} failures")
+    if failures:
+        print(f"  DIFFERENT RESULT WHEN SPLIT AT OFFSETS {failures[:10]}")
+        failed = True
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.sizes:
+            model_data = model_of_size(n, seed=1)
+            for category in ("stocks", "flows", "auxiliaries"):
+                for item in model_data[category]:
+                    item["description"] = DESCRIPTION
+            json_filename = os.path.join(tmp, "model.json")
+            with open(json_filename, "w") as f:
+                json.dump(model_data, f, indent=2)
+            del model_data
+            megabytes = os.path.getsize(json_filename) / 1e6
+            print(f"\n{n} variables, {megabytes:.1f} MB of JSON")
+            print(f"{'method':>8} {'peak (MB)':>10} {'time (s)':>9}")
+
+            outputs = {}
+            for name, func in METHODS.items():
+                xmile_filename = os.path.join(tmp, name + ".xmile")
+                peak = peak_memory(func, json_filename, xmile_filename)
+                seconds = best_time(func, json_filename, xmile_filename)
+                with open(xmile_filename, "rb") as f:
+                    outputs[name] = f.read()
+                print(f"{name:>8} {peak / 1e6:>10.1f} {seconds:>9.2f}")
+                if name == "load":
+                    load_peak = peak
+                elif name == "stream" and peak > load_peak:
+                    print("  THE STREAMED CONVERSION TAKES MORE MEMORY THAN LOADING THE FILE")
+                    failed = True
+            if len(set(outputs.values())) != 1:
+                print("  THE XMILE FILES DIFFER")
+                failed = True
+
+            batched = best_time(parse_all, json_filename)
+            batch_chars = jsonstream.BATCH_CHARS
+            jsonstream.BATCH_CHARS = float("inf")
+            try:
+                single = best_time(parse_all, json_filename)
+            finally:
+                jsonstream.BATCH_CHARS = batch_chars
+            print(f"parser: {megabytes / batched:.0f} MB/s batched ({backend}), {megabytes / single:.0f} MB/s "
+                  f"entry by entry")
+    if failed:
+        sys.exit("The streamed conversion is larger than loading the file or writes a different file, "
+                 "or the parser depends on where the text is split")
+
+
+if __name__ == "__main__":
+    main()
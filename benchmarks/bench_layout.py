@@ -0,0 +1,73 @@
+"""
+Scaling check for XMILE export in sdmodel.xmile.
+Converts synthetic models of increasing size and reports the time per variable.
+The view layout used to rescan every stock for each flow and every connector for
+each auxiliary; with the model index the time per variable should stay flat.
+Exits with a non-zero status if the largest model is more than 3x slower per
+variable than the smallest one, or if any model takes more than the budget of
+MAX_US_PER_VARIABLE microseconds per variable.
+
+Run from the repository root:
+    python benchmarks/bench_layout.py [--scale 1.0]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sdmodel.xmile import generate_xmile  # noqa: E402
+
+# Export time budget per variable, about four times what a current laptop takes
+MAX_US_PER_VARIABLE = 200
+
+
+def synthetic_model(n, rng):
+    """A model with n/4 stocks, n/4 flows and n/2 auxiliaries, each auxiliary feeding a flow."""
+    n_stocks = max(1, n // 4)
+    n_flows = max(1, n // 4)
+    stocks = [{"name": f"Stock {i}", "eqn": "100", "inflows": [], "outflows": []} for i in range(n_stocks)]
+    flows = [{"name": f"Flow {i}", "eqn": f"Stock {i % n_stocks} * Rate {i}"} for i in range(n_flows)]
+    auxiliaries = [{"name": f"Rate {i}", "eqn": "0.05"} for i in range(n - n_stocks - n_flows)]
+    connectors = []
+    for i, flow in enumerate(flows):
+        rng.choice(stocks)["outflows"].append(flow["name"])
+        rng.choice(stocks)["inflows"].append(flow["name"])
+        connectors.append({"src": f"Stock {i % n_stocks}", "tgt": flow["name"]})
+    for aux in auxiliaries:
+        connectors.append({"src": aux["name"], "tgt": rng.choice(flows)["name"]})
+    return {"stocks": stocks, "flows": flows, "auxiliaries": auxiliaries, "connectors": connectors}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaling check for XMILE export.")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the budget, e.g. for slow machines")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    sizes = [1000, 4000, 16000]
+    per_variable = []
+    budget = MAX_US_PER_VARIABLE * args.scale
+    print(f"{'variables':>10} {'export (s)':>11} {'us/variable':>12} {'budget':>7}")
+    for n in sizes:
+        model_data = synthetic_model(n, rng)
+        t0 = time.perf_counter()
+        generate_xmile(model_data, os.devnull)
+        elapsed = time.perf_counter() - t0
+        per_variable.append(elapsed / n)
+        print(f"{n:>10} {elapsed:>11.3f} {elapsed / n * 1e6:>12.1f} {budget:>7.0f}"
+              f"{'' if elapsed / n * 1e6 <= budget else '  OVER BUDGET'}")
+
+    growth = per_variable[-1] / per_variable[0]
+    print(f"Per-variable cost grew {growth:.2f}x over a {sizes[-1] // sizes[0]}x larger model")
+    if growth > 3:
+        sys.exit("Export time is growing faster than linearly")
+    if max(per_variable) * 1e6 > budget:
+        sys.exit(f"Export time is over the budget of {budget:.0f} us per variable")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Diagram layout engines (sdmodel.layout) on synthetic models of up to 10,000
+variables. For every engine the time, the number of overlapping objects
+before and after, and the diagram size are reported, and the layout is
+computed twice with the same seed. Exits with a non-zero status if a layout
+has overlaps, differs between the two runs, or takes longer than
+TIME_BUDGET seconds.
+
+Run from the repository root:
+    python benchmarks/bench_layout_engine.py
+"""
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_layout import synthetic_model  # noqa: E402
+from sdmodel.model import CATEGORIES  # noqa: E402
+from sdmodel.layout import LAYOUTS, compute_layout, count_overlaps, grid_layout  # noqa: E402
+
+# Seconds allowed for the largest model
+TIME_BUDGET = 10.0
+
+
+def main():
+    failed = False
+    print(f"{'variables':>10} {'method':>8} {'layout (s)':>11} {'overlaps':>9} {'after':>6} {'size (px)':>16}"
+          f"  deterministic")
+    for n in [1000, 10000]:
+        model_data = synthetic_model(n, random.Random(0))
+        kinds = {item["name"]: kind for kind, category in CATEGORIES for item in model_data[category]}
+        before = count_overlaps(grid_layout(model_data), kinds)
+        for method in LAYOUTS:
+            t0 = time.perf_counter()
+            positions = compute_layout(model_data, method, seed=1)
+            elapsed = time.perf_counter() - t0
+            same = compute_layout(model_data, method, seed=1) == positions
+            after = count_overlaps(positions, kinds)
+            xs = [x for x, _ in positions.values()]
+            ys = [y for _, y in positions.values()]
+            size = f"{max(xs) - min(xs)}x{max(ys) - min(ys)}"
+            failed = failed or after > 0 or not same or elapsed > TIME_BUDGET
+            print(f"{n:>10} {method:>8} {elapsed:>11.2f} {before:>9} {after:>6} {size:>16}  {'yes' if same else 'NO'}"
+                  f"{'  OVER BUDGET' if elapsed > TIME_BUDGET else ''}")
+
+    if failed:
+        sys.exit("A layout overlaps, is not deterministic or is too slow")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Load test of the extraction pipeline against the local mock API server
+(sdmodel.mockserver): throughput and tail latency of extraction followed by
+generate_xmile, at several levels of concurrency.
+
+For each concurrency level, that many clients send the same image over and
+over (a closed loop) through one BatchExtractor with the real provider
+client, retries and backoff, until --requests images have been converted.
+The latency of an image covers every attempt, the backoff in between and the
+XMILE export. The server answers with synthetic models and, at the given
+rates, with 429s, 500/503s, fenced text and malformed JSON.
+
+Exits with a non-zero status if more than --max-failure-rate of the images
+fail at any level. Needs the openai package (or google-genai for
+--provider gemini) and exits with the pip command to run when it is missing.
+
+Run from the repository root:
+    python benchmarks/bench_load.py
+    python benchmarks/bench_load.py --provider gemini --stream --concurrency 8 32 128 --requests 1000
+    python benchmarks/bench_load.py --latency uniform:0.2,2 --rate-limit-rate 0.2 --output load.json
+"""
+import argparse
+import asyncio
+import importlib.util
+import io
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sdmodel.extraction import PROVIDERS, BatchExtractor  # noqa: E402
+from sdmodel.mockserver import MockLLMServer  # noqa: E402
+from sdmodel.xmile import generate_xmile  # noqa: E402
+
+# The server does not look at the image, so every request sends the same small one
+IMAGE = b"\x89PNG\r\n\x1a\n" + bytes(4096)
+
+# SDK module and pip package of each provider's client
+SDKS = {"OPENAI": ("openai", "openai"), "GEMINI": ("google.genai", "google-genai")}
+
+
+def sdk_installed(provider_name):
+    module = SDKS[provider_name][0]
+    try:
+        return importlib.util.find_spec(module) is not None
+    except ImportError:
+        # The parent package ("google") is missing
+        return False
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+async def run_level(provider_name, base_url, concurrency, requests, streaming, max_retries):
+    """Converts `requests` images with `concurrency` clients; returns latencies, attempts and errors."""
+    provider = PROVIDERS[provider_name]("mock-key", base_url=base_url)
+    extractor = BatchExtractor(provider, concurrency=concurrency, max_retries=max_retries, backoff=0.05,
+                               max_backoff=1.0, cache=None, preprocess=None, streaming=streaming)
+    latencies, attempts, errors = [], [], {}
+    remaining = requests
+
+    async def client():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                model_data, tries = await extractor.extract(IMAGE, "image/png")
+                generate_xmile(model_data, io.BytesIO())
+            except Exception as e:
+                name = type(e).__name__
+                errors[name] = errors.get(name, 0) + 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            attempts.append(tries)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+    finally:
+        await extractor.aclose()
+    return time.perf_counter() - started, sorted(latencies), attempts, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--provider", type=str.upper, choices=sorted(PROVIDERS), default="OPENAI")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64],
+                        help="clients in flight at each level (default 1 4 16 64)")
+    parser.add_argument("--requests", type=int, default=200, help="images converted at each level (default 200)")
+    parser.add_argument("--stream", action="store_true", help="stream the responses")
+    parser.add_argument("--retries", type=int, default=5, help="retries per image (default 5)")
+    parser.add_argument("--latency", default="lognormal:0.3,0.5", help="server latency (see sdmodel.mockserver)")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--fenced-rate", type=float, default=0.1)
+    parser.add_argument("--malformed-rate", type=float, default=0.01)
+    parser.add_argument("--retry-after", type=float, default=0.1, help="Retry-After of the 429s (default 0.1 s)")
+    parser.add_argument("--model-size", type=int, default=30, help="variables per answer (default 30)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-failure-rate", type=float, default=0.05,
+                        help="highest share of failed images allowed at any level (default 0.05)")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    args = parser.parse_args()
+    # The driver uses the real client of the provider, so the SDK is needed even though nothing leaves the machine
+    if not sdk_installed(args.provider):
+        sys.exit(f"The {args.provider} client is not installed: pip install {SDKS[args.provider][1]} "
+                 f"(or pip install openai google-genai for both providers)")
+
+    server = MockLLMServer(latency=args.latency, rate_limit_rate=args.rate_limit_rate, error_rate=args.error_rate,
+                           fenced_rate=args.fenced_rate, malformed_rate=args.malformed_rate,
+                           retry_after=args.retry_after, model_size=args.model_size, seed=args.seed)
+    results = []
+    failed = False
+    print(f"{args.provider} {'streaming' if args.stream else 'non-streaming'}, server latency {args.latency}, "
+          f"{args.requests} images per level")
+    print(f"{'clients':>8} {'images/s':>9} {'p50 (s)':>8} {'p95 (s)':>8} {'p99 (s)':>8} {'max (s)':>8} "
+          f"{'retries':>8} {'failed':>7} {'max in flight':>14}")
+    with server.running():
+        base_url = server.openai_base_url if args.provider == "OPENAI" else server.gemini_base_url
+        for concurrency in args.concurrency:
+            server.reset_stats()
+            seconds, latencies, attempts, errors = asyncio.run(run_level(
+                args.provider, base_url, concurrency, args.requests, args.stream, args.retries))
+            failures = sum(errors.values())
+            result = {
+                "concurrency": concurrency, "images": args.requests, "seconds": seconds,
+                "throughput": len(latencies) / seconds, "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95), "p99": percentile(latencies, 99),
+                "max": latencies[-1] if latencies else float("nan"),
+                "retries": sum(attempts) - len(attempts), "failed": failures, "errors": errors,
+                "server": dict(server.stats),
+            }
+            results.append(result)
+            print(f"{concurrency:>8} {result['throughput']:>9.1f} {result['p50']:>8.3f} {result['p95']:>8.3f} "
+                  f"{result['p99']:>8.3f} {result['max']:>8.3f} {result['retries']:>8} {failures:>7} "
+                  f"{server.stats['max_in_flight']:>14}")
+            if errors:
+                print("         " + ", ".join(f"{name}: {count}" for name, count in sorted(errors.items())))
+            if failures > args.max_failure_rate * args.requests:
+                failed = True
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"provider": args.provider, "streaming": args.stream, "latency": args.latency,
+                       "results": results}, f, indent=2)
+    if failed:
+        sys.exit(f"More than {args.max_failure_rate:.0%} of the images failed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Memory and repeated work of model_data dictionaries against a loaded Model (sdmodel.model).
+
+1. Memory per variable of a model parsed from JSON and kept as dictionaries,
+   and of the same JSON loaded into a Model (the dictionaries are dropped).
+2. The work a script repeats on one model: a summary, the view layout and
+   two XMILE exports. Once from the dictionaries, which every call walks
+   again, and once from a Model loaded at the start (the load is included in
+   its time). Both must write identical files.
+
+Exits with a non-zero status if the Model takes more memory than the
+dictionaries or the files differ.
+
+Run from the repository root:
+    python benchmarks/bench_model.py
+"""
+import contextlib
+import gc
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sdmodel.model import load_model  # noqa: E402
+from sdmodel.synthetic import model_of_size  # noqa: E402
+from sdmodel.xmile import _view_layout, generate_xmile, print_summary  # noqa: E402
+
+SIZES = [1000, 10000, 50000]
+
+
+def retained_memory(func):
+    """Bytes still allocated by what func() returns."""
+    gc.collect()
+    tracemalloc.start()
+    result = func()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def repeated_work(model):
+    """Summary, layout and two exports of the same model; returns the exported bytes."""
+    outputs = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        print_summary(model)
+    list(_view_layout(model))
+    for streaming in (False, True):
+        out = io.BytesIO()
+        generate_xmile(model, out, streaming=streaming)
+        outputs.append(out.getvalue())
+    return outputs
+
+
+def best_time(func, repeats=3):
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    failed = False
+    print(f"{'variables':>10} {'dict B/var':>11} {'Model B/var':>12} {'dict (ms)':>10} {'Model (ms)':>11}")
+    for n in SIZES:
+        text = json.dumps(model_of_size(n, seed=1))
+        dict_bytes = retained_memory(lambda: json.loads(text))
+        model_bytes = retained_memory(lambda: load_model(json.loads(text)))
+
+        model_data = json.loads(text)
+        dict_seconds, dict_outputs = best_time(lambda: repeated_work(model_data))
+        model_seconds, model_outputs = best_time(lambda: repeated_work(load_model(model_data)))
+        print(f"{n:>10} {dict_bytes / n:>11.0f} {model_bytes / n:>12.0f} {dict_seconds * 1000:>10.1f} "
+              f"{model_seconds * 1000:>11.1f}")
+        if model_bytes > dict_bytes:
+            print("  THE MODEL TAKES MORE MEMORY THAN THE DICTIONARIES")
+            failed = True
+        if model_outputs != dict_outputs:
+            print("  THE XMILE FILES DIFFER")
+            failed = True
+    if failed:
+        sys.exit("The loaded model is larger than model_data or exports differently")
+
+
+if __name__ == "__main__":
+    main()
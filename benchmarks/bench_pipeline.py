@@ -0,0 +1,154 @@
+"""
+Stage-by-stage timing of the JSON-to-XMILE conversion (sdmodel.xmile) on
+synthetic models (sdmodel.synthetic) from 10 to 50,000 variables:
+
+    load        load_model (sdmodel.model), which the stages up to view start from
+    names       extract_variable_names
+    cleaning    compiling the equation cleaner and cleaning every equation
+    variables   building the <stock>/<flow>/<aux> elements
+    layout      computing the view positions
+    view        building the view elements
+    serialize   tree.write of the complete tree
+    export      generate_xmile from model_data, all of the above
+    stream      generate_xmile(streaming=True) from model_data
+
+Each stage is timed several times and the best time is kept. The results can
+be saved as JSON and compared with an earlier run; the comparison exits with
+a non-zero status if a stage got slower than the tolerance allows.
+
+Run from the repository root:
+    python benchmarks/bench_pipeline.py --output before.json
+    ... change the code ...
+    python benchmarks/bench_pipeline.py --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sdmodel.model import load_model  # noqa: E402
+from sdmodel.synthetic import model_of_size  # noqa: E402
+from sdmodel.xmile import (_header_elements, _variable_elements, _view_elements, _view_layout,  # noqa: E402
+                           compile_eqn_cleaner, extract_variable_names, generate_xmile)
+
+SIZES = [10, 100, 1000, 10000, 50000]
+
+# Timings below this many seconds are too noisy to flag as regressions
+MIN_COMPARED = 0.001
+
+
+def build_tree(model_data):
+    xmile = ET.Element("xmile", {"version": "1.0"})
+    xmile.extend(_header_elements())
+    model = ET.SubElement(xmile, "model")
+    ET.SubElement(model, "variables").extend(_variable_elements(model_data))
+    view = ET.SubElement(ET.SubElement(model, "views"), "view")
+    view.extend(_view_elements(model_data))
+    return ET.ElementTree(xmile)
+
+
+def stages(model_data):
+    """Returns (stage name, function) pairs; every function does the work of one stage."""
+    model = load_model(model_data)
+    names = extract_variable_names(model)
+    equations = [item.eqn for item in model.flows + model.auxiliaries]
+    tree = build_tree(model)
+
+    def cleaning():
+        clean = compile_eqn_cleaner(names)
+        for eqn in equations:
+            clean(eqn)
+
+    return [
+        ("load", lambda: load_model(model_data)),
+        ("names", lambda: extract_variable_names(model)),
+        ("cleaning", cleaning),
+        ("variables", lambda: list(_variable_elements(model))),
+        ("layout", lambda: list(_view_layout(model))),
+        ("view", lambda: list(_view_elements(model))),
+        ("serialize", lambda: tree.write(os.devnull, encoding="utf-8", xml_declaration=True)),
+        ("export", lambda: generate_xmile(model_data, os.devnull)),
+        ("stream", lambda: generate_xmile(model_data, os.devnull, streaming=True)),
+    ]
+
+
+def best_time(func, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def run(sizes, seed):
+    results = []
+    for n in sizes:
+        model_data = model_of_size(n, seed)
+        # More repeats for small models, whose timings are noisier
+        repeats = max(3, min(50, 20000 // n))
+        for stage, func in stages(model_data):
+            seconds = best_time(func, repeats)
+            results.append({"variables": n, "stage": stage, "seconds": seconds, "repeats": repeats})
+            print(f"{n:>10} {stage:>10} {seconds * 1000:>12.3f} {seconds / n * 1e6:>12.2f}")
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Prints the ratio to the baseline for every stage timed in both. Returns the regressions."""
+    before = {(r["variables"], r["stage"]): r["seconds"] for r in baseline["results"]}
+    regressions = []
+    print(f"\n{'variables':>10} {'stage':>10} {'before (ms)':>12} {'now (ms)':>12} {'ratio':>7}")
+    for r in results:
+        key = (r["variables"], r["stage"])
+        if key not in before:
+            continue
+        ratio = r["seconds"] / before[key]
+        slower = ratio > tolerance and before[key] >= MIN_COMPARED
+        if slower:
+            regressions.append(key)
+        print(f"{key[0]:>10} {key[1]:>10} {before[key] * 1000:>12.3f} {r['seconds'] * 1000:>12.3f} {ratio:>6.2f}x"
+              f"{'  SLOWER' if slower else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each stage of the XMILE conversion on synthetic models.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="model sizes in variables")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic models (default 0)")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="compare with the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=1.3,
+                        help="slowdown ratio that counts as a regression (default 1.3)")
+    args = parser.parse_args()
+
+    print(f"{'variables':>10} {'stage':>10} {'best (ms)':>12} {'us/variable':>12}")
+    results = run(args.sizes, args.seed)
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to '{args.output}'")
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            sys.exit(f"{len(regressions)} stage(s) slower than {args.tolerance}x the baseline")
+
+
+if __name__ == "__main__":
+    main()
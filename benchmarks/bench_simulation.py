@@ -0,0 +1,64 @@
+"""
+Benchmark for the NumPy simulation engine (sdmodel.simulation).
+Simulates synthetic models for 10,000 steps with Euler and RK4.
+
+Run from the repository root:
+    python benchmarks/bench_simulation.py
+"""
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sdmodel.simulation import compile_model, run_model  # noqa: E402
+
+
+def synthetic_model(n, rng):
+    """
+    A model with n/4 stocks, n/4 flows and n/2 auxiliaries. Half of the
+    auxiliaries are constants, the other half depend on a stock.
+    """
+    n_stocks = max(1, n // 4)
+    n_flows = max(1, n // 4)
+    n_aux = n - n_stocks - n_flows
+    stocks = [{"name": f"Stock {i}", "eqn": str(rng.randint(10, 1000)), "inflows": [], "outflows": []}
+              for i in range(n_stocks)]
+    auxiliaries = []
+    for i in range(n_aux):
+        if i % 2 == 0:
+            eqn = f"{rng.uniform(0.001, 0.05):.4f}"
+        else:
+            eqn = f"MIN(1, Stock {rng.randrange(n_stocks)} / 1000) * Rate {i - 1}"
+        auxiliaries.append({"name": f"Rate {i}", "eqn": eqn})
+    flows = []
+    templates = ["Stock {s} * Rate {a}", "Stock {s} / (1 + Rate {a})", "MAX(0, Stock {s} - 10) * Rate {a}"]
+    for i in range(n_flows):
+        eqn = templates[i % len(templates)].format(s=rng.randrange(n_stocks), a=rng.randrange(n_aux))
+        flows.append({"name": f"Flow {i}", "eqn": eqn})
+        rng.choice(stocks)["outflows"].append(f"Flow {i}")
+        rng.choice(stocks)["inflows"].append(f"Flow {i}")
+    return {"stocks": stocks, "flows": flows, "auxiliaries": auxiliaries, "connectors": []}
+
+
+def main():
+    rng = random.Random(0)
+    steps = 10000
+    print(f"{'variables':>10} {'compile (s)':>12} {'euler (s)':>10} {'rk4 (s)':>9}")
+    for n in [100, 1000, 5000]:
+        model_data = synthetic_model(n, rng)
+        t0 = time.perf_counter()
+        compiled = compile_model(model_data)
+        compile_time = time.perf_counter() - t0
+        timings = []
+        for method in ["euler", "rk4"]:
+            t0 = time.perf_counter()
+            run_model(compiled, start=0, stop=steps, dt=1, method=method)
+            timings.append(time.perf_counter() - t0)
+        print(f"{n:>10} {compile_time:>12.3f} {timings[0]:>10.3f} {timings[1]:>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
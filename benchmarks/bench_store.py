@@ -0,0 +1,71 @@
+"""
+Peak memory of simulation output kept in memory and written to a result store.
+Simulates a synthetic model for a long horizon at dt = 1/4, recording every
+variable, once in memory and once into a memory-mapped ResultStore
+(sdmodel.store), then exports the store to CSV in chunks. Exits with a
+non-zero status if the two results differ or the store run does not use less
+memory.
+
+Run from the repository root:
+    python benchmarks/bench_store.py [--variables 1000] [--stop 500]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_simulation import synthetic_model  # noqa: E402
+from sdmodel.simulation import compile_model, run_model  # noqa: E402
+
+
+def measure(func, *args, **kwargs):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--variables", type=int, default=1000)
+    parser.add_argument("--stop", type=float, default=500.0, help="simulated time at dt = 1/4 (default 500)")
+    args = parser.parse_args()
+
+    compiled = compile_model(synthetic_model(args.variables, random.Random(0)), cache=None)
+    options = {"start": 0, "stop": args.stop, "dt": 0.25}
+    with tempfile.TemporaryDirectory() as tmp:
+        memory, memory_time, memory_peak = measure(run_model, compiled, **options)
+        stored, store_time, store_peak = measure(run_model, compiled, output=os.path.join(tmp, "results"), **options)
+        same = np.array_equal(memory["values"], stored["values"], equal_nan=True)
+        size = memory["values"].nbytes / 1e6
+        del memory
+
+        csv_path = os.path.join(tmp, "results.csv")
+        _, csv_time, csv_peak = measure(stored["store"].to_csv, csv_path)
+        csv_size = os.path.getsize(csv_path) / 1e6
+
+    print(f"{args.variables} variables, {len(stored['time'])} saved steps, {size:.1f} MB of results")
+    print(f"{'':>10} {'time (s)':>9} {'peak (MB)':>10}")
+    print(f"{'memory':>10} {memory_time:>9.2f} {memory_peak / 1e6:>10.1f}")
+    print(f"{'store':>10} {store_time:>9.2f} {store_peak / 1e6:>10.1f}")
+    print(f"{'csv':>10} {csv_time:>9.2f} {csv_peak / 1e6:>10.1f}  ({csv_size:.1f} MB written)")
+    if not same:
+        sys.exit("Results written to the store differ from the in-memory results")
+    if store_peak >= memory_peak:
+        sys.exit("Writing to the store did not reduce peak memory")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Scaling check for model validation in sdmodel.graph.
+Validates synthetic models of increasing size, with chains of auxiliaries (so
+the dependency graph is deep) and a few deliberate problems, and reports the
+time per variable. Exits with a non-zero status if the largest model is more
+than 3x slower per variable than the smallest one, or if the deliberate
+problems are not all found.
+
+Run from the repository root:
+    python benchmarks/bench_validation.py
+"""
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sdmodel.graph import validate_model  # noqa: E402
+
+
+def synthetic_model(n, rng):
+    """
+    A model with n/4 stocks, n/4 flows and n/2 auxiliaries. Auxiliaries form
+    chains of 50, each flow uses a stock and the end of a chain. One undefined
+    name, one algebraic loop and one unused connector are added.
+    """
+    n_stocks = max(1, n // 4)
+    n_flows = max(1, n // 4)
+    n_aux = n - n_stocks - n_flows
+    stocks = [{"name": f"Stock {i}", "eqn": "100", "inflows": [], "outflows": []} for i in range(n_stocks)]
+    auxiliaries = []
+    connectors = []
+    for i in range(n_aux):
+        if i % 50 == 0:
+            auxiliaries.append({"name": f"Rate {i}", "eqn": "0.05"})
+        else:
+            auxiliaries.append({"name": f"Rate {i}", "eqn": f"Rate {i - 1} * 1.01"})
+            connectors.append({"src": f"Rate {i - 1}", "tgt": f"Rate {i}"})
+    flows = []
+    for i in range(n_flows):
+        stock = rng.choice(stocks)
+        rate = f"Rate {rng.randrange(n_aux)}"
+        flows.append({"name": f"Flow {i}", "eqn": f"{stock['name']} * {rate}"})
+        stock["outflows"].append(f"Flow {i}")
+        connectors.append({"src": stock["name"], "tgt": f"Flow {i}"})
+        connectors.append({"src": rate, "tgt": f"Flow {i}"})
+
+    auxiliaries[1]["eqn"] = "Rate 0 * Undefined_Name"
+    auxiliaries[-2]["eqn"] = f"{auxiliaries[-1]['name']} + 1"
+    auxiliaries[-1]["eqn"] = f"{auxiliaries[-2]['name']} * 2"
+    connectors.append({"src": "Stock 0", "tgt": "Rate 0"})
+    return {"stocks": stocks, "flows": flows, "auxiliaries": auxiliaries, "connectors": connectors}
+
+
+def main():
+    rng = random.Random(0)
+    sizes = [1000, 10000, 100000]
+    per_variable = []
+    failed = False
+    print(f"{'variables':>10} {'validate (s)':>13} {'us/variable':>12}  issues found")
+    for n in sizes:
+        model_data = synthetic_model(n, rng)
+        t0 = time.perf_counter()
+        issues = validate_model(model_data)
+        elapsed = time.perf_counter() - t0
+        per_variable.append(elapsed / n)
+        kinds = {issue["kind"] for issue in issues}
+        missing = {"undefined", "loop", "extra_connector"} - kinds
+        failed = failed or bool(missing)
+        print(f"{n:>10} {elapsed:>13.3f} {elapsed / n * 1e6:>12.1f}  {', '.join(sorted(kinds))}"
+              f"{'  MISSING ' + ', '.join(sorted(missing)) if missing else ''}")
+
+    growth = per_variable[-1] / per_variable[0]
+    print(f"Per-variable cost grew {growth:.2f}x over a {sizes[-1] // sizes[0]}x larger model")
+    if growth > 3:
+        sys.exit("Validation time is growing faster than linearly")
+    if failed:
+        sys.exit("Validation missed a deliberate problem")
+
+
+if __name__ == "__main__":
+    main()
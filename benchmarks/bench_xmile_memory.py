@@ -0,0 +1,67 @@
+"""
+Peak memory of the ElementTree and streaming XMILE writers in sdmodel.xmile.
+Both writers are run on the same synthetic model and must produce identical bytes.
+Exits with a non-zero status if the files differ or if the streaming peak is
+more than MAX_STREAM_SHARE of the ElementTree peak.
+
+Run from the repository root:
+    python benchmarks/bench_xmile_memory.py
+"""
+import os
+import sys
+import tempfile
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sdmodel.xmile import generate_xmile  # noqa: E402
+
+# Highest streaming peak allowed, as a share of the ElementTree peak (about a third today)
+MAX_STREAM_SHARE = 0.5
+
+
+def synthetic_model(n):
+    n_stocks = max(1, n // 4)
+    stocks = [{"name": f"Stock {i}", "eqn": "100", "description": "Accumulated quantity",
+               "inflows": [f"Flow {i}"], "outflows": []} for i in range(n_stocks)]
+    flows = [{"name": f"Flow {i}", "eqn": f"Stock {i} * Rate {i}", "unit": "units/year"} for i in range(n_stocks)]
+    auxiliaries = [{"name": f"Rate {i}", "eqn": "0.05", "unit": "1/year"} for i in range(n - 2 * n_stocks)]
+    connectors = [{"src": f"Rate {i}", "tgt": f"Flow {i % n_stocks}"} for i in range(len(auxiliaries))]
+    return {"stocks": stocks, "flows": flows, "auxiliaries": auxiliaries, "connectors": connectors}
+
+
+def peak_memory(func, *args, **kwargs):
+    tracemalloc.start()
+    func(*args, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    failed = False
+    print(f"{'variables':>10} {'output (MB)':>12} {'tree peak (MB)':>15} {'stream peak (MB)':>17}")
+    with tempfile.TemporaryDirectory() as tmp:
+        tree_path = os.path.join(tmp, "tree.xmile")
+        stream_path = os.path.join(tmp, "stream.xmile")
+        for n in [1000, 10000, 50000]:
+            model_data = synthetic_model(n)
+            tree_peak = peak_memory(generate_xmile, model_data, tree_path)
+            stream_peak = peak_memory(generate_xmile, model_data, stream_path, streaming=True)
+            with open(tree_path, "rb") as a, open(stream_path, "rb") as b:
+                same = a.read() == b.read()
+            size = os.path.getsize(tree_path) / 1e6
+            print(f"{n:>10} {size:>12.2f} {tree_peak / 1e6:>15.2f} {stream_peak / 1e6:>17.2f}")
+            if not same:
+                print("  THE STREAMING OUTPUT DIFFERS FROM THE ELEMENTTREE OUTPUT")
+                failed = True
+            if stream_peak > MAX_STREAM_SHARE * tree_peak:
+                print(f"  THE STREAMING PEAK IS OVER {MAX_STREAM_SHARE:.0%} OF THE ELEMENTTREE PEAK")
+                failed = True
+    if failed:
+        sys.exit("The streaming writer differs from the ElementTree writer or saves too little memory")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Speed and peak memory of read_xmile (sdmodel.xmile) against loading the whole
+XML tree with ET.parse. Synthetic models are written with generate_xmile,
+read back and written again; the second file must be byte-for-byte the same
+as the first. Exits with a non-zero status if a round trip differs or
+read_xmile needs more memory than the full tree.
+
+Run from the repository root:
+    python benchmarks/bench_xmile_read.py
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_xmile_memory import synthetic_model  # noqa: E402
+from sdmodel.xmile import generate_xmile, read_xmile  # noqa: E402
+
+
+def measure(func, *args, **kwargs):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    failed = False
+    print(f"{'variables':>10} {'file (MB)':>10} {'read (s)':>9} {'read peak (MB)':>15} {'ET.parse peak (MB)':>19}"
+          f"  round trip")
+    with tempfile.TemporaryDirectory() as tmp:
+        first = os.path.join(tmp, "first.xmile")
+        second = os.path.join(tmp, "second.xmile")
+        for n in [1000, 10000, 50000]:
+            generate_xmile(synthetic_model(n), first, streaming=True)
+            model_data, elapsed, read_peak = measure(read_xmile, first)
+            _, _, tree_peak = measure(ET.parse, first)
+            generate_xmile(model_data, second, streaming=True)
+            with open(first, "rb") as a, open(second, "rb") as b:
+                same = a.read() == b.read()
+            failed = failed or not same or read_peak >= tree_peak
+            size = os.path.getsize(first) / 1e6
+            print(f"{n:>10} {size:>10.2f} {elapsed:>9.3f} {read_peak / 1e6:>15.2f} {tree_peak / 1e6:>19.2f}"
+                  f"  {'identical' if same else 'DIFFERS'}")
+
+    if failed:
+        sys.exit("XMILE round trip differs or read_xmile used more memory than the full tree")
+
+
+if __name__ == "__main__":
+    main()
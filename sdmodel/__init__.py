@@ -0,0 +1,30 @@
+"""
+Tools for working with the stock and flow models extracted by the LLM scripts.
+
+The modules in this package take the same `model_data` dictionary that the
+JSON-to-XMILE converter consumes (keys 'stocks', 'flows', 'auxiliaries' and
+'connectors'):
+
+    sdmodel.model       load model_data once into a compact Model with a name index
+    sdmodel.xmile       write model_data as XMILE and read it back (standard library only)
+    sdmodel.equations   parse the 'eqn' strings into syntax trees
+    sdmodel.graph       dependency graph, loop detection and validation of a model
+    sdmodel.layout      overlap-free diagram layouts (grid, layered, force-directed)
+    sdmodel.simulation  run the model with NumPy (Euler or RK4)
+    sdmodel.codegen     generated simulation kernels and their on-disk cache
+    sdmodel.sweep       Monte Carlo and parameter sweeps over many runs
+    sdmodel.store       memory-mapped columnar store for simulation results
+    sdmodel.extraction  extract model_data from many diagram images concurrently
+    sdmodel.jobs        resumable SQLite job queue for extracting large batches of images
+    sdmodel.hedging     race OpenAI and Gemini and keep the first valid answer
+    sdmodel.consensus   sample several answers in parallel and merge what they agree on
+    sdmodel.images      shrink diagram images before they are uploaded
+    sdmodel.jsonstream  parse model_data JSON while it arrives, or a large file a block at a time
+    sdmodel.cache       on-disk cache of extraction results
+    sdmodel.instrument  timed spans, token usage and trace sinks
+    sdmodel.mockserver  local stand-in for the OpenAI and Gemini APIs, for load tests
+    sdmodel.synthetic   generate synthetic models of any size for benchmarks
+
+Importing the package imports none of these; NumPy, the provider SDKs and
+Pillow are only loaded by the modules (or functions) that need them.
+"""
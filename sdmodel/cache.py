@@ -0,0 +1,111 @@
+"""
+On-disk cache for the model data extracted from images by the LLM providers.
+
+Entries are keyed on the SHA-256 of the image bytes together with the prompt,
+provider, model name and generation settings, so the same request is only
+paid for once. The cache is a single SQLite file and uses only the standard
+library: a cache hit never needs the provider SDKs.
+
+    cache = ExtractionCache()
+    key = cache_key(image_bytes, prompt, "OPENAI", "gpt-4o", {"temperature": 1})
+    model_data = cache.get(key)
+    if model_data is None:
+        model_data = ...  # call the API
+        cache.put(key, model_data)
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+# Default location, overridable with the SD_EXTRACTION_CACHE environment variable
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "sd_model_extraction", "cache.sqlite3")
+
+
+def cache_key(image_bytes, prompt, provider, model, config):
+    """Returns the hex digest identifying one extraction request."""
+    request = {
+        "image": hashlib.sha256(image_bytes).hexdigest(),
+        "prompt": prompt,
+        "provider": provider,
+        "model": model,
+        "config": config,
+    }
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    """
+    SQLite-backed cache of extracted model data.
+
+    `max_bytes` bounds the total size of the stored JSON; the least recently
+    used entries are evicted first. Entries older than `max_age` seconds are
+    treated as missing and removed. Either limit may be None.
+    """
+
+    def __init__(self, path=None, max_bytes=512 * 1024 * 1024, max_age=None):
+        self.path = path or os.environ.get("SD_EXTRACTION_CACHE", DEFAULT_CACHE_PATH)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.path, timeout=30)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self._db.commit()
+
+    def get(self, key):
+        """Returns the cached model data for `key`, or None."""
+        row = self._db.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if self.max_age is not None and now - row[1] > self.max_age:
+            with self._db:
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            return None
+        with self._db:
+            self._db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, key, model_data):
+        """Stores model data under `key` and evicts entries beyond the size and age limits."""
+        value = json.dumps(model_data)
+        now = time.time()
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now),
+            )
+        self.evict()
+
+    def evict(self):
+        """Removes expired entries, then the least recently used ones until the size limit is met."""
+        with self._db:
+            if self.max_age is not None:
+                self._db.execute("DELETE FROM entries WHERE created < ?", (time.time() - self.max_age,))
+            if self.max_bytes is not None:
+                total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+                if total > self.max_bytes:
+                    excess = total - self.max_bytes
+                    removed = 0
+                    stale = []
+                    for key, size in self._db.execute("SELECT key, size FROM entries ORDER BY accessed"):
+                        if removed >= excess:
+                            break
+                        stale.append((key,))
+                        removed += size
+                    self._db.executemany("DELETE FROM entries WHERE key = ?", stale)
+
+    def clear(self):
+        """Removes every entry."""
+        with self._db:
+            self._db.execute("DELETE FROM entries")
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,279 @@
+"""
+Generated simulation kernels for compiled models, cached on disk.
+
+compile_model (sdmodel.simulation) groups the flow and auxiliary equations
+into templates that are evaluated with one NumPy operation per group. This
+module turns those groups into the source of a single Python function,
+
+    def derivative(v, t):
+        ctx[0] = t
+        v[r0] = multiply(v[s0_0], v[s0_1])
+        v[12] = minimum(1.0, divide(v[3], 1000.0))
+        ...
+        return net
+
+so that each time step runs straight-line code instead of walking a tree of
+closures. Constants that are the same for a whole group are written into the
+source, and groups of one variable index the state with plain integers.
+
+KernelCache keeps compiled models on disk, keyed by model_hash() of the
+equations, flows and connectors, so a model that has been simulated before
+skips parsing, ordering and code generation. It is used only when asked for
+(compile_model(..., cache="default")).
+"""
+import hashlib
+import json
+import math
+import os
+
+import numpy as np
+
+from sdmodel.model import to_model_data
+
+# Bump when the compiled model or the generated code changes, to ignore older cache files
+KERNEL_VERSION = 2
+
+# Default location, overridable with the SD_KERNEL_CACHE environment variable
+DEFAULT_KERNEL_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "sd_model_extraction", "kernels")
+
+_OPERATOR_NAMES = {
+    "+": "add",
+    "-": "subtract",
+    "*": "multiply",
+    "/": "divide",
+    "^": "power",
+    "mod": "mod",
+    "<": "less",
+    "<=": "less_equal",
+    ">": "greater",
+    ">=": "greater_equal",
+    "=": "equal",
+    "<>": "not_equal",
+    "and": "logical_and",
+    "or": "logical_or",
+}
+
+# Built-in functions that map directly onto a NumPy function of one argument
+_UNARY_CALLS = {
+    "ABS": "absolute",
+    "EXP": "exp",
+    "LN": "log",
+    "LOG10": "log10",
+    "SQRT": "sqrt",
+    "SIN": "sin",
+    "COS": "cos",
+    "TAN": "tan",
+    "ARCTAN": "arctan",
+    "INT": "floor",
+}
+
+_CONTEXT_CALLS = {"TIME": "ctx[0]", "DT": "ctx[1]", "STARTTIME": "ctx[2]", "STOPTIME": "ctx[3]"}
+
+# NumPy names available to the generated code
+_NUMPY_NAMES = sorted(set(_OPERATOR_NAMES.values()) | set(_UNARY_CALLS.values())
+                      | {"logical_not", "negative", "where", "minimum", "maximum", "zeros"})
+
+
+def model_hash(model_data):
+    """
+    Returns the hex digest of everything in model_data that affects a
+    simulation: names, equations, stock inflows and outflows, and connectors.
+    Descriptions, units and diagram positions are left out.
+    """
+    model_data = to_model_data(model_data)
+    structure = {
+        category: [[item.get("name"), item.get("eqn"), item.get("inflows"), item.get("outflows")]
+                   for item in model_data.get(category, [])]
+        for category in ("stocks", "flows", "auxiliaries")
+    }
+    structure["connectors"] = [[conn.get("src"), conn.get("tgt")] for conn in model_data.get("connectors", [])]
+    return hashlib.sha256(json.dumps(structure, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _literal(values):
+    # A constant shared by the whole group is written into the source
+    first = float(values[0])
+    if math.isfinite(first) and (values == first).all():
+        return repr(first)
+    return None
+
+
+class _Emitter:
+    """Writes the expression of one kernel group and collects the arrays it reads."""
+
+    def __init__(self, k, slot_arrays, const_arrays, bindings, batch_bindings):
+        self.k = k
+        self.single = len(slot_arrays[0]) == 1 if slot_arrays else False
+        self.slot_arrays = slot_arrays
+        self.const_arrays = const_arrays
+        self.bindings = bindings
+        self.batch_bindings = batch_bindings
+
+    def emit(self, node):
+        kind = node[0]
+        if kind == "slot":
+            rows = self.slot_arrays[node[1]]
+            if self.single:
+                return f"v[{int(rows[0])}]"
+            name = f"s{self.k}_{node[1]}"
+            self.bindings[name] = rows
+            return f"v[{name}]"
+        if kind == "const":
+            values = self.const_arrays[node[1]]
+            literal = _literal(values)
+            if literal is not None:
+                return literal
+            name = f"c{self.k}_{node[1]}"
+            self.batch_bindings[name] = values
+            return name
+        if kind == "neg":
+            return f"negative({self.emit(node[1])})"
+        if kind == "not":
+            return f"logical_not({self.emit(node[1])})"
+        if kind == "bin":
+            return f"{_OPERATOR_NAMES[node[1]]}({self.emit(node[2])}, {self.emit(node[3])})"
+        if kind == "if":
+            return f"where({', '.join(self.emit(child) for child in node[1:])})"
+        name, args = node[1], [self.emit(arg) for arg in node[2]]
+        if name in _CONTEXT_CALLS:
+            return _CONTEXT_CALLS[name]
+        if name == "PI":
+            return repr(math.pi)
+        if name in _UNARY_CALLS:
+            return f"{_UNARY_CALLS[name]}({args[0]})"
+        if name in ("MIN", "MAX") and args:
+            result = args[0]
+            for arg in args[1:]:
+                result = f"{'minimum' if name == 'MIN' else 'maximum'}({result}, {arg})"
+            return result
+        if name == "IF_THEN_ELSE":
+            return f"where({', '.join(args)})"
+        return f"f_{name}({', '.join(['ctx'] + args)})"
+
+
+def kernel_source(kernel_specs, n_stocks, has_edges):
+    """
+    Generates the derivative function for the kernel groups of a compiled
+    model. Returns (source, bindings, batch_bindings): the arrays the code
+    reads by name, where batch_bindings hold one value per variable and get
+    a run axis in batched simulations.
+    """
+    bindings = {}
+    batch_bindings = {}
+    lines = ["def derivative(v, t):", "    ctx[0] = t"]
+    for k, (rows, shape, slot_arrays, const_arrays) in enumerate(kernel_specs):
+        emitter = _Emitter(k, slot_arrays, const_arrays, bindings, batch_bindings)
+        if len(rows) == 1:
+            target = f"v[{int(rows[0])}]"
+        else:
+            target = f"v[r{k}]"
+            bindings[f"r{k}"] = rows
+        lines.append(f"    {target} = {emitter.emit(shape)}")
+    lines.append(f"    net = zeros(({n_stocks},) + v.shape[1:])")
+    if has_edges:
+        lines.append("    net[fed_stocks] = add.reduceat(multiply(v[edge_flows], edge_signs), edge_starts, axis=0)")
+    lines.append("    return net")
+    return "\n".join(lines) + "\n", bindings, batch_bindings
+
+
+def build_kernel(code, bindings, batch_bindings, context, functions, batched):
+    """
+    Runs the compiled kernel source and returns its derivative function.
+    `context` is the (time, dt, start, stop) list shared with the caller and
+    `functions` maps built-in function names to their implementations.
+    """
+    namespace = {name: getattr(np, name) for name in _NUMPY_NAMES}
+    namespace.update((f"f_{name}", func) for name, func in functions.items())
+    namespace.update(bindings)
+    for name, values in batch_bindings.items():
+        namespace[name] = values[:, None] if batched else values
+    namespace["ctx"] = context
+    exec(code, namespace)
+    return namespace["derivative"]
+
+
+class KernelCache:
+    """
+    Directory of compiled models, one .npz file per model_hash: the arrays,
+    plus the names, initializers and kernel source as JSON. Nothing is
+    unpickled and the source is compiled again on load. Since that source is
+    executed, the directory is only used if it belongs to the current user
+    and nobody else can write to it. Unreadable files count as missing, and a
+    cache that cannot be written is skipped.
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.environ.get("SD_KERNEL_CACHE", DEFAULT_KERNEL_CACHE)
+        self.tag = f"v{KERNEL_VERSION}"
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.{self.tag}.npz")
+
+    def _trusted(self):
+        # Anyone who can write kernel files here could run code as this user
+        try:
+            stat = os.stat(self.directory)
+        except OSError:
+            return False
+        if hasattr(os, "getuid") and (stat.st_uid != os.getuid() or stat.st_mode & 0o022):
+            return False
+        return True
+
+    def get(self, key):
+        """Returns the compiled model stored under `key`, or None."""
+        if not self._trusted():
+            return None
+        try:
+            with np.load(self._path(key), allow_pickle=False) as stored:
+                meta = json.loads(str(stored["meta"]))
+                bindings = {name: stored[f"b_{name}"] for name in meta["bindings"]}
+                batch_bindings = {name: stored[f"bb_{name}"] for name in meta["batch_bindings"]}
+            names = meta["names"]
+            return {
+                "names": names,
+                "index": {name: i for i, name in enumerate(names)},
+                "n_stocks": meta["n_stocks"],
+                "static": meta["static"],
+                "dynamic": meta["dynamic"],
+                "initializers": [(row, _as_tuples(shape), slots, consts)
+                                 for row, shape, slots, consts in meta["initializers"]],
+                "source": meta["source"],
+                "code": compile(meta["source"], "<sdmodel kernel>", "exec"),
+                "bindings": bindings,
+                "batch_bindings": batch_bindings,
+            }
+        except Exception:
+            # Missing, truncated, from another version or not ours: compile the model again
+            return None
+
+    def put(self, key, compiled):
+        """Stores a compiled model under `key`."""
+        meta = {
+            "names": compiled["names"],
+            "n_stocks": compiled["n_stocks"],
+            "static": compiled["static"],
+            "dynamic": compiled["dynamic"],
+            "initializers": compiled["initializers"],
+            "source": compiled["source"],
+            "bindings": list(compiled["bindings"]),
+            "batch_bindings": list(compiled["batch_bindings"]),
+        }
+        arrays = {f"b_{name}": values for name, values in compiled["bindings"].items()}
+        arrays.update((f"bb_{name}", values) for name, values in compiled["batch_bindings"].items())
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            if not self._trusted():
+                return
+            with open(tmp_path, "wb") as f:
+                np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+def _as_tuples(node):
+    # JSON turns the tuples of a template into lists
+    return tuple(_as_tuples(part) for part in node) if isinstance(node, list) else node
@@ -0,0 +1,339 @@
+"""
+Self-consistency extraction: sample the same diagram several times in
+parallel and keep what the samples agree on.
+
+K requests are sent at once, spread over one or both providers. Each answer
+is merged into a ConsensusMerger as it arrives: variables are matched by
+their normalized name (case, spaces and underscores ignored) and connectors
+by their normalized (src, tgt). Once `min_samples` answers are in and their
+agreement (the share of the consensus so far that every answer has) reaches
+`threshold`, the outstanding requests are cancelled. So when the model reads
+the diagram consistently, the result costs about as long as the slowest of
+the first few answers, not K calls in a row.
+
+The consensus model_data keeps the elements found in at least `min_share`
+of the merged answers. Each one gets a "confidence", the share of answers
+that had it. Equations, units and descriptions are the most common ones, and
+positions are the median.
+
+    python -m sdmodel.consensus diagram.png --samples 5 --providers openai gemini --threshold 0.9
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import Counter
+
+from sdmodel import instrument
+from sdmodel.extraction import API_KEY_VARIABLES, EXTRACTION_PROMPT, PROVIDERS, BatchExtractor
+from sdmodel.images import PREPROCESS, preprocess_file, sniff_mime_type
+from sdmodel.model import CATEGORIES
+
+DEFAULT_SAMPLES = 5
+DEFAULT_THRESHOLD = 0.9
+DEFAULT_MIN_SAMPLES = 3
+
+
+def normalize_name(name):
+    """The key variables are matched on: case-folded, with underscores and runs of spaces as single spaces."""
+    return " ".join(name.replace("_", " ").split()).casefold()
+
+
+def _normalize_text(text):
+    # Equations that differ only in spacing vote together
+    return " ".join(str(text).split())
+
+
+def _vote(counter, originals, key, value):
+    counter[key] += 1
+    originals.setdefault(key, value)
+
+
+def _winner(counter, originals):
+    """The most common value (the first seen among equals), or None."""
+    if not counter:
+        return None
+    return originals[counter.most_common(1)[0][0]]
+
+
+def _median(values):
+    values = sorted(values)
+    if not values:
+        return None
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+class _Element:
+    """Votes for one variable or connector across the merged samples."""
+
+    __slots__ = ("votes", "kinds", "names", "fields", "originals", "positions", "links")
+
+    def __init__(self):
+        self.votes = 0
+        self.kinds = Counter()
+        self.names = Counter()
+        self.fields = {}
+        self.originals = {}
+        self.positions = ([], [])
+        self.links = {"inflows": Counter(), "outflows": Counter()}
+
+
+class ConsensusMerger:
+    """
+    Merges model_data samples one at a time (add) and builds the consensus
+    of those merged so far (model_data). A count of the elements per number
+    of votes is kept as samples are added, so agreement() takes no time.
+    """
+
+    def __init__(self, min_share=0.5):
+        self.min_share = min_share
+        self.samples = 0
+        self.variables = {}
+        self.connectors = {}
+        self.histogram = Counter()
+
+    def _count_vote(self, element):
+        self.histogram[element.votes] -= 1
+        element.votes += 1
+        self.histogram[element.votes] += 1
+
+    def add(self, model_data):
+        """Merges one sample."""
+        self.samples += 1
+        seen = set()
+        for kind, category in CATEGORIES:
+            for item in model_data.get(category, []):
+                key = normalize_name(item["name"])
+                if key in seen:
+                    continue
+                seen.add(key)
+                element = self.variables.get(key)
+                if element is None:
+                    element = self.variables[key] = _Element()
+                self._count_vote(element)
+                element.kinds[kind] += 1
+                _vote(element.names, element.originals, ("name", item["name"]), item["name"])
+                for field in ("eqn", "unit", "description"):
+                    value = item.get(field)
+                    if value not in (None, ""):
+                        counter = element.fields.setdefault(field, Counter())
+                        _vote(counter, element.originals, (field, _normalize_text(value)), value)
+                for axis, field in enumerate(("x", "y")):
+                    value = item.get(field)
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        element.positions[axis].append(value)
+                if kind == "stock":
+                    for field in ("inflows", "outflows"):
+                        flows = {}
+                        for flow in item.get(field, ()):
+                            flows.setdefault(normalize_name(flow), flow)
+                        for key, flow in flows.items():
+                            element.links[field][key] += 1
+                            element.originals.setdefault(("flow", key), flow)
+
+        for conn in model_data.get("connectors", []):
+            key = (normalize_name(conn["src"]), normalize_name(conn["tgt"]))
+            if key in seen:
+                continue
+            seen.add(key)
+            element = self.connectors.get(key)
+            if element is None:
+                element = self.connectors[key] = _Element()
+            self._count_vote(element)
+            angle = conn.get("angle")
+            if angle is not None:
+                _vote(element.fields.setdefault("angle", Counter()), element.originals, ("angle", angle), angle)
+
+    def agreement(self):
+        """
+        Share of the consensus (the variables and connectors in at least
+        min_share of the samples) that every sample has. Elements only a few
+        samples made up are left out of the consensus, so they do not count.
+        """
+        samples = self.samples
+        kept = sum(count for votes, count in self.histogram.items() if votes and votes / samples >= self.min_share)
+        return self.histogram[samples] / kept if kept else 0.0
+
+    def model_data(self):
+        """
+        The consensus model_data: the elements found in at least min_share of
+        the samples, each with a "confidence" (the share of samples that had
+        it), spelled as most samples spelled them. Stock inflows and outflows
+        are kept if most samples with the stock list them; connectors if both
+        ends were kept.
+        """
+        samples = self.samples
+        kept = {key: element for key, element in self.variables.items()
+                if samples and element.votes / samples >= self.min_share}
+        names = {key: _winner(element.names, element.originals) for key, element in kept.items()}
+        model_data = {category: [] for _, category in CATEGORIES}
+        categories = dict(CATEGORIES)
+        for key, element in kept.items():
+            kind = element.kinds.most_common(1)[0][0]
+            item = {"name": names[key]}
+            for field in ("eqn", "description", "unit"):
+                value = _winner(element.fields.get(field, ()), element.originals)
+                if value is not None:
+                    item[field] = value
+            if kind == "stock":
+                for field in ("inflows", "outflows"):
+                    item[field] = [names.get(flow) or element.originals[("flow", flow)]
+                                   for flow, votes in element.links[field].items()
+                                   if votes / element.kinds["stock"] >= 0.5]
+            for axis, field in enumerate(("x", "y")):
+                value = _median(element.positions[axis])
+                if value is not None:
+                    item[field] = value
+            item["confidence"] = round(element.votes / samples, 3)
+            model_data[categories[kind]].append(item)
+
+        connectors = []
+        for (src, tgt), element in self.connectors.items():
+            if element.votes / samples < self.min_share or src not in names or tgt not in names:
+                continue
+            conn = {"src": names[src], "tgt": names[tgt]}
+            angle = _winner(element.fields.get("angle", ()), element.originals)
+            if angle is not None:
+                conn["angle"] = angle
+            conn["confidence"] = round(element.votes / samples, 3)
+            connectors.append(conn)
+        model_data["connectors"] = connectors
+        return model_data
+
+
+class ConsensusExtractor:
+    """
+    Samples one image `samples` times in parallel, the requests spread in
+    turn over `providers` (those of sdmodel.extraction, or any object with
+    `name`, `model`, `config` and an async request() method). Each request
+    is retried like a BatchExtractor's, and never answered from the cache:
+    the point is independent samples. A failed sample is left out; if all
+    fail, the last error is raised.
+    """
+
+    def __init__(self, providers, samples=DEFAULT_SAMPLES, threshold=DEFAULT_THRESHOLD,
+                 min_samples=DEFAULT_MIN_SAMPLES, min_share=0.5, max_retries=2, prompt=EXTRACTION_PROMPT,
+                 streaming=False):
+        self.providers = list(providers)
+        self.samples = samples
+        self.threshold = threshold
+        self.min_samples = min(min_samples, samples)
+        self.min_share = min_share
+        self.extractors = [BatchExtractor(provider, concurrency=samples, max_retries=max_retries, cache=None,
+                                          prompt=prompt, preprocess=None, streaming=streaming)
+                           for provider in self.providers]
+
+    async def extract(self, image_bytes, mime_type="image/png"):
+        """
+        Returns (consensus model_data, summary). The summary holds the number
+        of samples 'requested', 'merged', 'failed' and 'cancelled', the final
+        'agreement', whether the run 'stopped_early', and the samples merged
+        per provider. Recorded as a "consensus_extract" span.
+        """
+        with instrument.span("consensus_extract", samples=self.samples) as span:
+            merger = ConsensusMerger(self.min_share)
+            tasks = {}
+            for i in range(self.samples):
+                extractor = self.extractors[i % len(self.extractors)]
+                tasks[asyncio.create_task(extractor.extract(image_bytes, mime_type))] = extractor.provider.name
+            summary = {"requested": self.samples, "merged": 0, "failed": 0, "cancelled": 0, "agreement": None,
+                       "stopped_early": False, "providers": {}}
+            error = None
+            try:
+                while tasks:
+                    done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        provider = tasks.pop(task)
+                        # A sample cancelled from outside counts as failed, like in sdmodel.hedging
+                        if task.cancelled() or task.exception() is not None:
+                            error = asyncio.CancelledError() if task.cancelled() else task.exception()
+                            summary["failed"] += 1
+                            continue
+                        merger.add(task.result()[0])
+                        summary["providers"][provider] = summary["providers"].get(provider, 0) + 1
+                    if tasks and merger.samples >= self.min_samples and merger.agreement() >= self.threshold:
+                        summary["stopped_early"] = True
+                        break
+            finally:
+                summary["cancelled"] = len(tasks)
+                for task in tasks:
+                    task.cancel()
+                if tasks:
+                    await asyncio.gather(*tasks, return_exceptions=True)
+            if not merger.samples:
+                raise error
+            summary["merged"] = merger.samples
+            summary["agreement"] = round(merger.agreement(), 3)
+            span.set(merged=merger.samples, cancelled=summary["cancelled"], agreement=summary["agreement"])
+            return merger.model_data(), summary
+
+    async def aclose(self):
+        for extractor in self.extractors:
+            await extractor.aclose()
+
+
+async def extract_consensus(image_path, samples=DEFAULT_SAMPLES, providers=("OPENAI",), threshold=DEFAULT_THRESHOLD,
+                            min_samples=DEFAULT_MIN_SAMPLES, min_share=0.5, api_keys=None, models=None,
+                            configs=None, base_urls=None, preprocess=PREPROCESS, streaming=False):
+    """
+    Extracts one image by self-consistency sampling over `providers`
+    ('OPENAI' and/or 'GEMINI'). `api_keys`, `models`, `configs` and
+    `base_urls` are dicts keyed by provider name; API keys default to the
+    environment variables. Returns (model_data, summary) as
+    ConsensusExtractor.extract.
+    """
+    api_keys, models, configs, base_urls = api_keys or {}, models or {}, configs or {}, base_urls or {}
+    clients = [
+        PROVIDERS[name](api_keys.get(name) or os.environ.get(API_KEY_VARIABLES[name]), model=models.get(name),
+                        config=configs.get(name), base_url=base_urls.get(name))
+        for name in (provider.upper() for provider in providers)
+    ]
+    if preprocess is not None:
+        image_bytes, mime_type = await asyncio.to_thread(preprocess_file, image_path, **preprocess)
+    else:
+        with open(image_path, "rb") as f:
+            image_bytes = f.read()
+        mime_type = sniff_mime_type(image_bytes)
+
+    extractor = ConsensusExtractor(clients, samples=samples, threshold=threshold, min_samples=min_samples,
+                                   min_share=min_share, streaming=streaming)
+    try:
+        return await extractor.extract(image_bytes, mime_type)
+    finally:
+        await extractor.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract a stock and flow model from several parallel samples.")
+    parser.add_argument("image", help="diagram image")
+    parser.add_argument("--samples", type=int, default=DEFAULT_SAMPLES,
+                        help=f"requests sent in parallel (default {DEFAULT_SAMPLES})")
+    parser.add_argument("--providers", type=str.upper, nargs="+", choices=sorted(PROVIDERS), default=["OPENAI"],
+                        help="providers the requests are spread over (default OPENAI)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"agreement at which the other requests are cancelled (default {DEFAULT_THRESHOLD})")
+    parser.add_argument("--min-samples", type=int, default=DEFAULT_MIN_SAMPLES,
+                        help=f"answers merged before stopping early (default {DEFAULT_MIN_SAMPLES})")
+    parser.add_argument("--min-share", type=float, default=0.5,
+                        help="share of the answers an element needs to be kept (default 0.5)")
+    parser.add_argument("-o", "--output", default="output.json", help="where to write the model data")
+    parser.add_argument("--stream", action="store_true", help="parse the responses while they arrive")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    model_data, summary = asyncio.run(extract_consensus(
+        args.image, args.samples, args.providers, args.threshold, args.min_samples, args.min_share,
+        streaming=args.stream))
+    with open(args.output, "w") as outfile:
+        json.dump(model_data, outfile, indent=2)
+    print(f"Merged {summary['merged']} of {summary['requested']} samples ({summary['cancelled']} cancelled, "
+          f"{summary['failed']} failed), agreement {summary['agreement']:.2f}, "
+          f"in {time.perf_counter() - started:.1f} s; saved to '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
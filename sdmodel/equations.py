@@ -0,0 +1,301 @@
+"""
+Parsing of the equation strings ('eqn') stored in model_data.
+
+Equations are parsed into small tuple-based syntax trees:
+
+    ("num", value)                   numeric literal
+    ("var", name)                    reference to a model variable (its original name)
+    ("neg", operand)                 unary minus
+    ("not", operand)                 logical NOT
+    ("bin", op, left, right)         op is one of + - * / ^ mod < <= > >= = <> and or
+    ("if", condition, then, else)    IF ... THEN ... ELSE ...
+    ("call", function, (args, ...))  built-in function, upper case (TIME and DT take no args)
+
+Variable names are matched the way SD tools do it: case-insensitively, and
+with spaces and underscores treated as the same character, so "Birth Rate",
+"birth_rate" and "\"Birth Rate\"" all refer to the same variable. Words that
+do not match any variable are kept as ("var", word) so that callers can report
+them as undefined.
+"""
+import re
+
+
+class EquationError(ValueError):
+    """Raised when an equation cannot be parsed or does not fit the model."""
+
+
+# Built-in functions that may be used without parentheses
+CONSTANT_FUNCTIONS = {"TIME", "DT", "STARTTIME", "STOPTIME", "PI"}
+
+_KEYWORDS = {"IF", "THEN", "ELSE", "AND", "OR", "NOT", "MOD"}
+
+_TOKEN = re.compile(r"""
+    (?P<num>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+   |(?P<quoted>"[^"]*")
+   |(?P<op><=|>=|<>|==|!=|[-+*/^(),<>=])
+   |(?P<word>[A-Za-z_]\w*)
+""", re.VERBOSE)
+
+_SPACE = re.compile(r"\s*")
+_SEPARATORS = set(" \t\r\n_")
+_WORD_CHAR = re.compile(r"\w")
+
+_COMPARISONS = {"<": "<", "<=": "<=", ">": ">", ">=": ">=", "=": "=", "==": "=", "<>": "<>", "!=": "<>"}
+
+
+def canonical_name(name):
+    """Returns the form used to compare variable names: lower case, single spaces."""
+    return " ".join(re.split(r"[\s_]+", name.strip())).lower()
+
+
+def _match_name(trie, eqn, pos):
+    """
+    Returns (end, canonical name) for the longest variable name starting at
+    `pos`, or None. Any run of spaces and underscores matches one space.
+    """
+    node = trie
+    found = None
+    i = pos
+    n = len(eqn)
+    while i < n:
+        ch = eqn[i]
+        if ch in _SEPARATORS:
+            while i < n and eqn[i] in _SEPARATORS:
+                i += 1
+            ch = " "
+        else:
+            ch = ch.lower()
+            i += 1
+        node = node.get(ch)
+        if node is None:
+            break
+        if None in node and (i == n or not _WORD_CHAR.match(eqn, i)):
+            found = (i, node[None])
+    return found
+
+
+def _tokenize(eqn, trie, lookup):
+    """Splits an equation into (kind, value) tokens, matching known variable names first."""
+    tokens = []
+    pos = _SPACE.match(eqn).end()
+    while pos < len(eqn):
+        name = _match_name(trie, eqn, pos)
+        if name:
+            end, key = name
+            tokens.append(("var", lookup[key]))
+            pos = _SPACE.match(eqn, end).end()
+            continue
+        match = _TOKEN.match(eqn, pos)
+        if not match:
+            raise EquationError(f"Unexpected character {eqn[pos]!r} in equation {eqn!r}")
+        kind = match.lastgroup
+        text = match.group()
+        if kind == "quoted":
+            tokens.append(("var", lookup.get(canonical_name(text[1:-1]), text[1:-1])))
+        elif kind == "word" and text.upper() in _KEYWORDS:
+            tokens.append(("kw", text.upper()))
+        else:
+            tokens.append((kind, text))
+        pos = _SPACE.match(eqn, match.end()).end()
+    return tokens
+
+
+class _Parser:
+    """Recursive descent parser over the token list of one equation."""
+
+    def __init__(self, tokens, eqn):
+        self.tokens = tokens
+        self.eqn = eqn
+        self.pos = 0
+
+    def error(self, message):
+        return EquationError(f"{message} in equation {self.eqn!r}")
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if token[0] is None or (kind and token[0] != kind) or (value and token[1] != value):
+            expected = value or kind or "a value"
+            found = token[1] if token[0] else "end of equation"
+            raise self.error(f"Expected {expected!r} but found {found!r}")
+        self.pos += 1
+        return token
+
+    def accept(self, kind, *values):
+        token = self.peek()
+        if token[0] == kind and token[1] in values:
+            self.pos += 1
+            return token[1]
+        return None
+
+    def parse(self):
+        node = self.expression()
+        if self.pos != len(self.tokens):
+            raise self.error(f"Unexpected {self.peek()[1]!r}")
+        return node
+
+    def expression(self):
+        if self.accept("kw", "IF"):
+            condition = self.expression()
+            self.take("kw", "THEN")
+            then = self.expression()
+            self.take("kw", "ELSE")
+            return ("if", condition, then, self.expression())
+        return self.logical_or()
+
+    def logical_or(self):
+        node = self.logical_and()
+        while self.accept("kw", "OR"):
+            node = ("bin", "or", node, self.logical_and())
+        return node
+
+    def logical_and(self):
+        node = self.logical_not()
+        while self.accept("kw", "AND"):
+            node = ("bin", "and", node, self.logical_not())
+        return node
+
+    def logical_not(self):
+        if self.accept("kw", "NOT"):
+            return ("not", self.logical_not())
+        return self.comparison()
+
+    def comparison(self):
+        node = self.additive()
+        op = self.accept("op", *_COMPARISONS)
+        if op:
+            node = ("bin", _COMPARISONS[op], node, self.additive())
+        return node
+
+    def additive(self):
+        node = self.multiplicative()
+        while True:
+            op = self.accept("op", "+", "-")
+            if not op:
+                return node
+            node = ("bin", op, node, self.multiplicative())
+
+    def multiplicative(self):
+        node = self.unary()
+        while True:
+            op = self.accept("op", "*", "/") or self.accept("kw", "MOD")
+            if not op:
+                return node
+            node = ("bin", op.lower(), node, self.unary())
+
+    def unary(self):
+        if self.accept("op", "-"):
+            return ("neg", self.unary())
+        if self.accept("op", "+"):
+            return self.unary()
+        return self.power()
+
+    def power(self):
+        node = self.primary()
+        if self.accept("op", "^"):
+            # Right associative and binds tighter than a leading minus: -2^2 = -4
+            node = ("bin", "^", node, self.unary())
+        return node
+
+    def primary(self):
+        kind, text = self.peek()
+        if kind == "num":
+            self.pos += 1
+            return ("num", float(text))
+        if kind == "var":
+            self.pos += 1
+            return ("var", text)
+        if kind == "kw" and text == "IF":
+            return self.expression()
+        if self.accept("op", "("):
+            node = self.expression()
+            self.take("op", ")")
+            return node
+        if kind == "word":
+            self.pos += 1
+            if self.accept("op", "("):
+                args = []
+                if not self.accept("op", ")"):
+                    args.append(self.expression())
+                    while self.accept("op", ","):
+                        args.append(self.expression())
+                    self.take("op", ")")
+                return ("call", text.upper(), tuple(args))
+            if text.upper() in CONSTANT_FUNCTIONS:
+                return ("call", text.upper(), ())
+            # Unknown name: keep it so that the caller can report it
+            return ("var", text)
+        raise self.error(f"Unexpected {text!r}" if kind else "Unexpected end")
+
+
+def compile_eqn_parser(variable_names):
+    """
+    Builds a function that parses equations for a fixed list of variable names.
+    The name matcher is compiled once per model, so call this once and reuse
+    the result for every equation of the model. Syntax trees are cached per
+    equation string, so equations that repeat (such as "0") are parsed once.
+    """
+    lookup = {}
+    for name in variable_names:
+        if canonical_name(name):
+            lookup.setdefault(canonical_name(name), name)
+
+    # Character trie of the canonical names; the tokenizer takes the longest match,
+    # so that "Birth Rate" wins over "Birth"
+    trie = {}
+    for key in lookup:
+        node = trie
+        for ch in key:
+            node = node.setdefault(ch, {})
+        node[None] = key
+
+    trees = {}
+
+    def parse(eqn):
+        if isinstance(eqn, (int, float)) and not isinstance(eqn, bool):
+            return ("num", float(eqn))
+        if not isinstance(eqn, str) or not eqn.strip():
+            raise EquationError(f"Empty or invalid equation {eqn!r}")
+        tree = trees.get(eqn)
+        if tree is None:
+            tree = trees[eqn] = _Parser(_tokenize(eqn, trie, lookup), eqn).parse()
+        return tree
+
+    return parse
+
+
+def references(node, found=None):
+    """Returns the set of variable names referenced by a syntax tree."""
+    if found is None:
+        found = set()
+    kind = node[0]
+    if kind == "var":
+        found.add(node[1])
+    elif kind in ("neg", "not"):
+        references(node[1], found)
+    elif kind == "bin":
+        references(node[2], found)
+        references(node[3], found)
+    elif kind == "if":
+        for child in node[1:]:
+            references(child, found)
+    elif kind == "call":
+        for arg in node[2]:
+            references(arg, found)
+    return found
+
+
+def uses_time(node):
+    """Returns True if the syntax tree calls a time-dependent built-in."""
+    kind = node[0]
+    if kind == "call":
+        return node[1] in ("TIME", "STEP", "PULSE", "RAMP") or any(uses_time(arg) for arg in node[2])
+    if kind in ("neg", "not"):
+        return uses_time(node[1])
+    if kind == "bin":
+        return uses_time(node[2]) or uses_time(node[3])
+    if kind == "if":
+        return any(uses_time(child) for child in node[1:])
+    return False
@@ -0,0 +1,558 @@
+"""
+Concurrent extraction of model data from many diagram images.
+
+The image script handles one diagram per run with a blocking API call. This
+module runs a whole folder of diagrams through the async clients of the
+OpenAI and Gemini SDKs:
+
+* one client per provider, reused for every image;
+* at most `concurrency` requests in flight at once;
+* a token bucket per provider that keeps the request rate under the quota;
+* retries with jittered exponential backoff on 429 and 5xx responses
+  (honouring Retry-After when the server sends it);
+* images downsampled and re-encoded before upload (sdmodel.images);
+* the same on-disk cache as the image script (sdmodel.cache);
+* optionally, streamed responses parsed entry by entry (sdmodel.jsonstream),
+  so that malformed output is abandoned and retried early;
+* spans (sdmodel.instrument) for preprocessing, each API call and parsing,
+  with payload sizes, token usage and retries, when a sink is registered.
+
+    python -m sdmodel.extraction diagrams/*.png --provider openai -o extracted/ --concurrency 16 --rpm 500 \
+        --trace trace.jsonl
+
+`--base-url` points the client at another endpoint, e.g. a local fake server
+for testing. The SDKs are imported when the first client is created.
+"""
+import asyncio
+import base64
+import contextlib
+import glob
+import json
+import os
+import random
+import re
+import time
+
+from sdmodel import instrument
+from sdmodel.cache import ExtractionCache, cache_key
+from sdmodel.images import PREPROCESS, preprocess_file, sniff_mime_type
+from sdmodel.jsonstream import JSONStreamError, ModelStreamParser
+
+# Prompt sent with every image (shared with the image script, so that both use the same cache entries)
+EXTRACTION_PROMPT = (
+    "Analyze the following image of a stock and flow diagram in System Dynamics. "
+    "Extract the following information in JSON format: stocks, flows, auxiliaries, and connectors. "
+    "Return a JSON object with keys: 'stocks', 'flows', 'auxiliaries', 'connectors'. "
+    "Each of 'stocks', 'flows', and 'auxiliaries' should be an array of objects with a 'name' property, a 'description' property for adding documentation and explanation for each variable suggested by you, a 'unit' property for reasonable units that you suggest, and an 'eqn' property for sound equations that you suggest. (Note: you should suggest numbers instead of formulas in 'string' type for all the stocks)"
+    "As well as their relative location information in the given image: 'x' and 'y' coordinates (in pixels). "
+    "For stocks, also extract 'inflows' and 'outflows' as lists of flow names. "
+    "List all the names as original. "
+    "Each connector should be an object with properties 'src' and 'tgt' and ONLY take the arrow links between model variables into account. "
+    "You need to add the causal links from 'stock' to 'flow' in the 'connectors' part if the variable name of 'stock' is used in the suggested 'flow' equation. "
+    "To avoid any omissions, make sure and check every object with properties 'src' and 'tgt' in 'connectors' has been classified as either 'stocks', or 'flows', or 'auxiliaries'. "
+    "Add their causal relationships in 'connectors' part if any variable is used as part of the equation of another variable. "
+)
+
+# Default models and generation settings, the same as in the image script
+DEFAULT_MODELS = {"OPENAI": "gpt-4o", "GEMINI": "gemini-2.0-flash"}
+DEFAULT_CONFIGS = {
+    "OPENAI": {"temperature": 1, "top_p": 0.1},
+    "GEMINI": {"temperature": 0.2, "top_p": 0.95, "top_k": 20},
+}
+API_KEY_VARIABLES = {"OPENAI": "OPENAI_API_KEY", "GEMINI": "GEMINI_API_KEY"}
+
+# HTTP status codes that are worth retrying
+RETRY_STATUS = {408, 409, 429}
+
+
+def parse_model_json(text):
+    """
+    Returns the model data in an LLM response, after removing code fences and
+    any text around the outermost JSON object.
+    """
+    if not text or not text.strip():
+        raise ValueError("API returned an empty response. Check your model access, prompt, and image input.")
+    text = re.sub(r"```(?:json)?", "", text).strip()
+    json_match = re.search(r'\{.*\}', text, re.DOTALL)
+    if not json_match:
+        raise ValueError("No valid JSON found in API response")
+    return json.loads(json_match.group())
+
+
+# Keys of model_data that hold lists of variables, and of connectors
+VARIABLE_KEYS = ("stocks", "flows", "auxiliaries")
+
+
+def validate_model_data(model_data):
+    """
+    Checks that extracted model data has the expected shape: a JSON object
+    whose 'stocks', 'flows' and 'auxiliaries' are lists of objects with a
+    string 'name', and whose 'connectors' are objects with 'src' and 'tgt'.
+    At least one stock, flow or auxiliary is required. Raises ValueError.
+    """
+    if not isinstance(model_data, dict):
+        raise ValueError(f"Expected a JSON object, got {type(model_data).__name__}")
+    for category in VARIABLE_KEYS + ("connectors",):
+        items = model_data.get(category, [])
+        if not isinstance(items, list):
+            raise ValueError(f"'{category}' should be a list")
+        for item in items:
+            validate_item(category, item)
+    if not any(model_data.get(category) for category in VARIABLE_KEYS):
+        raise ValueError("No stocks, flows or auxiliaries found in API response")
+
+
+def validate_item(category, item):
+    """Checks one entry of model_data[category]. Raises ValueError."""
+    if not isinstance(item, dict):
+        raise ValueError(f"Every entry of '{category}' should be an object")
+    if category == "connectors":
+        if not isinstance(item.get("src"), str) or not isinstance(item.get("tgt"), str):
+            raise ValueError("Every connector needs string 'src' and 'tgt' properties")
+    elif category in VARIABLE_KEYS and (not isinstance(item.get("name"), str) or not item["name"].strip()):
+        raise ValueError(f"Every entry of '{category}' needs a 'name'")
+
+
+def parse_model_stream(chunks, on_item=None):
+    """
+    Parses model data from an iterable of text pieces, such as the deltas of
+    a streamed response. Every entry is validated as soon as it is complete,
+    and JSONStreamError is raised at the first malformed one; reading stops
+    there, and as soon as the JSON object is closed. `on_item(category, item)`
+    is called for each entry.
+    """
+    parser = ModelStreamParser(on_item=on_item, validate_item=validate_item)
+    received = 0
+    for text in chunks:
+        received += len(text)
+        parser.feed(text)
+        if parser.done:
+            break
+    instrument.annotate(response_chars=received)
+    return _finish_stream(parser)
+
+
+async def stream_model_data(chunks, on_item=None):
+    """parse_model_stream() for an async iterator; the iterator is closed when parsing stops."""
+    parser = ModelStreamParser(on_item=on_item, validate_item=validate_item)
+    received = 0
+    async with contextlib.aclosing(chunks):
+        async for text in chunks:
+            received += len(text)
+            parser.feed(text)
+            if parser.done:
+                break
+    instrument.annotate(response_chars=received)
+    return _finish_stream(parser)
+
+
+def _finish_stream(parser):
+    model_data = parser.close()
+    if not any(model_data.get(category) for category in VARIABLE_KEYS):
+        raise JSONStreamError("No stocks, flows or auxiliaries found in API response")
+    return model_data
+
+
+async def request_model_data(provider, image_bytes, mime_type, prompt=EXTRACTION_PROMPT, streaming=False,
+                             on_item=None):
+    """
+    Sends one image to `provider` and returns the validated model data. With
+    streaming=True the response is parsed while it arrives (provider.stream);
+    otherwise the complete text is parsed (provider.request). Recorded as an
+    "api_call" span (parsing included when streaming) and a "parse" span.
+    """
+    with instrument.span("api_call", provider=provider.name, model=getattr(provider, "model", None),
+                         streaming=streaming, payload_bytes=len(image_bytes)) as span:
+        if streaming:
+            return await stream_model_data(provider.stream(image_bytes, mime_type, prompt), on_item=on_item)
+        text = await provider.request(image_bytes, mime_type, prompt)
+        span.set(response_chars=len(text or ""))
+    with instrument.span("parse"):
+        model_data = parse_model_json(text)
+        validate_model_data(model_data)
+    return model_data
+
+
+class TokenBucket:
+    """
+    Async token bucket: `rate` tokens per second, holding up to `capacity`.
+    acquire() waits until a token is available. Share one bucket between
+    all the requests sent to the same provider.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens=1):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+
+def _status_code(exc):
+    """Returns the HTTP status of an SDK error, or None."""
+    for attribute in ("status_code", "code", "status"):
+        value = getattr(exc, attribute, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def is_retryable(exc):
+    """True for rate limits, server errors, timeouts and dropped connections."""
+    status = _status_code(exc)
+    if status is not None:
+        return status in RETRY_STATUS or status >= 500
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    if isinstance(exc, JSONStreamError):
+        # Malformed streamed output was abandoned early; another sample is usually fine
+        return True
+    # SDK connection and timeout errors (openai.APIConnectionError, httpx.ReadTimeout, ...)
+    return any(word in type(exc).__name__ for word in ("Connection", "Timeout"))
+
+
+def _retry_after(exc):
+    """Returns the delay asked for by a Retry-After header, or None."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base=1.0, maximum=60.0):
+    """Full-jitter exponential backoff: a random delay up to base * 2**attempt."""
+    return random.uniform(0, min(maximum, base * 2 ** attempt))
+
+
+class OpenAIProvider:
+    """Sends images to the OpenAI Responses API with one AsyncOpenAI client."""
+
+    name = "OPENAI"
+
+    def __init__(self, api_key, model=None, config=None, base_url=None, timeout=120):
+        from openai import AsyncOpenAI
+
+        self.model = model or DEFAULT_MODELS[self.name]
+        self.config = DEFAULT_CONFIGS[self.name] if config is None else config
+        # Retries are handled by the extractor, so that they share its backoff and rate limit
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=0)
+
+    def _create(self, image_bytes, mime_type, prompt, stream):
+        base64_image = base64.b64encode(image_bytes).decode("utf-8")
+        return self.client.responses.create(
+            model=self.model,
+            input=[
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "input_text", "text": prompt},
+                        {"type": "input_image", "image_url": f"data:{mime_type};base64,{base64_image}"},
+                    ],
+                }
+            ],
+            text={"format": {"type": "json_object"}},
+            stream=stream,
+            **self.config
+        )
+
+    async def request(self, image_bytes, mime_type, prompt):
+        response = await self._create(image_bytes, mime_type, prompt, stream=False)
+        instrument.record_usage(getattr(response, "usage", None))
+        return response.output_text
+
+    async def stream(self, image_bytes, mime_type, prompt):
+        """Yields the text of the response as it arrives."""
+        async with await self._create(image_bytes, mime_type, prompt, stream=True) as events:
+            async for event in events:
+                if event.type == "response.output_text.delta":
+                    yield event.delta
+                elif event.type == "response.completed":
+                    instrument.record_usage(getattr(event.response, "usage", None))
+
+    async def aclose(self):
+        await self.client.close()
+
+
+class GeminiProvider:
+    """Sends images to Gemini generate_content with one genai.Client (its async interface)."""
+
+    name = "GEMINI"
+
+    def __init__(self, api_key, model=None, config=None, base_url=None, timeout=120):
+        from google import genai
+        from google.genai import types
+
+        self.types = types
+        self.model = model or DEFAULT_MODELS[self.name]
+        self.config = DEFAULT_CONFIGS[self.name] if config is None else config
+        http_options = types.HttpOptions(base_url=base_url, timeout=int(timeout * 1000))
+        self.client = genai.Client(api_key=api_key, http_options=http_options)
+
+    def _arguments(self, image_bytes, mime_type, prompt):
+        # The image is sent as raw bytes, so Pillow is not needed here
+        return {
+            "model": self.model,
+            "contents": [prompt, self.types.Part.from_bytes(data=image_bytes, mime_type=mime_type)],
+            "config": self.types.GenerateContentConfig(**self.config),
+        }
+
+    async def request(self, image_bytes, mime_type, prompt):
+        response = await self.client.aio.models.generate_content(**self._arguments(image_bytes, mime_type, prompt))
+        instrument.record_usage(getattr(response, "usage_metadata", None))
+        return response.text
+
+    async def stream(self, image_bytes, mime_type, prompt):
+        """Yields the text of the response as it arrives."""
+        chunks = await self.client.aio.models.generate_content_stream(**self._arguments(image_bytes, mime_type, prompt))
+        async with contextlib.aclosing(chunks):
+            async for chunk in chunks:
+                # Every chunk carries the usage so far
+                instrument.record_usage(getattr(chunk, "usage_metadata", None))
+                if chunk.text:
+                    yield chunk.text
+
+    async def aclose(self):
+        aclose = getattr(self.client.aio, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+
+PROVIDERS = {"OPENAI": OpenAIProvider, "GEMINI": GeminiProvider}
+
+
+class BatchExtractor:
+    """
+    Extracts model data from many images through one provider.
+
+    `provider` is an OpenAIProvider, a GeminiProvider, or any object with an
+    async request(image_bytes, mime_type, prompt) method that returns the
+    response text (and, for streaming=True, an async stream() generator of
+    text pieces). `requests_per_minute` feeds the token bucket (None for no
+    limit); pass a shared `limiter` instead to split one quota between several
+    extractors. `preprocess` holds the sdmodel.images settings applied to
+    each file, or None to send the files unchanged. Set `cache` to None to
+    always call the API. With streaming=True responses are parsed while they
+    arrive, and `on_item(category, item)` sees each entry as soon as it is
+    complete (including the entries of attempts that are retried later).
+    """
+
+    def __init__(self, provider, concurrency=8, requests_per_minute=None, limiter=None, max_retries=5,
+                 backoff=1.0, max_backoff=60.0, cache="default", prompt=EXTRACTION_PROMPT, preprocess=PREPROCESS,
+                 streaming=False, on_item=None):
+        self.provider = provider
+        self.streaming = streaming
+        self.on_item = on_item
+        self.preprocess = preprocess
+        self.semaphore = asyncio.Semaphore(concurrency)
+        if limiter is None and requests_per_minute:
+            limiter = TokenBucket(requests_per_minute / 60.0, capacity=max(1.0, min(concurrency, requests_per_minute / 60.0)))
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.cache = ExtractionCache() if cache == "default" else cache
+        self.prompt = prompt
+
+    def _key(self, image_bytes):
+        return cache_key(image_bytes, self.prompt, self.provider.name, self.provider.model, self.provider.config)
+
+    async def extract(self, image_bytes, mime_type="image/png"):
+        """
+        Returns (model_data, attempts) for one image. Retryable errors, and
+        malformed streamed output, are retried up to max_retries times; the
+        last error is raised. Recorded as an "extract" span with the cache
+        outcome, the number of retries and the time spent backing off.
+        """
+        with instrument.span("extract", provider=self.provider.name) as span:
+            key = self._key(image_bytes) if self.cache is not None else None
+            if key is not None:
+                model_data = self.cache.get(key)
+                if model_data is not None:
+                    span.set(cache="hit", retries=0)
+                    return model_data, 0
+            span.set(cache="miss" if key is not None else "off")
+
+            attempt = 0
+            while True:
+                attempt += 1
+                try:
+                    async with self.semaphore:
+                        if self.limiter is not None:
+                            await self.limiter.acquire()
+                        model_data = await request_model_data(self.provider, image_bytes, mime_type, self.prompt,
+                                                              self.streaming, self.on_item)
+                    break
+                except Exception as e:
+                    if attempt > self.max_retries or not is_retryable(e):
+                        span.set(retries=attempt - 1)
+                        raise
+                    delay = _retry_after(e)
+                    if delay is None:
+                        delay = backoff_delay(attempt - 1, self.backoff, self.max_backoff)
+                    span.add("backoff_seconds", delay)
+                    await asyncio.sleep(delay)
+            span.set(retries=attempt - 1)
+
+            if key is not None:
+                self.cache.put(key, model_data)
+            return model_data, attempt
+
+    async def extract_file(self, image_path):
+        """
+        Reads, preprocesses and extracts one image file. Returns a result dict
+        (see extract_many); errors are reported in it instead of raised.
+        """
+        started = time.perf_counter()
+        try:
+            with instrument.span("image", image=image_path):
+                with instrument.span("preprocess", preprocess=self.preprocess is not None) as span:
+                    if self.preprocess is not None:
+                        image_bytes, mime_type = await asyncio.to_thread(preprocess_file, image_path,
+                                                                         **self.preprocess)
+                    else:
+                        image_bytes = await asyncio.to_thread(_read_bytes, image_path)
+                        mime_type = sniff_mime_type(image_bytes)
+                    span.set(image_bytes=len(image_bytes))
+                model_data, attempts = await self.extract(image_bytes, mime_type)
+            error = None
+        except Exception as e:
+            model_data, attempts, error = None, None, f"{type(e).__name__}: {e}"
+        return {"image": image_path, "model_data": model_data, "attempts": attempts, "error": error,
+                "seconds": time.perf_counter() - started}
+
+    async def extract_many(self, image_paths, on_result=None):
+        """
+        Extracts every image concurrently. Returns one result dict per image,
+        in input order, with keys 'image', 'model_data', 'attempts' (0 for a
+        cache hit), 'error' and 'seconds'. `on_result` is called with each
+        result as soon as it is ready.
+        """
+        tasks = [asyncio.create_task(self.extract_file(path)) for path in image_paths]
+        for task in asyncio.as_completed(tasks):
+            result = await task
+            if on_result is not None:
+                on_result(result)
+        return [task.result() for task in tasks]
+
+    async def aclose(self):
+        aclose = getattr(self.provider, "aclose", None)
+        if aclose is not None:
+            await aclose()
+        if self.cache is not None:
+            self.cache.close()
+
+
+def _read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def find_images(inputs, extensions=(".png", ".jpg", ".jpeg", ".webp", ".gif")):
+    """Expands files, directories and glob patterns into a sorted list of image paths."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            candidates = glob.glob(os.path.join(item, "**", "*"), recursive=True)
+        else:
+            candidates = glob.glob(item) or [item]
+        paths.extend(p for p in candidates if p.lower().endswith(extensions) and os.path.isfile(p))
+    return sorted(set(paths))
+
+
+async def extract_images(image_paths, provider="OPENAI", api_key=None, model=None, config=None, base_url=None,
+                         concurrency=8, requests_per_minute=None, max_retries=5, use_cache=True, preprocess=PREPROCESS,
+                         streaming=False, on_result=None):
+    """
+    Extracts model data from image_paths with one reused client for `provider`
+    ('OPENAI' or 'GEMINI'). The API key defaults to the OPENAI_API_KEY or
+    GEMINI_API_KEY environment variable. Returns the results of
+    BatchExtractor.extract_many.
+    """
+    provider = provider.upper()
+    if api_key is None:
+        api_key = os.environ.get(API_KEY_VARIABLES[provider])
+    client = PROVIDERS[provider](api_key, model=model, config=config, base_url=base_url)
+    extractor = BatchExtractor(client, concurrency=concurrency, requests_per_minute=requests_per_minute,
+                               max_retries=max_retries, cache="default" if use_cache else None, preprocess=preprocess,
+                               streaming=streaming)
+    try:
+        return await extractor.extract_many(image_paths, on_result=on_result)
+    finally:
+        await extractor.aclose()
+
+
+def main():
+    # Only the command line needs argparse; it would add about 15 ms to every import of this module
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Extract stock and flow models from many diagram images.")
+    parser.add_argument("inputs", nargs="+", help="image files, directories or glob patterns")
+    parser.add_argument("--provider", type=str.upper, choices=sorted(PROVIDERS), default="OPENAI")
+    parser.add_argument("--model", help="model name (default: gpt-4o / gemini-2.0-flash)")
+    parser.add_argument("-o", "--output-dir", default="extracted", help="where to write the JSON files")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight (default 8)")
+    parser.add_argument("--rpm", type=float, help="maximum requests per minute")
+    parser.add_argument("--retries", type=int, default=5, help="retries on 429/5xx errors (default 5)")
+    parser.add_argument("--base-url", help="API endpoint, e.g. a local test server")
+    parser.add_argument("--no-cache", action="store_true", help="always call the API")
+    parser.add_argument("--max-edge", type=int, default=PREPROCESS["max_edge"],
+                        help=f"longest image edge in pixels (default {PREPROCESS['max_edge']})")
+    parser.add_argument("--format", type=str.upper, choices=["PNG", "JPEG", "WEBP"], default=PREPROCESS["format"],
+                        help="image encoding sent to the API (default PNG)")
+    parser.add_argument("--color", action="store_true", help="keep colours instead of converting to grayscale")
+    parser.add_argument("--no-preprocess", action="store_true", help="send the image files unchanged")
+    parser.add_argument("--stream", action="store_true",
+                        help="parse responses while they arrive and retry malformed ones early")
+    parser.add_argument("--trace", help="append timing, size and token records to this JSON lines file")
+    args = parser.parse_args()
+
+    image_paths = find_images(args.inputs)
+    if not image_paths:
+        parser.error("no images found")
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    def save(result):
+        name = os.path.splitext(os.path.basename(result["image"]))[0] + ".json"
+        if result["error"]:
+            print(f"FAILED {result['image']}: {result['error']}")
+            return
+        with open(os.path.join(args.output_dir, name), "w") as outfile:
+            json.dump(result["model_data"], outfile, indent=2)
+        print(f"{result['image']} -> {name} ({result['seconds']:.1f} s, {result['attempts']} attempts)")
+
+    preprocess = None if args.no_preprocess else {
+        **PREPROCESS, "max_edge": args.max_edge, "format": args.format, "grayscale": not args.color}
+    if args.trace:
+        instrument.add_sink(instrument.JSONLinesSink(args.trace))
+        collected = instrument.add_sink(instrument.MemorySink())
+    started = time.perf_counter()
+    results = asyncio.run(extract_images(image_paths, args.provider, model=args.model, base_url=args.base_url,
+                                         concurrency=args.concurrency, requests_per_minute=args.rpm,
+                                         max_retries=args.retries, use_cache=not args.no_cache,
+                                         preprocess=preprocess, streaming=args.stream, on_result=save))
+    failed = sum(1 for r in results if r["error"])
+    elapsed = time.perf_counter() - started
+    print(f"\nExtracted {len(results) - failed} of {len(results)} images in {elapsed:.1f} s ({failed} failed)")
+    if args.trace:
+        instrument.print_summary(collected.records)
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+Dependency graph and validation of model_data.
+
+build_dependency_graph() parses every equation once and records which
+variables each one refers to. validate_model() uses the graph to report:
+
+* variables defined more than once, equations that do not parse and
+  references to undefined names;
+* algebraic loops between flows and auxiliaries, and loops between initial
+  values;
+* stock inflows and outflows that are not flows of the model;
+* connectors that are not backed by an equation reference, and equation
+  references that have no connector.
+
+Everything runs in time linear in the size of the model (equations are
+matched against a trie of the variable names, and loops are found with
+Tarjan's algorithm), so validation is cheap enough to run before every
+conversion. Only the standard library is used.
+
+    python -m sdmodel.graph model.json
+"""
+import argparse
+import json
+
+from sdmodel.equations import EquationError, canonical_name, compile_eqn_parser, references
+from sdmodel.model import CATEGORIES, to_model_data
+
+
+def build_dependency_graph(model_data):
+    """
+    Parses the equations of model_data. Returns a dict with:
+
+        'names'         all variable names, stocks first, then flows and auxiliaries
+        'kinds'         {name: 'stock', 'flow' or 'aux'}
+        'trees'         {name: syntax tree} for every equation that parsed
+        'deps'          {name: set of names referenced by its equation}
+        'duplicates'    names defined more than once
+        'missing'       variables without an equation
+        'parse_errors'  {name: message}
+    """
+    model_data = to_model_data(model_data)
+    names = []
+    kinds = {}
+    duplicates = []
+    for kind, category in CATEGORIES:
+        for item in model_data.get(category, []):
+            name = item["name"]
+            if name in kinds:
+                duplicates.append(name)
+                continue
+            names.append(name)
+            kinds[name] = kind
+
+    parse = compile_eqn_parser(names)
+    trees = {}
+    deps = {}
+    missing = []
+    parse_errors = {}
+    for _, category in CATEGORIES:
+        for item in model_data.get(category, []):
+            name = item["name"]
+            if name in trees or name in parse_errors:
+                continue
+            eqn = item.get("eqn")
+            if eqn is None or eqn == "":
+                missing.append(name)
+                deps.setdefault(name, set())
+                continue
+            try:
+                tree = parse(eqn)
+            except EquationError as e:
+                parse_errors[name] = str(e)
+                deps[name] = set()
+                continue
+            trees[name] = tree
+            deps[name] = references(tree)
+    return {"names": names, "kinds": kinds, "trees": trees, "deps": deps, "duplicates": duplicates,
+            "missing": missing, "parse_errors": parse_errors}
+
+
+def topological_order(names, deps):
+    """
+    Orders `names` so that every name comes after its dependencies. Names that
+    are part of, or depend on, a loop are left out of the result. Dependencies
+    outside `names` are ignored.
+    """
+    known = set(names)
+    pending = {}
+    users = {name: [] for name in names}
+    for name in names:
+        count = 0
+        for dep in deps[name]:
+            if dep in known:
+                users[dep].append(name)
+                count += 1
+        pending[name] = count
+    ready = [name for name in names if pending[name] == 0]
+    order = []
+    while ready:
+        name = ready.pop()
+        order.append(name)
+        for user in users[name]:
+            pending[user] -= 1
+            if pending[user] == 0:
+                ready.append(user)
+    return order
+
+
+def find_loops(names, deps):
+    """
+    Returns the loops among `names` as sorted lists of names: every strongly
+    connected group of two or more variables, and every variable that refers
+    to itself. Dependencies outside `names` are ignored.
+    """
+    known = set(names)
+    number = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    loops = []
+    counter = 0
+    for root in names:
+        if root in number:
+            continue
+        number[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(deps[root]))]
+        while work:
+            node, children = work[-1]
+            for dep in children:
+                if dep not in known:
+                    continue
+                if dep not in number:
+                    number[dep] = low[dep] = counter
+                    counter += 1
+                    stack.append(dep)
+                    on_stack.add(dep)
+                    work.append((dep, iter(deps[dep])))
+                    break
+                if dep in on_stack:
+                    low[node] = min(low[node], number[dep])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == number[node]:
+                    group = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        group.append(member)
+                        if member == node:
+                            break
+                    if len(group) > 1 or node in deps[node]:
+                        loops.append(sorted(group))
+    return sorted(loops)
+
+
+def _issue(severity, kind, variable, message):
+    return {"severity": severity, "kind": kind, "variable": variable, "message": message}
+
+
+def validate_model(model_data, graph=None):
+    """
+    Checks model_data and returns a list of issues, each a dict with
+    'severity' ('error' or 'warning'), 'kind', 'variable' and 'message'.
+    Errors make the model impossible to simulate; warnings point at
+    connectors and equations that disagree.
+    Pass the result of build_dependency_graph as `graph` to reuse it.
+    """
+    model_data = to_model_data(model_data)
+    if graph is None:
+        graph = build_dependency_graph(model_data)
+    kinds, trees, deps = graph["kinds"], graph["trees"], graph["deps"]
+    issues = []
+
+    for name in graph["duplicates"]:
+        issues.append(_issue("error", "duplicate", name, f"Variable {name!r} is defined more than once"))
+    for name, message in graph["parse_errors"].items():
+        issues.append(_issue("error", "parse", name, f"Equation of {name!r} cannot be parsed: {message}"))
+    for name in graph["missing"]:
+        issues.append(_issue("warning", "no_equation", name, f"Variable {name!r} has no equation"))
+    for name in graph["names"]:
+        undefined = sorted(ref for ref in deps[name] if ref not in kinds)
+        if undefined:
+            issues.append(_issue("error", "undefined", name,
+                                 f"Equation of {name!r} refers to undefined name(s): {', '.join(undefined)}"))
+
+    # Flows and auxiliaries are computed from each other within a time step; stocks break loops
+    computed = [name for name in graph["names"] if kinds[name] != "stock"]
+    computed_deps = {name: {dep for dep in deps[name] if kinds.get(dep) in ("flow", "aux")} for name in computed}
+    for loop in find_loops(computed, computed_deps):
+        issues.append(_issue("error", "loop", loop[0], f"Algebraic loop involving: {', '.join(loop)}"))
+    # Initial values are computed from all equations, including the stocks' initial value equations
+    for loop in find_loops(graph["names"], deps):
+        if any(kinds[name] == "stock" for name in loop):
+            issues.append(_issue("error", "initial_loop", loop[0],
+                                 f"The initial values of these variables depend on each other in a loop: "
+                                 f"{', '.join(loop)}"))
+
+    # Stock inflows and outflows must be flows of the model (written with spaces or underscores)
+    flows = {}
+    for name in graph["names"]:
+        if kinds[name] == "flow":
+            flows.setdefault(name, name)
+            flows.setdefault(name.replace(" ", "_"), name)
+    for stock in model_data.get("stocks", []):
+        for key in ("inflows", "outflows"):
+            for flow in stock.get(key, []):
+                if flow not in flows:
+                    issues.append(_issue("error", "unknown_flow", stock["name"],
+                                         f"Stock {stock['name']!r} lists unknown flow {flow!r} in its {key}"))
+
+    # Connectors should match the references of the target's equation, and the other way round
+    lookup = {}
+    for name in graph["names"]:
+        lookup.setdefault(canonical_name(name), name)
+
+    def resolve(name):
+        # Exact names are the common case; otherwise match "Birth_Rate" to "Birth Rate"
+        if name in kinds:
+            return name
+        return lookup.get(canonical_name(name)) if isinstance(name, str) else None
+
+    links = set()
+    for conn in model_data.get("connectors", []):
+        src, tgt = conn.get("src"), conn.get("tgt")
+        resolved_src, resolved_tgt = resolve(src), resolve(tgt)
+        if resolved_src is None or resolved_tgt is None:
+            unknown = src if resolved_src is None else tgt
+            issues.append(_issue("warning", "unknown_connector", unknown,
+                                 f"Connector {src!r} -> {tgt!r} refers to unknown variable {unknown!r}"))
+            continue
+        if (resolved_src, resolved_tgt) in links:
+            continue
+        links.add((resolved_src, resolved_tgt))
+        if resolved_tgt in trees and resolved_src not in deps[resolved_tgt]:
+            issues.append(_issue("warning", "extra_connector", resolved_tgt,
+                                 f"Connector {src!r} -> {tgt!r} is not used by the equation of {tgt!r}"))
+    for name in computed:
+        if name not in trees:
+            continue
+        for dep in sorted(deps[name]):
+            if dep in kinds and dep != name and (dep, name) not in links:
+                issues.append(_issue("warning", "missing_connector", name,
+                                     f"Equation of {name!r} uses {dep!r} but there is no connector {dep!r} -> {name!r}"))
+    return issues
+
+
+def print_issues(issues, limit=20):
+    """Prints the number of errors and warnings, and the first `limit` issues."""
+    errors = sum(1 for issue in issues if issue["severity"] == "error")
+    print(f"\nValidation: {errors} error(s), {len(issues) - errors} warning(s)")
+    ordered = sorted(issues, key=lambda issue: issue["severity"] != "error")
+    for issue in ordered[:limit]:
+        print(f"  {issue['severity']}: {issue['message']}")
+    if len(issues) > limit:
+        print(f"  ... and {len(issues) - limit} more")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the equations and connectors of a JSON stock and flow model.")
+    parser.add_argument("model", help="path to the model JSON file")
+    parser.add_argument("--limit", type=int, default=50, help="issues to print (default 50)")
+    args = parser.parse_args()
+
+    with open(args.model, "r") as f:
+        model_data = json.load(f)
+    issues = validate_model(model_data)
+    print_issues(issues, args.limit)
+    if any(issue["severity"] == "error" for issue in issues):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""
+Hedged extraction: race two providers and keep the first valid answer.
+
+The image is sent to the primary provider first. If no valid answer has
+arrived after `hedge_delay` seconds, or the primary fails sooner, the same
+request goes to the secondary provider. The first response that parses and
+passes validate_model_data() wins, and the other request is cancelled.
+
+Every attempt's latency is recorded per provider in a LatencyTracker. The
+tracker is saved between runs, and hedge_delay="auto" waits for the
+primary's 95th percentile before hedging:
+
+    python -m sdmodel.hedging diagram.png --primary openai --delay auto
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from collections import deque
+
+from sdmodel import instrument
+from sdmodel.cache import ExtractionCache, cache_key
+from sdmodel.extraction import (API_KEY_VARIABLES, DEFAULT_CONFIGS, DEFAULT_MODELS, EXTRACTION_PROMPT, PROVIDERS,
+                                request_model_data)
+from sdmodel.images import PREPROCESS, preprocess_file, sniff_mime_type
+
+# Where latency samples are kept between runs, overridable with the SD_LATENCY_FILE environment variable
+DEFAULT_LATENCY_FILE = os.path.join(os.path.expanduser("~"), ".cache", "sd_model_extraction", "latency.json")
+
+# Hedge delay used until a provider has enough latency samples
+DEFAULT_HEDGE_DELAY = 10.0
+MIN_SAMPLES = 20
+
+
+class LatencyTracker:
+    """
+    Recent request latencies per provider, in seconds, as (seconds, censored)
+    samples. A cancelled request that lost the race is censored: it only
+    shows that the latency was at least that long. The percentiles are
+    Kaplan-Meier estimates, so censored samples keep the slow tail in the
+    estimate without being taken for finished requests, which would pull
+    the "auto" hedge delay down and make hedging more and more frequent.
+    Failures are counted separately.
+    """
+
+    def __init__(self, max_samples=1000):
+        self.max_samples = max_samples
+        self.samples = {}
+        self.failures = {}
+
+    def record(self, provider, seconds, ok=True, cancelled=False):
+        """Records a finished request, a failure (ok=False) or a lower bound (cancelled=True)."""
+        if ok:
+            self.samples.setdefault(provider, deque(maxlen=self.max_samples)).append((seconds, cancelled))
+        else:
+            self.failures[provider] = self.failures.get(provider, 0) + 1
+
+    def completed(self, provider):
+        """The number of finished (not cancelled) requests recorded for `provider`."""
+        return sum(1 for _, censored in self.samples.get(provider, ()) if not censored)
+
+    def percentile(self, provider, q):
+        """
+        Returns the q-th percentile (0-100) of the provider's latency, or None
+        without finished requests. When the cancelled requests hide the
+        percentile, the longest recorded time is returned as a lower bound.
+        """
+        samples = sorted(self.samples.get(provider, ()))
+        if not any(not censored for _, censored in samples):
+            return None
+        # Finished requests sort before cancelled ones of the same length, as Kaplan-Meier expects
+        at_risk = len(samples)
+        survival = 1.0
+        for seconds, censored in samples:
+            if not censored:
+                survival *= 1 - 1 / at_risk
+                if survival <= 1 - q / 100 + 1e-9:
+                    return seconds
+            at_risk -= 1
+        return samples[-1][0]
+
+    def summary(self):
+        """Returns {provider: {'count', 'cancelled', 'failures', 'p50', 'p90', 'p95', 'p99'}}."""
+        summary = {}
+        for provider in sorted(set(self.samples) | set(self.failures)):
+            completed = self.completed(provider)
+            stats = {"count": completed, "cancelled": len(self.samples.get(provider, ())) - completed,
+                     "failures": self.failures.get(provider, 0)}
+            for q in (50, 90, 95, 99):
+                stats[f"p{q}"] = self.percentile(provider, q)
+            summary[provider] = stats
+        return summary
+
+    def hedge_delay(self, provider, q=95, default=DEFAULT_HEDGE_DELAY):
+        """The q-th percentile latency of `provider` once it has MIN_SAMPLES finished requests, else `default`."""
+        if self.completed(provider) < MIN_SAMPLES:
+            return default
+        return self.percentile(provider, q)
+
+    def save(self, path=None):
+        path = path or os.environ.get("SD_LATENCY_FILE", DEFAULT_LATENCY_FILE)
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        data = {"samples": {p: [list(sample) for sample in v] for p, v in self.samples.items()},
+                "failures": self.failures}
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(data, f)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path=None, max_samples=1000):
+        """Returns the tracker saved at `path`, or an empty one."""
+        tracker = cls(max_samples)
+        path = path or os.environ.get("SD_LATENCY_FILE", DEFAULT_LATENCY_FILE)
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return tracker
+        for provider, values in data.get("samples", {}).items():
+            # Files from before censoring was recorded hold plain latencies
+            samples = ((value, False) if isinstance(value, (int, float)) else (value[0], bool(value[1]))
+                       for value in values)
+            tracker.samples[provider] = deque(samples, maxlen=max_samples)
+        tracker.failures = dict(data.get("failures", {}))
+        return tracker
+
+
+class HedgedExtractor:
+    """
+    Sends each image to `primary`, and to `secondary` after `hedge_delay`
+    seconds ("auto" for the primary's 95th percentile latency) or as soon as
+    the primary fails. Providers are the ones of sdmodel.extraction, or any
+    object with `name`, `model`, `config` and an async request() method.
+    With streaming=True a malformed response counts as failed as soon as the
+    first bad entry arrives, so the hedge starts earlier.
+    """
+
+    def __init__(self, primary, secondary, hedge_delay="auto", tracker=None, cache="default",
+                 prompt=EXTRACTION_PROMPT, streaming=False):
+        self.streaming = streaming
+        self.providers = [primary, secondary]
+        self.hedge_delay = hedge_delay
+        self.tracker = tracker if tracker is not None else LatencyTracker()
+        self.cache = ExtractionCache() if cache == "default" else cache
+        self.prompt = prompt
+
+    def _key(self, provider, image_bytes):
+        return cache_key(image_bytes, self.prompt, provider.name, provider.model, provider.config)
+
+    async def _attempt(self, provider, image_bytes, mime_type):
+        started = time.perf_counter()
+        try:
+            model_data = await request_model_data(provider, image_bytes, mime_type, self.prompt, self.streaming)
+        except asyncio.CancelledError:
+            self.tracker.record(provider.name, time.perf_counter() - started, cancelled=True)
+            raise
+        except Exception:
+            self.tracker.record(provider.name, time.perf_counter() - started, ok=False)
+            raise
+        self.tracker.record(provider.name, time.perf_counter() - started)
+        return model_data
+
+    async def extract(self, image_bytes, mime_type="image/png"):
+        """
+        Returns (model_data, provider name) of the first valid response.
+        Raises the last error if both providers fail. Recorded as a
+        "hedged_extract" span with the winner and whether the request was hedged.
+        """
+        with instrument.span("hedged_extract") as span:
+            model_data, winner = await self._extract(image_bytes, mime_type, span)
+            span.set(winner=winner)
+            return model_data, winner
+
+    async def _extract(self, image_bytes, mime_type, span):
+        if self.cache is not None:
+            for provider in self.providers:
+                model_data = self.cache.get(self._key(provider, image_bytes))
+                if model_data is not None:
+                    span.set(cache="hit")
+                    return model_data, provider.name
+
+        primary, secondary = self.providers
+        delay = self.hedge_delay
+        if delay == "auto":
+            delay = self.tracker.hedge_delay(primary.name)
+
+        tasks = {asyncio.create_task(self._attempt(primary, image_bytes, mime_type)): primary}
+        hedged = False
+        error = None
+        try:
+            while tasks:
+                timeout = None if hedged else delay
+                done, _ = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    provider = tasks.pop(task)
+                    # Cancelled from outside this race: treat it like a failed attempt
+                    if task.cancelled():
+                        error = asyncio.CancelledError()
+                        continue
+                    if task.exception() is None:
+                        model_data = task.result()
+                        if self.cache is not None:
+                            self.cache.put(self._key(provider, image_bytes), model_data)
+                        return model_data, provider.name
+                    error = task.exception()
+                # Hedge when the delay has passed or the primary failed
+                if not hedged:
+                    hedged = True
+                    span.set(hedged=True)
+                    tasks[asyncio.create_task(self._attempt(secondary, image_bytes, mime_type))] = secondary
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        raise error
+
+    async def aclose(self):
+        for provider in self.providers:
+            aclose = getattr(provider, "aclose", None)
+            if aclose is not None:
+                await aclose()
+        if self.cache is not None:
+            self.cache.close()
+
+
+async def extract_hedged(image_path, primary="OPENAI", hedge_delay="auto", api_keys=None, models=None,
+                         configs=None, base_urls=None, use_cache=True, preprocess=PREPROCESS, latency_file=None,
+                         streaming=False):
+    """
+    Extracts one image with a hedged request, OPENAI against GEMINI.
+    `api_keys`, `models`, `configs` and `base_urls` are dicts keyed by
+    provider name; API keys default to the environment variables. The latency
+    samples are loaded from and saved to `latency_file`. With streaming=True
+    responses are parsed while they arrive. The cache is checked before the
+    provider clients are created, so a cached image needs neither SDK nor
+    API key.
+    Returns (model_data, provider name).
+    """
+    api_keys, models, configs, base_urls = api_keys or {}, models or {}, configs or {}, base_urls or {}
+    primary = primary.upper()
+    order = [primary] + [name for name in PROVIDERS if name != primary]
+    if preprocess is not None:
+        image_bytes, mime_type = await asyncio.to_thread(preprocess_file, image_path, **preprocess)
+    else:
+        with open(image_path, "rb") as f:
+            image_bytes = f.read()
+        mime_type = sniff_mime_type(image_bytes)
+
+    cache = ExtractionCache() if use_cache else None
+    if cache is not None:
+        for name in order:
+            # The same key HedgedExtractor computes from the provider's model and config
+            config = DEFAULT_CONFIGS[name] if configs.get(name) is None else configs[name]
+            key = cache_key(image_bytes, EXTRACTION_PROMPT, name, models.get(name) or DEFAULT_MODELS[name], config)
+            model_data = cache.get(key)
+            if model_data is not None:
+                cache.close()
+                with instrument.span("hedged_extract", cache="hit", winner=name):
+                    return model_data, name
+
+    try:
+        providers = [
+            PROVIDERS[name](api_keys.get(name) or os.environ.get(API_KEY_VARIABLES[name]), model=models.get(name),
+                            config=configs.get(name), base_url=base_urls.get(name))
+            for name in order
+        ]
+    except BaseException:
+        if cache is not None:
+            cache.close()
+        raise
+    tracker = LatencyTracker.load(latency_file)
+    extractor = HedgedExtractor(providers[0], providers[1], hedge_delay=hedge_delay, tracker=tracker, cache=cache,
+                                streaming=streaming)
+    try:
+        return await extractor.extract(image_bytes, mime_type)
+    finally:
+        await extractor.aclose()
+        tracker.save(latency_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract a stock and flow model, racing OpenAI and Gemini.")
+    parser.add_argument("image", nargs="?", help="diagram image")
+    parser.add_argument("--primary", type=str.upper, choices=sorted(PROVIDERS), default="OPENAI")
+    parser.add_argument("--delay", default="auto",
+                        help="seconds before the secondary provider is asked, or 'auto' (default)")
+    parser.add_argument("-o", "--output", default="output.json", help="where to write the model data")
+    parser.add_argument("--no-cache", action="store_true", help="always call the APIs")
+    parser.add_argument("--stream", action="store_true", help="parse the responses while they arrive")
+    parser.add_argument("--stats", action="store_true", help="print the recorded latency percentiles and exit")
+    args = parser.parse_args()
+
+    if args.stats:
+        for provider, stats in LatencyTracker.load().summary().items():
+            percentiles = "  ".join(f"p{q} {stats[f'p{q}']:.2f} s" for q in (50, 90, 95, 99)
+                                    if stats[f"p{q}"] is not None)
+            print(f"{provider}: {stats['count']} requests, {stats['cancelled']} cancelled, "
+                  f"{stats['failures']} failures  {percentiles}")
+        return
+    if not args.image:
+        parser.error("an image is required")
+
+    delay = args.delay if args.delay == "auto" else float(args.delay)
+    started = time.perf_counter()
+    model_data, provider = asyncio.run(extract_hedged(args.image, args.primary, delay, use_cache=not args.no_cache,
+                                                             streaming=args.stream))
+    with open(args.output, "w") as outfile:
+        json.dump(model_data, outfile, indent=2)
+    print(f"Answer from {provider} in {time.perf_counter() - started:.1f} s, saved to '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""
+Timed spans and pluggable sinks for the extraction pipeline.
+
+    from sdmodel import instrument
+
+    instrument.add_sink(instrument.JSONLinesSink("trace.jsonl"))
+    with instrument.span("api_call", provider="OPENAI", payload_bytes=len(image_bytes)) as span:
+        response = client.responses.create(...)
+        instrument.record_usage(response.usage)
+
+Every span records its name, start time, duration, outcome ("ok", "error" or
+"cancelled") and attributes such as bytes sent, prompt and completion tokens
+and retries, and hands the record to each sink when it ends. A span opened
+inside another one, also across `await` and in asyncio tasks, records the
+outer span's id as its parent.
+
+Sinks are objects with an emit(record) method. JSONLinesSink appends one JSON
+object per line to a file and MemorySink keeps the records in a list, for
+tests. Setting the SD_TRACE_FILE environment variable adds a JSONLinesSink
+for that file when this module is imported.
+
+With no sink, span() returns one shared object that does nothing, so the
+instrumented code pays a function call per span and nothing else.
+
+    python -m sdmodel.instrument trace.jsonl     # latency, bytes and tokens per stage
+
+Only the standard library is used.
+"""
+import contextlib
+import contextvars
+import itertools
+import json
+import math
+import os
+import threading
+import time
+
+_sinks = []
+_current = contextvars.ContextVar("sdmodel_instrument_span", default=None)
+_ids = itertools.count(1)
+
+# Token counts as each SDK names them: OpenAI Responses, OpenAI Chat Completions, Gemini
+_USAGE_FIELDS = {
+    "prompt_tokens": ("input_tokens", "prompt_tokens", "prompt_token_count"),
+    "completion_tokens": ("output_tokens", "completion_tokens", "candidates_token_count"),
+}
+
+# Record keys that are not summed in summaries
+_RECORD_KEYS = {"name", "id", "parent", "start", "seconds", "status", "error"}
+
+# Numeric attributes that label a span rather than count something, so summarize() does not add them up
+_LABEL_KEYS = {"attempt"}
+
+
+class Span:
+    """One timed stage. Use it through span(); set() and add() attach attributes to its record."""
+
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.id = next(_ids)
+        self.parent = None
+
+    def __enter__(self):
+        parent = _current.get()
+        self.parent = parent.id if parent is not None else None
+        self._token = _current.set(self)
+        self.start = time.time()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self._started
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # Exited in another context than it was entered in (e.g. an abandoned async generator)
+            pass
+        record = {"name": self.name, "id": self.id, "parent": self.parent, "start": self.start,
+                  "seconds": seconds, "status": "ok"}
+        if exc_type is not None:
+            # By name, so that recording does not need asyncio imported
+            record["status"] = "cancelled" if exc_type.__name__ == "CancelledError" else "error"
+            record["error"] = f"{exc_type.__name__}: {exc}"
+        record.update(self.attrs)
+        _emit(record)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, key, amount=1):
+        self.attrs[key] = self.attrs.get(key, 0) + amount
+
+
+class _NullSpan:
+    """Stands in for Span while nothing is recording."""
+
+    id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def add(self, key, amount=1):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+def span(name, **attrs):
+    """
+    Returns a context manager that times the stage `name`. `attrs` and
+    anything added with set()/add() on the returned span go into its record.
+    """
+    if not _sinks:
+        return _NULL_SPAN
+    return Span(name, attrs)
+
+
+def enabled():
+    """True if at least one sink is registered."""
+    return bool(_sinks)
+
+
+def current():
+    """The innermost open span of this task or thread (a do-nothing span if none)."""
+    if not _sinks:
+        return _NULL_SPAN
+    return _current.get() or _NULL_SPAN
+
+
+def annotate(**attrs):
+    """Adds attributes to the innermost open span, if any."""
+    current().set(**attrs)
+
+
+def usage_tokens(usage):
+    """
+    Returns {'prompt_tokens': ..., 'completion_tokens': ...} from the usage
+    object of an OpenAI or Gemini response (or a dict). Counts the SDK does
+    not report are left out.
+    """
+    tokens = {}
+    for key, fields in _USAGE_FIELDS.items():
+        for field in fields:
+            value = usage.get(field) if isinstance(usage, dict) else getattr(usage, field, None)
+            if isinstance(value, int):
+                tokens[key] = value
+                break
+    return tokens
+
+
+def record_usage(usage):
+    """Adds the token counts of a response's usage object to the innermost open span."""
+    if usage is not None and _sinks:
+        current().set(**usage_tokens(usage))
+
+
+def _emit(record):
+    for sink in list(_sinks):
+        sink.emit(record)
+
+
+def add_sink(sink):
+    """Starts sending span records to `sink`. Returns the sink."""
+    _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink):
+    """Stops sending records to `sink` and closes it, if it has a close() method."""
+    if sink in _sinks:
+        _sinks.remove(sink)
+    close = getattr(sink, "close", None)
+    if close is not None:
+        close()
+
+
+@contextlib.contextmanager
+def recording(*sinks):
+    """Registers `sinks` for the duration of a with block (by default a new MemorySink, which is yielded)."""
+    sinks = sinks or (MemorySink(),)
+    for sink in sinks:
+        add_sink(sink)
+    try:
+        yield sinks[0]
+    finally:
+        for sink in sinks:
+            remove_sink(sink)
+
+
+class JSONLinesSink:
+    """Appends every record to `path` as one line of JSON. Safe to share between threads."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    def emit(self, record):
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class MemorySink:
+    """Keeps every record in the `records` list."""
+
+    def __init__(self):
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def find(self, name):
+        """The records of the spans called `name`, in the order they ended."""
+        return [record for record in self.records if record["name"] == name]
+
+    def clear(self):
+        self.records.clear()
+
+
+def load(path):
+    """Reads the records written by a JSONLinesSink."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def summarize(records):
+    """
+    Groups records by span name. Returns {name: {'count', 'errors', 'total',
+    'mean', 'p50', 'p95', 'max', and the sum of every numeric attribute}},
+    with the names in the order they first ended.
+    """
+    groups = {}
+    for record in records:
+        groups.setdefault(record["name"], []).append(record)
+    summary = {}
+    for name, group in groups.items():
+        seconds = [record["seconds"] for record in group]
+        stats = {"count": len(group), "errors": sum(record["status"] != "ok" for record in group),
+                 "total": sum(seconds), "mean": sum(seconds) / len(seconds), "p50": _percentile(seconds, 50),
+                 "p95": _percentile(seconds, 95), "max": max(seconds)}
+        for record in group:
+            for key, value in record.items():
+                if key not in _RECORD_KEYS and key not in _LABEL_KEYS and isinstance(value, (int, float)) \
+                        and not isinstance(value, bool):
+                    stats[key] = stats.get(key, 0) + value
+        summary[name] = stats
+    return summary
+
+
+def print_summary(records):
+    """Prints latency per stage, and the summed bytes, tokens and retries."""
+    print(f"{'stage':<18} {'count':>6} {'errors':>6} {'mean (s)':>9} {'p95 (s)':>8} {'total (s)':>10}  totals")
+    for name, stats in summarize(records).items():
+        totals = ", ".join(f"{key} {value:g}" for key, value in stats.items()
+                           if key not in ("count", "errors", "total", "mean", "p50", "p95", "max"))
+        print(f"{name:<18} {stats['count']:>6} {stats['errors']:>6} {stats['mean']:>9.3f} {stats['p95']:>8.3f} "
+              f"{stats['total']:>10.3f}  {totals}")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Summarize a trace written by sdmodel.instrument.")
+    parser.add_argument("trace", help="JSON lines trace file (see SD_TRACE_FILE)")
+    args = parser.parse_args()
+    print_summary(load(args.trace))
+
+
+if os.environ.get("SD_TRACE_FILE"):
+    add_sink(JSONLinesSink(os.environ["SD_TRACE_FILE"]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,493 @@
+"""
+Resumable batch extraction backed by a SQLite job queue.
+
+Every image is a row of the queue with its state:
+
+    pending     waiting for a worker
+    in_flight   claimed by a worker, which renews its lease while it works
+    done        extracted; the model data, the JSON file and the XMILE file are recorded
+    failed      the extraction or the conversion failed; the error is recorded
+
+Running the same command again resumes the batch: images already done are
+skipped, and jobs left in flight by a worker that crashed are claimed again
+once their lease runs out. Several worker processes, on the same queue file,
+claim jobs in IMMEDIATE transactions, so no image is claimed twice while its
+lease holds. Each image gets its own "<name>.json" and "<name>.xmile" in the
+output directory, written under a temporary name and renamed when complete.
+
+    python -m sdmodel.jobs diagrams/ -o extracted/ --provider openai --workers 4 --concurrency 8
+    python -m sdmodel.jobs -o extracted/ --status
+    python -m sdmodel.jobs -o extracted/ --retry-failed
+
+The queue uses only the standard library; the extraction itself is
+sdmodel.extraction.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+from sdmodel import instrument
+from sdmodel.extraction import API_KEY_VARIABLES, PROVIDERS, BatchExtractor, find_images
+from sdmodel.images import PREPROCESS
+from sdmodel.xmile import generate_xmile
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+STATES = (PENDING, IN_FLIGHT, DONE, FAILED)
+
+# Seconds a claim holds without being renewed; workers renew theirs four times per lease
+DEFAULT_LEASE = 120.0
+
+# Name of the queue file in the output directory
+QUEUE_FILE = "jobs.sqlite3"
+
+
+class JobQueue:
+    """
+    SQLite queue of extraction jobs, one row per image. Safe to open from
+    several processes at once: claims are made in IMMEDIATE transactions and
+    completions only apply to the worker that holds the claim. Within a
+    process, the methods may be called from any thread (run_worker calls them
+    through asyncio.to_thread); a lock keeps them from interleaving.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Autocommit mode: transactions are opened explicitly where several statements must agree
+        self._db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " image TEXT PRIMARY KEY, stem TEXT NOT NULL UNIQUE, state TEXT NOT NULL, attempts INTEGER NOT NULL,"
+            " worker TEXT, claimed REAL, updated REAL NOT NULL, model_data TEXT, json_path TEXT, xmile_path TEXT,"
+            " error TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, claimed)")
+
+    def _transaction(self):
+        return _Transaction(self._db, self._lock)
+
+    def add(self, image_paths):
+        """
+        Queues images that are not in the queue yet. Each gets an output name
+        from its file name, with a hash of its path added if another image
+        already has that name. Returns the number of images added.
+        """
+        now = time.time()
+        with self._transaction():
+            known = {row[0] for row in self._db.execute("SELECT image FROM jobs")}
+            stems = {row[0] for row in self._db.execute("SELECT stem FROM jobs")}
+            rows = []
+            for path in image_paths:
+                image = os.path.abspath(path)
+                if image in known:
+                    continue
+                known.add(image)
+                stem = os.path.splitext(os.path.basename(image))[0]
+                if stem in stems:
+                    stem = f"{stem}-{hashlib.sha1(image.encode('utf-8')).hexdigest()[:8]}"
+                stems.add(stem)
+                rows.append((image, stem, PENDING, 0, now))
+            self._db.executemany("INSERT INTO jobs (image, stem, state, attempts, updated) VALUES (?, ?, ?, ?, ?)",
+                                 rows)
+        return len(rows)
+
+    def claim(self, worker, limit=1, lease=DEFAULT_LEASE):
+        """
+        Marks up to `limit` jobs as in flight for `worker` and returns them as
+        dicts with 'image', 'stem' and 'attempts'. Pending jobs come first in
+        the order they were added; in-flight jobs whose lease ran out are
+        claimed again.
+        """
+        now = time.time()
+        with self._transaction():
+            rows = self._db.execute(
+                "SELECT image, stem, attempts FROM jobs WHERE state = ? OR (state = ? AND claimed < ?)"
+                " ORDER BY state = ? DESC, rowid LIMIT ?",
+                (PENDING, IN_FLIGHT, now - lease, PENDING, limit),
+            ).fetchall()
+            self._db.executemany(
+                "UPDATE jobs SET state = ?, worker = ?, claimed = ?, updated = ?, attempts = attempts + 1"
+                " WHERE image = ?",
+                [(IN_FLIGHT, worker, now, now, row[0]) for row in rows],
+            )
+        return [{"image": image, "stem": stem, "attempts": attempts + 1} for image, stem, attempts in rows]
+
+    def renew(self, worker):
+        """Extends the lease of every job `worker` has in flight."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("UPDATE jobs SET claimed = ? WHERE state = ? AND worker = ?", (now, IN_FLIGHT, worker))
+
+    def complete(self, image, worker, model_data, json_path, xmile_path, staged=()):
+        """
+        Records a finished job. Returns False if `worker` no longer holds it.
+        `staged` lists (temporary path, final path) pairs of output files.
+        They are renamed in the same transaction, and only if the claim holds,
+        so a worker whose lease ran out never replaces the files of the
+        worker that took the job over. Files that are not renamed are left
+        for the caller to remove.
+        """
+        value = json.dumps(model_data)
+        with self._transaction():
+            cursor = self._db.execute(
+                "UPDATE jobs SET state = ?, worker = NULL, claimed = NULL, updated = ?, model_data = ?, json_path = ?,"
+                " xmile_path = ?, error = NULL WHERE image = ? AND state = ? AND worker = ?",
+                (DONE, time.time(), value, json_path, xmile_path, image, IN_FLIGHT, worker),
+            )
+            if cursor.rowcount != 1:
+                return False
+            for temporary, path in staged:
+                os.replace(temporary, path)
+        return True
+
+    def fail(self, image, worker, error):
+        """Records a failed job. Returns False if `worker` no longer holds it."""
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE jobs SET state = ?, worker = NULL, claimed = NULL, updated = ?, error = ?"
+                " WHERE image = ? AND state = ? AND worker = ?",
+                (FAILED, time.time(), error, image, IN_FLIGHT, worker),
+            )
+            return cursor.rowcount == 1
+
+    def release(self, worker):
+        """Puts the jobs `worker` has in flight back to pending, e.g. when it is interrupted."""
+        with self._lock:
+            self._db.execute("UPDATE jobs SET state = ?, worker = NULL, claimed = NULL, updated = ?"
+                             " WHERE state = ? AND worker = ?", (PENDING, time.time(), IN_FLIGHT, worker))
+
+    def retry_failed(self):
+        """Puts every failed job back to pending. Returns how many there were."""
+        with self._lock:
+            cursor = self._db.execute("UPDATE jobs SET state = ?, updated = ? WHERE state = ?",
+                                      (PENDING, time.time(), FAILED))
+            return cursor.rowcount
+
+    def counts(self):
+        """Returns {state: number of jobs} for every state."""
+        counts = dict.fromkeys(STATES, 0)
+        with self._lock:
+            counts.update(self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+        return counts
+
+    def jobs(self, state=None):
+        """
+        Returns the jobs (all, or those in `state`) as dicts with 'image',
+        'stem', 'state', 'attempts', 'json_path', 'xmile_path' and 'error'.
+        """
+        query = "SELECT image, stem, state, attempts, json_path, xmile_path, error FROM jobs"
+        with self._lock:
+            rows = self._db.execute(query + " WHERE state = ? ORDER BY rowid", (state,)).fetchall() if state else \
+                self._db.execute(query + " ORDER BY rowid").fetchall()
+        keys = ("image", "stem", "state", "attempts", "json_path", "xmile_path", "error")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def model_data(self, image):
+        """The model data extracted from `image`, or None if it is not done."""
+        with self._lock:
+            row = self._db.execute("SELECT model_data FROM jobs WHERE image = ?",
+                                   (os.path.abspath(image),)).fetchone()
+        return json.loads(row[0]) if row and row[0] is not None else None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, rolled back on error. Takes the write lock up front, so claims never race."""
+
+    def __init__(self, db, lock):
+        self.db = db
+        self.lock = lock
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            self.db.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self.lock.release()
+            raise
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.db.execute("ROLLBACK" if exc_type is not None else "COMMIT")
+        finally:
+            self.lock.release()
+        return False
+
+
+def _write_json(model_data, path):
+    with open(path, "w") as f:
+        json.dump(model_data, f, indent=2)
+
+
+def stage_outputs(model_data, output_dir, stem):
+    """
+    Writes <stem>.json and <stem>.xmile under temporary names of their own,
+    so workers on the same stem never touch each other's files. Returns
+    [(temporary path, final path)] for both; rename them to publish them.
+    """
+    # Readers of the final paths see either the previous file or the complete new one
+    token = uuid.uuid4().hex[:12]
+    json_path = os.path.join(output_dir, stem + ".json")
+    xmile_path = os.path.join(output_dir, stem + ".xmile")
+    staged = [(f"{json_path}.{token}.tmp", json_path), (f"{xmile_path}.{token}.tmp", xmile_path)]
+    try:
+        with instrument.span("write_output") as span:
+            _write_json(model_data, staged[0][0])
+            generate_xmile(model_data, staged[1][0], streaming=True)
+            span.set(output_bytes=os.path.getsize(staged[0][0]) + os.path.getsize(staged[1][0]))
+    except BaseException:
+        remove_staged(staged)
+        raise
+    return staged
+
+
+def remove_staged(staged):
+    """Removes the temporary files of stage_outputs() that were not renamed."""
+    for temporary, _ in staged:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+
+
+def write_outputs(model_data, output_dir, stem):
+    """Writes <stem>.json and <stem>.xmile atomically. Returns their paths."""
+    staged = stage_outputs(model_data, output_dir, stem)
+    try:
+        for temporary, path in staged:
+            os.replace(temporary, path)
+    finally:
+        remove_staged(staged)
+    return staged[0][1], staged[1][1]
+
+
+def worker_name():
+    """A name for this worker that is unique across hosts and processes."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+async def run_worker(queue, extractor, output_dir, concurrency=8, lease=DEFAULT_LEASE, on_result=None):
+    """
+    Claims jobs from `queue` and extracts them with `extractor` (a
+    BatchExtractor), at most `concurrency` at a time, until none are left.
+    While other workers still hold jobs, it waits and claims those whose
+    lease runs out. Jobs in flight when it is interrupted go back to pending.
+    `on_result` is called with each BatchExtractor result; the result has
+    'discarded' set when the worker had lost the job's lease and another
+    worker claimed it meanwhile. Returns the numbers of jobs done and failed
+    by this worker. The queue is called through asyncio.to_thread, so SQLite
+    never blocks the requests in flight.
+    """
+    worker = worker_name()
+    tasks = {}
+    counts = {DONE: 0, FAILED: 0}
+    renewed = time.monotonic()
+
+    async def process(job):
+        result = await extractor.extract_file(job["image"])
+        staged = []
+        if result["error"] is None:
+            try:
+                staged = await asyncio.to_thread(stage_outputs, result["model_data"], output_dir, job["stem"])
+            except Exception as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+        if result["error"] is None:
+            try:
+                # The files are renamed into place only if this worker still holds the job
+                recorded = await asyncio.to_thread(queue.complete, job["image"], worker, result["model_data"],
+                                                   staged[0][1], staged[1][1], staged)
+                state = DONE
+            except OSError as e:
+                result["error"] = f"{type(e).__name__}: {e}"
+            finally:
+                await asyncio.to_thread(remove_staged, staged)
+        if result["error"] is not None:
+            recorded = await asyncio.to_thread(queue.fail, job["image"], worker, result["error"])
+            state = FAILED
+        # Another worker claimed the job after this one's lease ran out; its result counts instead
+        result["discarded"] = not recorded
+        if recorded:
+            counts[state] += 1
+        if on_result is not None:
+            on_result(result)
+
+    try:
+        while True:
+            if len(tasks) < concurrency:
+                for job in await asyncio.to_thread(queue.claim, worker, concurrency - len(tasks), lease):
+                    tasks[asyncio.create_task(process(job))] = job
+            if not tasks:
+                if not (await asyncio.to_thread(queue.counts))[IN_FLIGHT]:
+                    break
+                # Other workers hold the remaining jobs; take over any whose lease runs out
+                await asyncio.sleep(min(1.0, lease / 4))
+                continue
+            done, _ = await asyncio.wait(tasks, timeout=lease / 4, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                del tasks[task]
+                task.result()
+            if time.monotonic() - renewed > lease / 4:
+                await asyncio.to_thread(queue.renew, worker)
+                renewed = time.monotonic()
+    finally:
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        # Run inline: the loop may be shutting down after a KeyboardInterrupt
+        queue.release(worker)
+    return counts
+
+
+def _make_provider(provider, api_key, model, config, base_url):
+    if callable(provider):
+        return provider()
+    provider = provider.upper()
+    if api_key is None:
+        api_key = os.environ.get(API_KEY_VARIABLES[provider])
+    return PROVIDERS[provider](api_key, model=model, config=config, base_url=base_url)
+
+
+def _print_result(result):
+    if result.get("discarded"):
+        print(f"DISCARDED {result['image']}: the lease ran out and another worker took the image over")
+    elif result["error"]:
+        print(f"FAILED {result['image']}: {result['error']}")
+    else:
+        print(f"{result['image']} ({result['seconds']:.1f} s, {result['attempts']} attempts)")
+
+
+def _worker_process(settings):
+    """Runs one worker in its own process with its own queue connection and provider client."""
+    settings = dict(settings)
+    queue = JobQueue(settings.pop("queue_path"))
+    client = _make_provider(*(settings.pop(key) for key in ("provider", "api_key", "model", "config", "base_url")))
+    extractor = BatchExtractor(client, concurrency=settings["concurrency"],
+                               requests_per_minute=settings.pop("requests_per_minute"),
+                               max_retries=settings.pop("max_retries"),
+                               cache="default" if settings.pop("use_cache") else None,
+                               preprocess=settings.pop("preprocess"), streaming=settings.pop("streaming"))
+
+    async def work():
+        try:
+            return await run_worker(queue, extractor, **settings)
+        finally:
+            await extractor.aclose()
+
+    try:
+        return asyncio.run(work())
+    finally:
+        queue.close()
+
+
+def run_jobs(queue_path, image_paths=(), output_dir=".", provider="OPENAI", api_key=None, model=None, config=None,
+             base_url=None, workers=1, concurrency=8, requests_per_minute=None, max_retries=5, use_cache=True,
+             preprocess=PREPROCESS, streaming=False, retry_failed=False, lease=DEFAULT_LEASE, verbose=True):
+    """
+    Adds image_paths to the queue at `queue_path` and works through every
+    pending job with `workers` processes, each with its own client and
+    `concurrency` requests in flight. The request rate is split evenly between
+    the processes. `provider` is 'OPENAI', 'GEMINI' or a picklable function
+    returning a provider object (see BatchExtractor). With `retry_failed`,
+    failed jobs are tried again. Returns the queue's counts per state.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    queue = JobQueue(queue_path)
+    try:
+        added = queue.add(image_paths)
+        retried = queue.retry_failed() if retry_failed else 0
+        counts = queue.counts()
+    finally:
+        queue.close()
+    if verbose:
+        print(f"Queued {added} new images ({retried} failed ones again): {counts[PENDING]} pending, "
+              f"{counts[IN_FLIGHT]} in flight, {counts[DONE]} done, {counts[FAILED]} failed")
+
+    settings = {
+        "queue_path": queue_path, "provider": provider, "api_key": api_key, "model": model, "config": config,
+        "base_url": base_url, "requests_per_minute": requests_per_minute / workers if requests_per_minute else None,
+        "max_retries": max_retries, "use_cache": use_cache, "preprocess": preprocess, "streaming": streaming,
+        "output_dir": output_dir, "concurrency": concurrency, "lease": lease,
+        "on_result": _print_result if verbose else None,
+    }
+    if workers <= 1:
+        _worker_process(settings)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for future in [pool.submit(_worker_process, settings) for _ in range(workers)]:
+                future.result()
+
+    queue = JobQueue(queue_path)
+    try:
+        return queue.counts()
+    finally:
+        queue.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract stock and flow models from many images, resumably.")
+    parser.add_argument("inputs", nargs="*", help="image files, directories or glob patterns to add to the queue")
+    parser.add_argument("-o", "--output-dir", default="extracted", help="where to write the JSON and XMILE files")
+    parser.add_argument("--queue", help=f"queue file (default: {QUEUE_FILE} in the output directory)")
+    parser.add_argument("--provider", type=str.upper, choices=sorted(PROVIDERS), default="OPENAI")
+    parser.add_argument("--model", help="model name (default: gpt-4o / gemini-2.0-flash)")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes (default 1)")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight per worker (default 8)")
+    parser.add_argument("--rpm", type=float, help="maximum requests per minute, shared by all workers")
+    parser.add_argument("--retries", type=int, default=5, help="retries on 429/5xx errors (default 5)")
+    parser.add_argument("--base-url", help="API endpoint, e.g. a local test server")
+    parser.add_argument("--no-cache", action="store_true", help="always call the API")
+    parser.add_argument("--no-preprocess", action="store_true", help="send the image files unchanged")
+    parser.add_argument("--stream", action="store_true", help="parse responses while they arrive")
+    parser.add_argument("--retry-failed", action="store_true", help="try the failed images again")
+    parser.add_argument("--lease", type=float, default=DEFAULT_LEASE,
+                        help=f"seconds before a crashed worker's jobs are claimed again (default {DEFAULT_LEASE:g})")
+    parser.add_argument("--status", action="store_true", help="print the state of the queue and exit")
+    args = parser.parse_args()
+
+    queue_path = args.queue or os.path.join(args.output_dir, QUEUE_FILE)
+    if args.status:
+        if not os.path.exists(queue_path):
+            parser.error(f"no queue at '{queue_path}'")
+        queue = JobQueue(queue_path)
+        counts = queue.counts()
+        for job in queue.jobs(FAILED):
+            print(f"FAILED {job['image']} ({job['attempts']} attempts): {job['error']}")
+        queue.close()
+        print(", ".join(f"{counts[state]} {state}" for state in STATES))
+        return
+
+    image_paths = find_images(args.inputs) if args.inputs else []
+    if args.inputs and not image_paths:
+        parser.error("no images found")
+    started = time.perf_counter()
+    counts = run_jobs(queue_path, image_paths, args.output_dir, args.provider, model=args.model,
+                      base_url=args.base_url, workers=args.workers, concurrency=args.concurrency,
+                      requests_per_minute=args.rpm, max_retries=args.retries, use_cache=not args.no_cache,
+                      preprocess=None if args.no_preprocess else PREPROCESS, streaming=args.stream,
+                      retry_failed=args.retry_failed, lease=args.lease)
+    print(f"\n{counts[DONE]} done, {counts[FAILED]} failed, {counts[PENDING] + counts[IN_FLIGHT]} left "
+          f"after {time.perf_counter() - started:.1f} s (queue: '{queue_path}')")
+    if counts[FAILED] or counts[PENDING] or counts[IN_FLIGHT]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,369 @@
+"""
+Incremental parsing of model_data JSON that arrives in pieces.
+
+ModelStreamParser is fed text as it arrives, for example the chunks of a
+streamed LLM response. The entries of the 'stocks', 'flows', 'auxiliaries'
+and 'connectors' lists are decoded one by one as soon as each is complete,
+and handed to `on_item` together with their category. Malformed JSON raises
+JSONStreamError at the first bad entry, instead of after the whole response
+has been received.
+
+Text before the first '{' (such as a ```json fence) and after the closing
+'}' is ignored, so fenced LLM output parses without any clean-up.
+
+    parser = ModelStreamParser(on_item=lambda category, item: print(category, item["name"]))
+    for chunk in chunks:
+        parser.feed(chunk)
+    model_data = parser.close()
+
+stream_items() reads a JSON model file the same way, a block at a time, and
+yields its entries without ever holding the whole document:
+
+    for category, item in stream_items("merged_model.json"):
+        ...
+
+When a large piece holds many complete entries they are decoded together in
+one call, with orjson if it is installed and the json module otherwise.
+"""
+import contextlib
+import json
+import re
+
+# Lists of model_data that are decoded entry by entry
+STREAM_KEYS = ("stocks", "flows", "auxiliaries", "connectors")
+
+_STRUCTURE = re.compile(r'[{}\[\]"]')
+_STRING_END = re.compile(r'["\\]')
+_NON_SPACE = re.compile(r"\S")
+_SCALAR_END = re.compile(r"[,}\]\s]")
+_DECODER = json.JSONDecoder()
+
+# Entries are decoded in batches once this many characters are waiting; streamed LLM
+# responses arrive in much smaller pieces and keep the entry-by-entry path
+BATCH_CHARS = 4096
+
+# Size of the blocks stream_items() reads
+CHUNK_CHARS = 1 << 16
+
+_batch_loads = None
+
+
+class JSONStreamError(ValueError):
+    """Raised when streamed text is not a well-formed model_data object."""
+
+
+class ModelStreamParser:
+    """
+    Parses one JSON object from text fed in pieces.
+
+    `on_item(category, item)` is called for every decoded entry of the lists
+    named in `stream_keys`. `validate_item(category, item)` may raise
+    ValueError to reject an entry; the error is raised again as a
+    JSONStreamError. With keep_items=False the entries are only passed to
+    on_item, so memory stays bounded however long the lists are.
+    `max_preamble` bounds the text skipped before the first '{'.
+    """
+
+    def __init__(self, on_item=None, validate_item=None, stream_keys=STREAM_KEYS, keep_items=True,
+                 max_preamble=4096):
+        self.on_item = on_item
+        self.validate_item = validate_item
+        self.stream_keys = set(stream_keys)
+        self.keep_items = keep_items
+        self.max_preamble = max_preamble
+        self.result = {}
+        self.counts = {}
+        self.buffer = ""
+        self.offset = 0    # characters dropped from the front of the buffer
+        self.pos = 0       # scan position in the buffer
+        self.start = 0     # start of the value being scanned
+        self.state = "preamble"
+        self.need_comma = False
+        self.key = None
+        self.array_items = 0
+        self.target = None
+        self.depth = 0
+        self.in_string = False
+        self.mode = None
+        self.batch_from = 0
+
+    @property
+    def done(self):
+        return self.state == "done"
+
+    def feed(self, text):
+        """Parses the next piece of text. Raises JSONStreamError on malformed input."""
+        if self.state == "done":
+            return
+        if self.start:
+            self.buffer = self.buffer[self.start:]
+            self.offset += self.start
+            self.pos -= self.start
+            self.start = 0
+        self.buffer += text
+        self.batch_from = 0
+        self._parse()
+
+    def close(self):
+        """Returns the parsed object; raises JSONStreamError if it is incomplete."""
+        if self.state != "done":
+            raise JSONStreamError("Response ended before the JSON object was complete")
+        return self.result
+
+    def _error(self, message):
+        return JSONStreamError(f"{message} at character {self.offset + self.pos}")
+
+    def _parse(self):
+        buf = self.buffer
+        while True:
+            state = self.state
+            if state == "done":
+                return
+            if state == "scan":
+                end = self._scan(buf)
+                if end is None:
+                    return
+                self._finish_value(buf, end)
+                continue
+            if state == "preamble":
+                i = buf.find("{", self.pos)
+                if i < 0:
+                    if self.offset + len(buf) > self.max_preamble:
+                        raise JSONStreamError("No JSON object found at the start of the response")
+                    self.pos = self.start = len(buf)
+                    return
+                self.pos = self.start = i + 1
+                self.state = "key"
+                continue
+
+            match = _NON_SPACE.search(buf, self.pos)
+            if match is None:
+                self.pos = self.start = len(buf)
+                return
+            self.pos = i = match.start()
+            c = buf[i]
+            if state == "key":
+                if c == "}" and (self.need_comma or self.key is None):
+                    self.state = "done"
+                    self.pos = self.start = i + 1
+                    return
+                if self.need_comma:
+                    if c != ",":
+                        raise self._error(f"Expected ',' or '}}' but found {c!r}")
+                    self.need_comma = False
+                    self.pos = self.start = i + 1
+                elif c == '"':
+                    self._begin_scan(buf, i, "key")
+                else:
+                    raise self._error(f"Expected a key but found {c!r}")
+            elif state == "colon":
+                if c != ":":
+                    raise self._error(f"Expected ':' but found {c!r}")
+                self.state = "value"
+                self.pos = self.start = i + 1
+            elif state == "value":
+                if self.key in self.stream_keys:
+                    if c != "[":
+                        raise self._error(f"'{self.key}' should be a list")
+                    if self.keep_items:
+                        self.result.setdefault(self.key, [])
+                    self.counts.setdefault(self.key, 0)
+                    self.state = "array"
+                    self.need_comma = False
+                    self.array_items = 0
+                    self.pos = self.start = i + 1
+                else:
+                    self._begin_scan(buf, i, "value")
+            elif state == "array":
+                if c == "]" and (self.need_comma or not self.array_items):
+                    self.state = "key"
+                    self.need_comma = True
+                    self.pos = self.start = i + 1
+                elif self.need_comma:
+                    if c != ",":
+                        raise self._error(f"Expected ',' or ']' in '{self.key}' but found {c!r}")
+                    self.need_comma = False
+                    self.pos = self.start = i + 1
+                elif len(buf) - i >= BATCH_CHARS and i >= self.batch_from and self._decode_batch(buf, i):
+                    continue
+                else:
+                    self._begin_scan(buf, i, "item")
+
+    def _decode_batch(self, buf, i):
+        """
+        Decodes every complete entry from position i to the last '}' followed
+        by ',' or ']' in one call. Returns False, having changed nothing, if
+        that text is not a clean run of entries (the end falls inside a string
+        or a nested object, the list ends before it, or an entry is malformed
+        or rejected); the entries are then parsed one by one, which reports
+        errors at the right place. Only one attempt is made per piece of text.
+        """
+        self.batch_from = len(buf)
+        end = buf.rfind("}", i)
+        for _ in range(3):
+            if end <= i:
+                return False
+            match = _NON_SPACE.search(buf, end + 1)
+            if match is not None and match.group() in ",]":
+                break
+            end = buf.rfind("}", i, end)
+        else:
+            return False
+        try:
+            items = _loads_batch("[" + buf[i:end + 1] + "]")
+        except ValueError:
+            return False
+        key = self.key
+        if self.validate_item is not None:
+            try:
+                for item in items:
+                    self.validate_item(key, item)
+            except ValueError:
+                return False
+        self.counts[key] += len(items)
+        self.array_items += len(items)
+        if self.keep_items:
+            self.result[key].extend(items)
+        if self.on_item is not None:
+            on_item = self.on_item
+            for item in items:
+                on_item(key, item)
+        self.pos = self.start = end + 1
+        self.need_comma = True
+        return True
+
+    def _begin_scan(self, buf, i, target):
+        self.target = target
+        self.start = i
+        c = buf[i]
+        # Fast path: the whole value is usually in the buffer already. A number is only
+        # complete once a terminator follows it: "1." or "2.5e" at the end of a piece
+        # decodes as 1 or 2.5, and the rest of the number arrives with the next piece.
+        try:
+            value, end = _DECODER.raw_decode(buf, i)
+        except ValueError:
+            pass
+        else:
+            if c not in "-0123456789" or _SCALAR_END.match(buf, end):
+                self._store(value, end)
+                return
+        self.state = "scan"
+        if c in "{[":
+            self.mode, self.depth, self.in_string, self.pos = "nested", 1, False, i + 1
+        elif c == '"':
+            self.mode, self.depth, self.in_string, self.pos = "nested", 0, True, i + 1
+        else:
+            self.mode, self.pos = "scalar", i
+
+    def _scan(self, buf):
+        """Returns the end of the value that starts at self.start, or None if more text is needed."""
+        if self.mode == "scalar":
+            match = _SCALAR_END.search(buf, self.pos)
+            if match is None:
+                self.pos = len(buf)
+                return None
+            return match.start()
+        pos = self.pos
+        while True:
+            if self.in_string:
+                match = _STRING_END.search(buf, pos)
+                if match is None:
+                    self.pos = len(buf)
+                    return None
+                if match.group() == "\\":
+                    if match.end() >= len(buf):
+                        # The escaped character has not arrived yet
+                        self.pos = match.start()
+                        return None
+                    pos = match.end() + 1
+                    continue
+                self.in_string = False
+                pos = match.end()
+                if self.depth == 0:
+                    return pos
+                continue
+            match = _STRUCTURE.search(buf, pos)
+            if match is None:
+                self.pos = len(buf)
+                return None
+            c = match.group()
+            pos = match.end()
+            if c == '"':
+                self.in_string = True
+            elif c in "{[":
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.depth == 0:
+                    return pos
+
+    def _finish_value(self, buf, end):
+        self.pos = end
+        try:
+            value = json.loads(buf[self.start:end])
+        except ValueError as e:
+            where = f"'{self.key}'" if self.target != "key" else "a key"
+            raise self._error(f"Malformed JSON in {where}: {e}") from None
+        self._store(value, end)
+
+    def _store(self, value, end):
+        self.pos = self.start = end
+        target = self.target
+        if target == "key":
+            if not isinstance(value, str):
+                raise self._error("Expected a key")
+            self.key = value
+            self.state = "colon"
+            return
+        self.need_comma = True
+        if target == "value":
+            self.result[self.key] = value
+            self.state = "key"
+            return
+        if self.validate_item is not None:
+            try:
+                self.validate_item(self.key, value)
+            except ValueError as e:
+                raise self._error(str(e)) from None
+        self.counts[self.key] += 1
+        self.array_items += 1
+        if self.keep_items:
+            self.result[self.key].append(value)
+        if self.on_item is not None:
+            self.on_item(self.key, value)
+        self.state = "array"
+
+
+def _loads_batch(text):
+    """json.loads, or orjson.loads when orjson is installed (imported on first use)."""
+    global _batch_loads
+    if _batch_loads is None:
+        try:
+            from orjson import loads as _batch_loads
+        except ImportError:
+            _batch_loads = json.loads
+    return _batch_loads(text)
+
+
+def stream_items(file, stream_keys=STREAM_KEYS, chunk_chars=CHUNK_CHARS, validate_item=None):
+    """
+    Yields (category, item) for every entry of the lists in `stream_keys` of a
+    JSON model, read `chunk_chars` characters at a time from a file name or a
+    text file object. Only the current block and entry are held in memory.
+    Other top-level values are skipped. Raises JSONStreamError on malformed
+    JSON or a truncated file.
+    """
+    pending = []
+    parser = ModelStreamParser(on_item=lambda category, item: pending.append((category, item)),
+                               validate_item=validate_item, stream_keys=stream_keys, keep_items=False)
+    with contextlib.ExitStack() as stack:
+        if not hasattr(file, "read"):
+            file = stack.enter_context(open(file, "r", encoding="utf-8"))
+        while not parser.done:
+            text = file.read(chunk_chars)
+            if not text:
+                break
+            parser.feed(text)
+            yield from pending
+            pending.clear()
+    parser.close()
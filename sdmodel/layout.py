@@ -0,0 +1,487 @@
+"""
+Diagram layout for the XMILE view.
+
+The converter places stocks on a fixed 4-column grid, flows between their
+stocks and auxiliaries in a column above the variable they feed, so the
+objects of a large model pile on top of each other. This module computes new
+positions with one of the engines in LAYOUTS:
+
+    grid      the converter's positions, with overlaps removed
+    layered   columns that follow the direction of influence (stocks, the
+              flows and auxiliaries they feed, ...), ordered to shorten links
+    force     a force-directed layout (springs along links, repulsion between
+              neighbours), started from the layered one
+
+Positions already in model_data ('x'/'y' from the LLM) seed the layered and
+force engines. Every engine ends by placing the objects one by one with a
+SpatialGrid index, moving each to the nearest free spot, so no two boxes
+overlap. Results depend only on the model and the seed.
+
+    from sdmodel.layout import apply_layout
+    generate_xmile(apply_layout(model_data, "layered"), "model.xmile")
+
+    python -m sdmodel.layout model.json -o laid_out.json --method force
+
+The grid and layered engines use only the standard library; the force engine
+needs NumPy.
+"""
+import argparse
+import json
+import math
+import random
+
+from sdmodel.graph import build_dependency_graph
+from sdmodel.model import CATEGORIES, Model, load_model, to_model_data
+
+# Width and height of each kind of object, including room for its name below
+ELEMENT_SIZES = {"stock": (100, 70), "flow": (130, 50), "aux": (70, 50)}
+
+# Free space kept around every object
+MARGIN = 10
+
+# Distance between columns and rows of the layered layout
+COLUMN_SPACING = 220
+ROW_SPACING = 90
+
+# Top-left corner of the laid out diagram
+ORIGIN = (100, 100)
+
+
+class SpatialGrid:
+    """
+    Uniform grid index of axis-aligned boxes (x1, y1, x2, y2). A box is
+    registered in every cell it touches, so checking a box for overlaps only
+    looks at the boxes in its own cells.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def _cells(self, box):
+        size = self.cell_size
+        x1, y1, x2, y2 = box
+        return [(cx, cy) for cx in range(int(x1 // size), int(x2 // size) + 1)
+                for cy in range(int(y1 // size), int(y2 // size) + 1)]
+
+    def insert(self, box):
+        for cell in self._cells(box):
+            self.cells.setdefault(cell, []).append(box)
+
+    def overlaps(self, box):
+        """True if `box` overlaps a box in the index (touching edges do not count)."""
+        x1, y1, x2, y2 = box
+        size = self.cell_size
+        cells = self.cells
+        for cx in range(int(x1 // size), int(x2 // size) + 1):
+            for cy in range(int(y1 // size), int(y2 // size) + 1):
+                for ox1, oy1, ox2, oy2 in cells.get((cx, cy), ()):
+                    if x1 < ox2 and ox1 < x2 and y1 < oy2 and oy1 < y2:
+                        return True
+        return False
+
+
+def _box(kind, x, y):
+    width, height = ELEMENT_SIZES[kind]
+    return (x - width / 2 - MARGIN, y - height / 2 - MARGIN, x + width / 2 + MARGIN, y + height / 2 + MARGIN)
+
+
+def _given_position(item):
+    # LLM positions may be numbers or strings; anything else counts as missing
+    try:
+        return float(item["x"]), float(item["y"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _elements(model_data):
+    """Returns (names, kinds, given positions) with names in model order, stocks first."""
+    names = []
+    kinds = {}
+    given = {}
+    for kind, category in CATEGORIES:
+        for item in model_data.get(category, []):
+            name = item["name"]
+            if name in kinds:
+                continue
+            names.append(name)
+            kinds[name] = kind
+            position = _given_position(item)
+            if position is not None:
+                given[name] = position
+    return names, kinds, given
+
+
+def _links(model_data, names):
+    """
+    Returns the successors of every variable: the variables whose equations
+    refer to it, the targets of its connectors, the flows draining a stock and
+    the stock a flow fills. Links to unknown names are dropped.
+    """
+    index = {name: i for i, name in enumerate(names)}
+    successors = {name: set() for name in names}
+
+    def link(src, tgt):
+        if src in index and tgt in index and src != tgt:
+            successors[src].add(tgt)
+
+    for name, refs in build_dependency_graph(model_data)["deps"].items():
+        for ref in refs:
+            link(ref, name)
+    for conn in model_data.get("connectors", []):
+        link(conn.get("src"), conn.get("tgt"))
+    for stock in model_data.get("stocks", []):
+        for flow in stock.get("outflows", []):
+            link(stock["name"], flow)
+        for flow in stock.get("inflows", []):
+            link(flow, stock["name"])
+    return {name: sorted(successors[name], key=index.__getitem__) for name in names}
+
+
+def _acyclic(names, successors):
+    """
+    Drops the links that close a cycle, found by depth-first search in model
+    order. Stocks come first, so the links that feed a stock back are the ones
+    dropped.
+    """
+    state = dict.fromkeys(names, 0)  # 0 unvisited, 1 on the stack, 2 done
+    kept = {name: [] for name in names}
+    for root in names:
+        if state[root]:
+            continue
+        state[root] = 1
+        stack = [(root, iter(successors[root]))]
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                if state[child] == 1:
+                    continue
+                kept[node].append(child)
+                if state[child] == 0:
+                    state[child] = 1
+                    stack.append((child, iter(successors[child])))
+                    break
+            else:
+                state[node] = 2
+                stack.pop()
+    return kept
+
+
+def _layers(names, successors):
+    """Longest-path layering of an acyclic graph: every link points to a later layer."""
+    indegree = dict.fromkeys(names, 0)
+    for name in names:
+        for child in successors[name]:
+            indegree[child] += 1
+    layer = dict.fromkeys(names, 0)
+    ready = [name for name in reversed(names) if indegree[name] == 0]
+    while ready:
+        node = ready.pop()
+        for child in successors[node]:
+            layer[child] = max(layer[child], layer[node] + 1)
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                ready.append(child)
+    return layer
+
+
+def layered_layout(model_data, seed=0, sweeps=4):
+    """
+    Places the variables in columns that follow the links between them and
+    orders each column to keep linked variables at similar heights (barycenter
+    sweeps). Given 'y' positions decide the starting order within a column.
+    Tall columns are wrapped so the diagram stays roughly square. `seed` only
+    breaks ties between variables with the same given position.
+    Returns {name: (x, y)}.
+    """
+    names, kinds, given = _elements(model_data)
+    if not names:
+        return {}
+    successors = _acyclic(names, _links(model_data, names))
+    predecessors = {name: [] for name in names}
+    for name in names:
+        for child in successors[name]:
+            predecessors[child].append(name)
+    layer = _layers(names, successors)
+
+    rng = random.Random(seed)
+    tiebreak = {name: rng.random() for name in names}
+    model_order = {name: i for i, name in enumerate(names)}
+    columns = [[] for _ in range(max(layer.values()) + 1)]
+    for name in sorted(names, key=lambda n: (given[n][1] if n in given else math.inf, model_order[n],
+                                             tiebreak[n])):
+        columns[layer[name]].append(name)
+
+    rank = {}
+    for column in columns:
+        rank.update((name, i) for i, name in enumerate(column))
+    for sweep in range(sweeps):
+        # Alternate between ordering by the variables before and after each column
+        neighbours = predecessors if sweep % 2 == 0 else successors
+        order = columns if sweep % 2 == 0 else columns[::-1]
+        for column in order:
+            def barycenter(name):
+                linked = neighbours[name]
+                return sum(rank[n] for n in linked) / len(linked) if linked else rank[name]
+
+            column.sort(key=lambda name: (barycenter(name), rank[name]))
+            rank.update((name, i) for i, name in enumerate(column))
+
+    # Wrap tall columns into several, then long runs of columns into bands below each other
+    max_rows = max(8, math.ceil(math.sqrt(len(names)) * 1.5))
+    slots = []
+    for column in columns:
+        for first in range(0, len(column), max_rows):
+            slots.append(column[first:first + max_rows])
+    rows = max(len(slot) for slot in slots)
+    bands = max(1, round(math.sqrt(len(slots) * COLUMN_SPACING / (rows * ROW_SPACING))))
+    per_band = math.ceil(len(slots) / bands)
+
+    positions = {}
+    x0, y0 = ORIGIN
+    for k, slot in enumerate(slots):
+        band, column_x = divmod(k, per_band)
+        for i, name in enumerate(slot):
+            positions[name] = (x0 + column_x * COLUMN_SPACING, y0 + (band * (rows + 1) + i) * ROW_SPACING)
+    return positions
+
+
+def _neighbour_pairs(positions, radius):
+    """Returns (i, j) index arrays of every ordered pair of points closer than `radius` on the grid."""
+    import numpy as np
+
+    cells = np.floor(positions / radius).astype(np.int64)
+    cells -= cells.min(axis=0)
+    width = cells[:, 1].max() + 3
+    keys = cells[:, 0] * width + cells[:, 1]
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    pairs_i = []
+    pairs_j = []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            target = keys + dx * width + dy
+            lo = np.searchsorted(sorted_keys, target, side="left")
+            hi = np.searchsorted(sorted_keys, target, side="right")
+            counts = hi - lo
+            total = int(counts.sum())
+            if not total:
+                continue
+            i = np.repeat(np.arange(len(keys)), counts)
+            starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+            j = order[starts + np.arange(total)]
+            keep = i != j
+            pairs_i.append(i[keep])
+            pairs_j.append(j[keep])
+    if not pairs_i:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+
+def force_layout(model_data, seed=0, iterations=60, distance=160.0, refresh=5):
+    """
+    Fruchterman-Reingold layout: linked variables attract, variables closer
+    than twice `distance` repel. Repulsion is only computed between neighbours
+    found on a grid (searched again every `refresh` iterations), so an
+    iteration is linear in the size of the model. The variables start at their
+    given positions, or at their layered position, with a little jitter drawn
+    from `seed`. Densely linked groups end up closer than `distance`, so the
+    result is scaled up until the typical nearest neighbour is `distance`
+    away. Returns {name: (x, y)}.
+    """
+    import numpy as np
+
+    names, kinds, given = _elements(model_data)
+    if not names:
+        return {}
+    start = layered_layout(model_data, seed)
+    index = {name: i for i, name in enumerate(names)}
+    positions = np.array([given.get(name, start[name]) for name in names], dtype=float)
+    # Variables given the same position start from their layered one instead
+    seen = set()
+    for i, name in enumerate(names):
+        key = tuple(positions[i])
+        if key in seen:
+            positions[i] = start[name]
+        seen.add(key)
+    rng = np.random.default_rng(seed)
+    positions += rng.uniform(-distance / 10, distance / 10, positions.shape)
+
+    links = _links(model_data, names)
+    edges = np.array(sorted({(min(index[a], index[b]), max(index[a], index[b]))
+                             for a in names for b in links[a]}), dtype=np.int64).reshape(-1, 2)
+    temperature = distance
+    cooling = temperature / iterations
+    for iteration in range(iterations):
+        displacement = np.zeros_like(positions)
+        if iteration % refresh == 0:
+            i, j = _neighbour_pairs(positions, 2 * distance)
+        if len(i):
+            delta = positions[i] - positions[j]
+            dist = np.maximum(np.hypot(delta[:, 0], delta[:, 1]), 1.0)
+            force = np.where(dist < 2 * distance, distance * distance / dist, 0.0)
+            for axis in (0, 1):
+                displacement[:, axis] += np.bincount(i, delta[:, axis] * force / dist, minlength=len(names))
+        if len(edges):
+            a, b = edges[:, 0], edges[:, 1]
+            delta = positions[a] - positions[b]
+            dist = np.maximum(np.hypot(delta[:, 0], delta[:, 1]), 1.0)
+            for axis in (0, 1):
+                pull = delta[:, axis] * dist / distance
+                displacement[:, axis] -= np.bincount(a, pull, minlength=len(names))
+                displacement[:, axis] += np.bincount(b, pull, minlength=len(names))
+        length = np.maximum(np.hypot(displacement[:, 0], displacement[:, 1]), 1e-9)
+        positions += displacement * (np.minimum(length, temperature) / length)[:, None]
+        temperature = max(temperature - cooling, 1.0)
+
+    i, j = _neighbour_pairs(positions, 2 * distance)
+    if len(i):
+        nearest = np.full(len(names), np.inf)
+        np.minimum.at(nearest, i, np.hypot(*(positions[i] - positions[j]).T))
+        typical = np.median(nearest[np.isfinite(nearest)])
+        if typical < distance:
+            positions *= distance / max(typical, 1.0)
+    positions -= positions.min(axis=0) - ORIGIN
+    return {name: (float(x), float(y)) for name, (x, y) in zip(names, positions)}
+
+
+def grid_layout(model_data, seed=0):
+    """The positions the converter writes (sdmodel.xmile), before overlaps are removed."""
+    from sdmodel.xmile import _view_layout
+
+    positions = {}
+    for entry in _view_layout(model_data):
+        if entry[0] == "connector":
+            continue
+        try:
+            positions[entry[1]] = (float(entry[2]), float(entry[3]))
+        except ValueError:
+            positions[entry[1]] = ORIGIN
+    return positions
+
+
+LAYOUTS = {
+    "grid": grid_layout,
+    "layered": layered_layout,
+    "force": force_layout,
+}
+
+
+def remove_overlaps(positions, kinds):
+    """
+    Places the variables one by one, in order, at the free spot closest to
+    their position, searching outwards on rings of half the variable's size.
+    The ring reached in each cell of the index is remembered and the next
+    search in that cell starts just inside it, so a pile of variables in one
+    place does not search the same full rings again. Returns
+    {name: (x, y)} with integer coordinates.
+    """
+    cell_size = max(max(size) for size in ELEMENT_SIZES.values()) + 2 * MARGIN
+    index = SpatialGrid(cell_size)
+    first_ring = {}
+    placed = {}
+    for name, (x, y) in positions.items():
+        kind = kinds[name]
+        width, height = ELEMENT_SIZES[kind]
+        half_x, half_y = width / 2 + MARGIN, height / 2 + MARGIN
+        step_x, step_y = int(half_x), int(half_y)
+        x, y = round(x), round(y)
+        spot = (kind, x // cell_size, y // cell_size)
+        ring = max(first_ring.get(spot, 0) - 1, 0)
+        free = None
+        while free is None:
+            for dx, dy in _ring(ring):
+                cx, cy = x + dx * step_x, y + dy * step_y
+                if not index.overlaps((cx - half_x, cy - half_y, cx + half_x, cy + half_y)):
+                    free = (cx, cy)
+                    break
+            else:
+                ring += 1
+        first_ring[spot] = ring
+        placed[name] = free
+        index.insert(_box(kind, *free))
+    return placed
+
+
+def _ring(r):
+    # Offsets on the square ring at distance r, nearest to the centre line first
+    if r == 0:
+        yield 0, 0
+        return
+    for d in range(r + 1):
+        for sign in ((1, -1) if d else (1,)):
+            yield r, sign * d
+            yield -r, sign * d
+            yield sign * d, r
+            yield sign * d, -r
+
+
+def count_overlaps(positions, kinds):
+    """Number of variables whose box overlaps the box of a variable placed before it."""
+    index = SpatialGrid(max(max(size) for size in ELEMENT_SIZES.values()) + 2 * MARGIN)
+    overlaps = 0
+    for name, (x, y) in positions.items():
+        box = _box(kinds[name], x, y)
+        if index.overlaps(box):
+            overlaps += 1
+        index.insert(box)
+    return overlaps
+
+
+def compute_layout(model_data, method="layered", seed=0):
+    """
+    Runs a layout engine, a name from LAYOUTS or a function
+    (model_data, seed) -> {name: (x, y)}, and removes the overlaps.
+    Variables the engine leaves out keep their converter position.
+    Returns {name: (x, y)} in the order stocks, flows, auxiliaries.
+    """
+    model_data = to_model_data(model_data)
+    engine = LAYOUTS[method] if isinstance(method, str) else method
+    names, kinds, _ = _elements(model_data)
+    positions = engine(model_data, seed)
+    if len(positions) < len(names):
+        fallback = grid_layout(model_data)
+        positions = {name: positions.get(name, fallback[name]) for name in names}
+    return remove_overlaps({name: positions[name] for name in names}, kinds)
+
+
+def apply_layout(model_data, method="layered", seed=0):
+    """
+    Returns a copy of model_data with every stock, flow and auxiliary at its
+    compute_layout position (a new Model if given a Model).
+    """
+    if isinstance(model_data, Model):
+        return load_model(apply_layout(model_data.to_dict(), method, seed))
+    positions = compute_layout(model_data, method, seed)
+    laid_out = dict(model_data)
+    for _, category in CATEGORIES:
+        items = []
+        for item in model_data.get(category, []):
+            x, y = positions[item["name"]]
+            items.append(dict(item, x=x, y=y))
+        if category in model_data:
+            laid_out[category] = items
+    return laid_out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lay out the diagram of a JSON stock and flow model.")
+    parser.add_argument("model", help="JSON model file")
+    parser.add_argument("-o", "--output", required=True, help="write the model with new x/y positions here")
+    parser.add_argument("--method", choices=sorted(LAYOUTS), default="layered", help="layout engine (default: layered)")
+    parser.add_argument("--seed", type=int, default=0, help="seed for tie-breaking and jitter (default 0)")
+    args = parser.parse_args()
+
+    with open(args.model, "r") as f:
+        model_data = json.load(f)
+    _, kinds, _ = _elements(model_data)
+    before = count_overlaps(grid_layout(model_data), kinds)
+    laid_out = apply_layout(model_data, args.method, args.seed)
+    with open(args.output, "w") as f:
+        json.dump(laid_out, f, indent=2)
+    print(f"Laid out {len(kinds)} variables with '{args.method}' ({before} overlapping before, 0 after); "
+          f"saved to '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
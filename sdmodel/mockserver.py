@@ -0,0 +1,453 @@
+"""
+Local stand-in for the OpenAI and Gemini APIs, for load tests and offline runs.
+
+The server speaks enough of both wire formats for the SDK clients used by
+the image script and sdmodel.extraction:
+
+    POST /v1/responses                                 OpenAI Responses API (also with "stream": true)
+    POST /v1beta/models/<model>:generateContent        Gemini generate_content
+    POST /v1beta/models/<model>:streamGenerateContent  Gemini streaming (server-sent events)
+    GET  /stats                                        counts of the requests served so far
+
+Every answer is stock and flow model data: one of the `responses` given, or
+a synthetic model (sdmodel.synthetic) of `model_size` variables. Each request
+draws its latency from a distribution and may be answered with a 429, a 500
+or 503, a response wrapped in code fences or text, or malformed JSON, at the
+configured rates. Streamed answers are sent in pieces spread over the
+latency, the first one after a fifth of it.
+
+    python -m sdmodel.mockserver --port 8080 --latency lognormal:0.8,0.5 --rate-limit-rate 0.05 \
+        --error-rate 0.01 --fenced-rate 0.2 --malformed-rate 0.02
+
+    python -m sdmodel.extraction diagrams/ --base-url http://127.0.0.1:8080/v1 ...
+    python -m sdmodel.extraction diagrams/ --provider gemini --base-url http://127.0.0.1:8080 ...
+
+From Python, `with MockLLMServer(...).running() as server:` serves from a
+background thread; `server.openai_base_url` and `server.gemini_base_url`
+are the endpoints to give the clients. Only the standard library is used.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import random
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+# Latency distributions: name -> (number of parameters, sampler(rng, *parameters))
+LATENCY_DISTRIBUTIONS = {
+    "fixed": (1, lambda rng, seconds: seconds),
+    "uniform": (2, lambda rng, low, high: rng.uniform(low, high)),
+    "normal": (2, lambda rng, mean, sd: max(0.0, rng.gauss(mean, sd))),
+    "lognormal": (2, lambda rng, median, sigma: median * rng.lognormvariate(0.0, sigma)),
+    "exponential": (1, lambda rng, mean: rng.expovariate(1.0 / mean) if mean > 0 else 0.0),
+}
+
+_REASONS = {200: "OK", 404: "Not Found", 400: "Bad Request", 429: "Too Many Requests", 500: "Internal Server Error",
+            503: "Service Unavailable"}
+
+# Error bodies as each API sends them
+_OPENAI_ERRORS = {
+    429: {"message": "Rate limit reached for requests", "type": "requests", "param": None,
+          "code": "rate_limit_exceeded"},
+    500: {"message": "The server had an error while processing your request.", "type": "server_error", "param": None,
+          "code": None},
+    503: {"message": "The engine is currently overloaded, please try again later.", "type": "server_error",
+          "param": None, "code": None},
+}
+_GEMINI_ERRORS = {
+    429: ("Resource has been exhausted (e.g. check quota).", "RESOURCE_EXHAUSTED"),
+    500: ("Internal error encountered.", "INTERNAL"),
+    503: ("The model is overloaded. Please try again later.", "UNAVAILABLE"),
+}
+
+
+def parse_latency(spec):
+    """
+    Returns a function rng -> seconds for a latency spec: a number of seconds,
+    or "<distribution>:<parameters>" with the distributions of
+    LATENCY_DISTRIBUTIONS, e.g. "uniform:0.2,1.5" or "lognormal:0.8,0.5"
+    (median 0.8 s). Raises ValueError.
+    """
+    if isinstance(spec, (int, float)):
+        return lambda rng: float(spec)
+    name, _, arguments = spec.partition(":")
+    if name not in LATENCY_DISTRIBUTIONS:
+        try:
+            seconds = float(spec)
+        except ValueError:
+            raise ValueError(f"Unknown latency distribution {name!r}; "
+                             f"use one of {', '.join(LATENCY_DISTRIBUTIONS)}") from None
+        return lambda rng: seconds
+    count, sampler = LATENCY_DISTRIBUTIONS[name]
+    parameters = [float(value) for value in arguments.split(",") if value.strip()]
+    if len(parameters) != count:
+        raise ValueError(f"'{name}' latency takes {count} parameter(s), got {len(parameters)}")
+    return lambda rng: sampler(rng, *parameters)
+
+
+class MockLLMServer:
+    """
+    HTTP server imitating the OpenAI Responses and Gemini generate_content
+    endpoints. `latency` is a spec for parse_latency. The rates are the
+    shares of requests answered with a 429 (with a Retry-After of
+    `retry_after` seconds), a 500 or 503, fenced or wrapped text, and
+    malformed JSON. `responses` is a list of model_data dicts to answer with;
+    by default each answer is a new synthetic model of `model_size`
+    variables. Streamed text is sent `chunk_chars` characters at a time.
+    The same seed gives the same sequence of outcomes.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency="lognormal:0.8,0.5", rate_limit_rate=0.0, error_rate=0.0,
+                 fenced_rate=0.0, malformed_rate=0.0, retry_after=1.0, responses=None, model_size=20,
+                 chunk_chars=64, seed=0):
+        self.host = host
+        self.port = port
+        self.latency = parse_latency(latency)
+        self.rate_limit_rate = rate_limit_rate
+        self.error_rate = error_rate
+        self.fenced_rate = fenced_rate
+        self.malformed_rate = malformed_rate
+        self.retry_after = retry_after
+        self.responses = responses
+        self.model_size = model_size
+        self.chunk_chars = chunk_chars
+        self.rng = random.Random(seed)
+        self.stats = {}
+        self.reset_stats()
+        self._server = None
+        self._connections = set()
+        self._served = 0
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def openai_base_url(self):
+        """The base_url for the OpenAI clients."""
+        return self.url + "/v1"
+
+    @property
+    def gemini_base_url(self):
+        """The base_url for the Gemini client (its HttpOptions)."""
+        return self.url
+
+    def reset_stats(self):
+        self.stats = {"requests": 0, "openai": 0, "gemini": 0, "streamed": 0, "in_flight": 0, "max_in_flight": 0,
+                      "bytes_received": 0, "bytes_sent": 0, "outcomes": {}}
+
+    async def start(self):
+        """Starts listening; with port=0 a free port is picked and stored in self.port."""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        """Stops listening and closes the open connections, idle keep-alive ones included."""
+        if self._server is not None:
+            self._server.close()
+            for task in list(self._connections):
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    @contextlib.contextmanager
+    def running(self):
+        """Serves from a background thread for the duration of a with block, so blocking clients can use it."""
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+        errors = []
+
+        def serve():
+            asyncio.set_event_loop(loop)
+            try:
+                loop.run_until_complete(self.start())
+            except Exception as e:
+                errors.append(e)
+                started.set()
+                return
+            started.set()
+            loop.run_forever()
+
+        thread = threading.Thread(target=serve, name="mock-llm-server", daemon=True)
+        thread.start()
+        started.wait()
+        if errors:
+            thread.join()
+            loop.close()
+            raise errors[0]
+        try:
+            yield self
+        finally:
+            asyncio.run_coroutine_threadsafe(self.stop(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+    # --- HTTP ---
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                if "content-length" in headers:
+                    body = await reader.readexactly(int(headers["content-length"]))
+                elif headers.get("transfer-encoding", "").lower() == "chunked":
+                    body = await _read_chunked(reader)
+                else:
+                    body = b""
+                self.stats["bytes_received"] += len(request_line) + len(body)
+                await self._dispatch(method, target, body, writer)
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError, ValueError):
+            # A closed or stopped connection, or one that does not speak HTTP
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def _send(self, writer, status, body, content_type="application/json", extra_headers=()):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        head = [f"HTTP/1.1 {status} {_REASONS.get(status, 'Error')}", f"content-type: {content_type}",
+                f"content-length: {len(data)}", *extra_headers]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + data)
+        self.stats["bytes_sent"] += len(data)
+        await writer.drain()
+
+    async def _send_events(self, writer, events, delays):
+        """Sends server-sent events with chunked transfer encoding, waiting delays[i] before event i."""
+        writer.write(b"HTTP/1.1 200 OK\r\ncontent-type: text/event-stream\r\ncache-control: no-cache\r\n"
+                     b"transfer-encoding: chunked\r\n\r\n")
+        for event, delay in zip(events, delays):
+            if delay > 0:
+                await asyncio.sleep(delay)
+            data = event.encode("utf-8")
+            writer.write(f"{len(data):x}\r\n".encode("latin-1") + data + b"\r\n")
+            self.stats["bytes_sent"] += len(data)
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    async def _dispatch(self, method, target, body, writer):
+        url = urlsplit(target)
+        path = url.path
+        if method == "GET" and path.rstrip("/").endswith("/stats"):
+            await self._send(writer, 200, self.stats)
+            return
+        if method != "POST":
+            await self._send(writer, 404, {"error": {"message": f"No route for {method} {path}"}})
+            return
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            await self._send(writer, 400, {"error": {"message": "Request body is not JSON"}})
+            return
+        if path.endswith("/responses"):
+            provider, model, stream = "openai", request.get("model", "mock"), bool(request.get("stream"))
+        elif ":generateContent" in path or ":streamGenerateContent" in path:
+            provider, stream = "gemini", ":streamGenerateContent" in path
+            model = path.rsplit("/", 1)[-1].split(":", 1)[0]
+        else:
+            await self._send(writer, 404, {"error": {"message": f"No route for POST {path}"}})
+            return
+
+        stats = self.stats
+        stats["requests"] += 1
+        stats[provider] += 1
+        stats["streamed"] += stream
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            outcome, status, text = self._outcome()
+            stats["outcomes"][outcome] = stats["outcomes"].get(outcome, 0) + 1
+            if status != 200:
+                # Errors come back at once, as rate limits and overloads do
+                await self._send_error(writer, provider, status)
+                return
+            latency = self.latency(self.rng)
+            usage = (max(1, len(body) // 4), max(1, len(text) // 4))
+            if provider == "openai":
+                await self._answer_openai(writer, model, text, usage, stream, latency)
+            else:
+                await self._answer_gemini(writer, model, text, usage, stream, latency)
+        finally:
+            stats["in_flight"] -= 1
+
+    def _outcome(self):
+        """Draws what a request gets: (outcome name, HTTP status, response text)."""
+        rng = self.rng
+        draw = rng.random()
+        if draw < self.rate_limit_rate:
+            return "rate_limited", 429, ""
+        draw -= self.rate_limit_rate
+        if draw < self.error_rate:
+            status = rng.choice((500, 503))
+            return f"error_{status}", status, ""
+        text = json.dumps(self._model_data(), indent=2)
+        draw = rng.random()
+        if draw < self.malformed_rate:
+            return "malformed", 200, _malform(text, rng)
+        if draw < self.malformed_rate + self.fenced_rate:
+            return "fenced", 200, rng.choice((
+                f"```json\n{text}\n```",
+                f"Here is the extracted model:\n\n```json\n{text}\n```\n\nLet me know if you need changes.",
+                f"Here is the model data you asked for:\n{text}\nThe equations are suggestions.",
+            ))
+        return "ok", 200, text
+
+    def _model_data(self):
+        self._served += 1
+        if self.responses:
+            return self.responses[(self._served - 1) % len(self.responses)]
+        from sdmodel.synthetic import model_of_size
+
+        return model_of_size(self.model_size, seed=self._served)
+
+    async def _send_error(self, writer, provider, status):
+        headers = [f"retry-after: {self.retry_after:g}"] if status == 429 else []
+        if provider == "openai":
+            body = {"error": _OPENAI_ERRORS[status]}
+        else:
+            message, state = _GEMINI_ERRORS[status]
+            body = {"error": {"code": status, "message": message, "status": state}}
+        await self._send(writer, status, body, extra_headers=headers)
+
+    def _pieces(self, text, latency):
+        """Splits text for streaming; returns (pieces, delay before each piece, delay between pieces)."""
+        pieces = [text[i:i + self.chunk_chars] for i in range(0, len(text), self.chunk_chars)] or [""]
+        first = latency / 5
+        rest = (latency - first) / len(pieces)
+        return pieces, [first] + [rest] * (len(pieces) - 1), rest
+
+    async def _answer_openai(self, writer, model, text, usage, stream, latency):
+        response_id = "resp_" + uuid.uuid4().hex
+        message_id = "msg_" + uuid.uuid4().hex
+        response = {
+            "id": response_id, "object": "response", "created_at": int(time.time()), "status": "completed",
+            "model": model, "error": None, "incomplete_details": None, "instructions": None, "metadata": {},
+            "parallel_tool_calls": True, "temperature": 1.0, "top_p": 1.0, "tool_choice": "auto", "tools": [],
+            "output": [{"type": "message", "id": message_id, "status": "completed", "role": "assistant",
+                        "content": [{"type": "output_text", "text": text, "annotations": []}]}],
+            "usage": {"input_tokens": usage[0], "output_tokens": usage[1], "total_tokens": usage[0] + usage[1],
+                      "input_tokens_details": {"cached_tokens": 0},
+                      "output_tokens_details": {"reasoning_tokens": 0}},
+        }
+        if not stream:
+            await asyncio.sleep(latency)
+            await self._send(writer, 200, response)
+            return
+        pieces, delays, last = self._pieces(text, latency)
+        in_progress = dict(response, status="in_progress", output=[], usage=None)
+        events = [("response.created", {"response": in_progress})]
+        events += [("response.output_text.delta", {"item_id": message_id, "output_index": 0, "content_index": 0,
+                                                   "delta": piece, "logprobs": []}) for piece in pieces]
+        events += [
+            ("response.output_text.done", {"item_id": message_id, "output_index": 0, "content_index": 0,
+                                           "text": text, "logprobs": []}),
+            ("response.completed", {"response": response}),
+        ]
+        lines = [f"event: {kind}\ndata: {json.dumps(dict(data, type=kind, sequence_number=i))}\n\n"
+                 for i, (kind, data) in enumerate(events)]
+        await self._send_events(writer, lines, [0.0] + delays + [last, 0.0])
+
+    async def _answer_gemini(self, writer, model, text, usage, stream, latency):
+        def chunk(piece, final):
+            candidate = {"content": {"parts": [{"text": piece}], "role": "model"}, "index": 0}
+            metadata = {"promptTokenCount": usage[0], "totalTokenCount": usage[0]}
+            if final:
+                candidate["finishReason"] = "STOP"
+                metadata.update(candidatesTokenCount=usage[1], totalTokenCount=usage[0] + usage[1])
+            return {"candidates": [candidate], "usageMetadata": metadata, "modelVersion": model,
+                    "responseId": uuid.uuid4().hex[:22]}
+
+        if not stream:
+            await asyncio.sleep(latency)
+            await self._send(writer, 200, chunk(text, True))
+            return
+        pieces, delays, _ = self._pieces(text, latency)
+        lines = [f"data: {json.dumps(chunk(piece, i == len(pieces) - 1))}\r\n\r\n" for i, piece in enumerate(pieces)]
+        await self._send_events(writer, lines, delays)
+
+
+async def _read_chunked(reader):
+    body = bytearray()
+    while True:
+        size = int((await reader.readline()).split(b";", 1)[0], 16)
+        if size == 0:
+            await reader.readline()
+            return bytes(body)
+        body += await reader.readexactly(size)
+        await reader.readline()
+
+
+def _malform(text, rng):
+    # The ways LLM output breaks: cut off mid-way, or an entry that is not valid JSON
+    if rng.random() < 0.5:
+        return text[:max(1, int(len(text) * rng.uniform(0.3, 0.9)))]
+    position = text.find('"name"', len(text) // 3)
+    if position < 0:
+        return text + ","
+    return text[:position] + "name: " + text[position + len('"name":'):]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve fake OpenAI and Gemini responses with stock and flow models.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", default="lognormal:0.8,0.5",
+                        help="seconds, or fixed:S, uniform:A,B, normal:MEAN,SD, lognormal:MEDIAN,SIGMA, exponential:MEAN")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share answered with 500 or 503")
+    parser.add_argument("--fenced-rate", type=float, default=0.0, help="share wrapped in code fences or text")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="share with malformed JSON")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After of the 429s, in seconds")
+    parser.add_argument("--responses", help="JSON file with a model, or a list of models, to answer with")
+    parser.add_argument("--model-size", type=int, default=20, help="variables of the synthetic models (default 20)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    responses = None
+    if args.responses:
+        with open(args.responses, "r") as f:
+            responses = json.load(f)
+        if isinstance(responses, dict):
+            responses = [responses]
+    server = MockLLMServer(args.host, args.port, args.latency, args.rate_limit_rate, args.error_rate,
+                           args.fenced_rate, args.malformed_rate, args.retry_after, responses, args.model_size,
+                           seed=args.seed)
+
+    async def serve():
+        await server.start()
+        print(f"Serving on {server.url}: OpenAI base_url {server.openai_base_url}, "
+              f"Gemini base_url {server.gemini_base_url}")
+        await server.serve_forever()
+
+    with contextlib.suppress(KeyboardInterrupt):
+        asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Compact in-memory form of model_data.
+
+load_model() walks the JSON dictionaries once and returns a Model: one
+Variable object (with __slots__, no per-object dict) per stock, flow and
+auxiliary, interned names, the underscored XMILE identifier of every name, a
+name -> index map and arrays linking each flow to the stocks it drains and
+fills. The XMILE writers, print_summary and the simulation take a Model
+wherever they take model_data, so a model converted or simulated several
+times is only walked once.
+
+    from sdmodel.model import read_model
+    from sdmodel.xmile import generate_xmile
+
+    model = read_model("model.json")
+    print(model.index["Population"], model.stocks[0].ident)
+    generate_xmile(model, "model.xmile")
+
+Model.to_dict() returns model_data again. Only the standard library is used.
+
+For JSON files too large to load whole, read_model(path, streaming=True)
+builds the Model from the entries as sdmodel.jsonstream parses them, and
+outline=True also leaves out the equations, descriptions and units: what
+remains is what the view layout and print_summary need.
+"""
+from array import array
+
+# Kind of each variable and the model_data list it comes from
+CATEGORIES = (("stock", "stocks"), ("flow", "flows"), ("aux", "auxiliaries"))
+
+# Optional fields of a variable: model_data key -> attribute
+_FIELDS = (("eqn", "eqn"), ("description", "description"), ("unit", "unit"), ("x", "x"), ("y", "y"))
+
+
+class Variable:
+    """
+    One stock, flow or auxiliary. Fields missing from model_data are None;
+    `inflows` and `outflows` are tuples of flow names (empty unless a stock).
+    """
+
+    __slots__ = ("kind", "name", "ident", "eqn", "description", "unit", "x", "y", "inflows", "outflows")
+
+    def __init__(self, kind, name, eqn=None, description=None, unit=None, x=None, y=None, inflows=(),
+                 outflows=()):
+        self.kind = kind
+        self.name = name
+        self.ident = name.replace(" ", "_")
+        self.eqn = eqn
+        self.description = description
+        self.unit = unit
+        self.x = x
+        self.y = y
+        self.inflows = inflows
+        self.outflows = outflows
+
+    def __repr__(self):
+        return f"Variable({self.kind!r}, {self.name!r})"
+
+    def to_dict(self):
+        """The model_data dictionary of the variable, with only the fields that are set."""
+        item = {"name": self.name}
+        for key, attribute in _FIELDS:
+            value = getattr(self, attribute)
+            if value is not None:
+                item[key] = value
+        if self.kind == "stock":
+            item["inflows"] = list(self.inflows)
+            item["outflows"] = list(self.outflows)
+        return item
+
+
+class Model:
+    """
+    A loaded model (see load_model):
+
+        stocks, flows, auxiliaries   tuples of Variable
+        variables                    stocks + flows + auxiliaries, in that order
+        names                        tuple of the variable names, in the same order
+        index                        name -> position in `variables` (the first, if a name repeats)
+        connectors                   tuple of (src, tgt, angle or None)
+        flow_source, flow_sink       array of the position in `stocks` of the first stock each
+                                     flow drains / fills, -1 if none
+    """
+
+    __slots__ = ("stocks", "flows", "auxiliaries", "variables", "names", "index", "connectors", "flow_source",
+                 "flow_sink")
+
+    def __init__(self, stocks, flows, auxiliaries, connectors):
+        self.stocks = tuple(stocks)
+        self.flows = tuple(flows)
+        self.auxiliaries = tuple(auxiliaries)
+        self.variables = self.stocks + self.flows + self.auxiliaries
+        self.names = tuple(v.name for v in self.variables)
+        self.connectors = tuple(connectors)
+        index = {}
+        for i, name in enumerate(self.names):
+            index.setdefault(name, i)
+        self.index = index
+
+        # Flows are matched to stocks by exact name, keeping the first stock found
+        source, sink = {}, {}
+        for position, stock in enumerate(self.stocks):
+            for flow in stock.outflows:
+                source.setdefault(flow, position)
+            for flow in stock.inflows:
+                sink.setdefault(flow, position)
+        self.flow_source = array("i", [source.get(flow.name, -1) for flow in self.flows])
+        self.flow_sink = array("i", [sink.get(flow.name, -1) for flow in self.flows])
+
+    def __len__(self):
+        return len(self.variables)
+
+    def __repr__(self):
+        return (f"Model({len(self.stocks)} stocks, {len(self.flows)} flows, {len(self.auxiliaries)} auxiliaries, "
+                f"{len(self.connectors)} connectors)")
+
+    def variable(self, name):
+        """The Variable called `name`. Raises KeyError if there is none."""
+        return self.variables[self.index[name]]
+
+    def identifier(self, name):
+        """The XMILE identifier of `name` (spaces replaced by underscores), also for names not in the model."""
+        i = self.index.get(name)
+        return self.variables[i].ident if i is not None else name.replace(" ", "_")
+
+    def to_dict(self):
+        """Returns the model as model_data."""
+        model_data = {category: [v.to_dict() for v in getattr(self, category)] for _, category in CATEGORIES}
+        connectors = []
+        for src, tgt, angle in self.connectors:
+            conn = {"src": src, "tgt": tgt}
+            if angle is not None:
+                conn["angle"] = angle
+            connectors.append(conn)
+        model_data["connectors"] = connectors
+        return model_data
+
+
+def _variable(kind, item, intern, outline=False):
+    """Builds the Variable of one model_data entry; `intern` is a dict's setdefault."""
+    get = item.get
+    name = item["name"]
+    if kind == "stock":
+        inflows = tuple([intern(flow, flow) for flow in get("inflows", ())])
+        outflows = tuple([intern(flow, flow) for flow in get("outflows", ())])
+    else:
+        inflows = outflows = ()
+    if outline:
+        return Variable(kind, intern(name, name), x=get("x"), y=get("y"), inflows=inflows, outflows=outflows)
+    return Variable(kind, intern(name, name), get("eqn"), get("description"), get("unit"), get("x"), get("y"),
+                    inflows, outflows)
+
+
+def _connector(conn, intern):
+    return intern(conn["src"], conn["src"]), intern(conn["tgt"], conn["tgt"]), conn.get("angle")
+
+
+def load_model(model_data):
+    """
+    Builds a Model from model_data. A Model is returned unchanged, so
+    functions can call this on whichever of the two they are given.
+    """
+    if isinstance(model_data, Model):
+        return model_data
+    # Names repeat in stocks, flow lists and connectors; interning keeps one copy of each string
+    strings = {}
+    intern = strings.setdefault
+    lists = {category: [_variable(kind, item, intern) for item in model_data.get(category, [])]
+             for kind, category in CATEGORIES}
+    connectors = [_connector(conn, intern) for conn in model_data.get("connectors", [])]
+    return Model(lists["stocks"], lists["flows"], lists["auxiliaries"], connectors)
+
+
+def load_model_items(items, outline=False):
+    """
+    Builds a Model from (category, entry) pairs in any order, such as those
+    of sdmodel.jsonstream.stream_items, keeping only the Variables. With
+    outline=True the equations, descriptions and units are dropped.
+    """
+    strings = {}
+    intern = strings.setdefault
+    kinds = {category: kind for kind, category in CATEGORIES}
+    lists = {category: [] for _, category in CATEGORIES}
+    connectors = []
+    for category, item in items:
+        if category == "connectors":
+            connectors.append(_connector(item, intern))
+        else:
+            lists[category].append(_variable(kinds[category], item, intern, outline))
+    return Model(lists["stocks"], lists["flows"], lists["auxiliaries"], connectors)
+
+
+def to_model_data(model):
+    """Returns model_data for a Model or model_data (unchanged), for code that works on dictionaries."""
+    return model.to_dict() if isinstance(model, Model) else model
+
+
+def read_model(json_filename, streaming=False, outline=False):
+    """
+    Reads a JSON model file straight into a Model. With streaming=True the
+    file is parsed a block at a time and the entries are loaded as they are
+    decoded, so the JSON document is never held in memory; outline=True
+    (which implies streaming) also drops the equations, descriptions and units.
+    """
+    if streaming or outline:
+        from sdmodel.jsonstream import stream_items
+
+        return load_model_items(stream_items(json_filename), outline)
+    import json
+
+    with open(json_filename, "r") as f:
+        return load_model(json.load(f))
@@ -0,0 +1,435 @@
+"""
+NumPy simulation engine for the stock and flow models in model_data.
+
+Each equation is parsed once (sdmodel.equations). Auxiliaries and flows are
+ordered topologically from their equation references and the model's
+connectors. Equations that have the same shape at the same depth of the
+dependency graph, such as all the "Stock * Rate" flows, are then evaluated
+together with one NumPy operation per step. The groups are written out as the
+source of one Python function per model (sdmodel.codegen), and compiled
+models are cached on disk, keyed by a hash of the model structure. Stocks
+are integrated with Euler or fourth-order Runge-Kutta.
+
+    results = simulate(model_data)
+    results["values"][:, results["index"]["Population"]]
+
+All state lives in one array with a row per variable and a column per run,
+so the same compiled model can also run a batch of N parameter sets at once.
+"""
+import math
+
+import numpy as np
+
+from sdmodel.codegen import KernelCache, build_kernel, kernel_source, model_hash
+from sdmodel.equations import EquationError, compile_eqn_parser, references, uses_time
+from sdmodel.graph import find_loops, topological_order
+from sdmodel.model import to_model_data
+from sdmodel.store import ResultStore
+
+# The simulation specifications written into the XMILE files
+SIM_SPECS = {"start": 0.0, "stop": 100.0, "dt": 0.25}
+
+METHODS = ("euler", "rk4")
+
+
+def _pulse(t, dt, magnitude, first, interval=0.0):
+    # Stella-style PULSE: an impulse of `magnitude` spread over one dt
+    since = t - first
+    if interval and interval > 0:
+        hit = (since >= 0) & (np.mod(since, interval) < dt / 2)
+    else:
+        hit = (since >= 0) & (since < dt / 2)
+    return np.where(hit, magnitude / dt, 0.0)
+
+
+# Built-in functions: name -> (implementation, number of arguments or None for any).
+# Implementations receive the context (time, dt, start, stop) first.
+FUNCTIONS = {
+    "ABS": (lambda c, x: np.abs(x), 1),
+    "EXP": (lambda c, x: np.exp(x), 1),
+    "LN": (lambda c, x: np.log(x), 1),
+    "LOG10": (lambda c, x: np.log10(x), 1),
+    "SQRT": (lambda c, x: np.sqrt(x), 1),
+    "SIN": (lambda c, x: np.sin(x), 1),
+    "COS": (lambda c, x: np.cos(x), 1),
+    "TAN": (lambda c, x: np.tan(x), 1),
+    "ARCTAN": (lambda c, x: np.arctan(x), 1),
+    "INT": (lambda c, x: np.floor(x), 1),
+    "MIN": (lambda c, *xs: _reduce(np.minimum, xs), None),
+    "MAX": (lambda c, *xs: _reduce(np.maximum, xs), None),
+    "IF_THEN_ELSE": (lambda c, cond, a, b: np.where(cond, a, b), 3),
+    "STEP": (lambda c, height, start: np.where(c[0] >= start, height, 0.0), 2),
+    "RAMP": (lambda c, slope, start: np.where(c[0] >= start, slope * (c[0] - start), 0.0), 2),
+    "PULSE": (lambda c, *args: _pulse(c[0], c[1], *args), None),
+    "TIME": (lambda c: c[0], 0),
+    "DT": (lambda c: c[1], 0),
+    "STARTTIME": (lambda c: c[2], 0),
+    "STOPTIME": (lambda c: c[3], 0),
+    "PI": (lambda c: math.pi, 0),
+}
+
+_OPERATORS = {
+    "+": np.add,
+    "-": np.subtract,
+    "*": np.multiply,
+    "/": np.divide,
+    "^": np.power,
+    "mod": np.mod,
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "=": np.equal,
+    "<>": np.not_equal,
+    "and": np.logical_and,
+    "or": np.logical_or,
+}
+
+
+def _reduce(func, values):
+    result = values[0]
+    for value in values[1:]:
+        result = func(result, value)
+    return result
+
+
+def _template(node, slots, consts):
+    """
+    Replaces the variables and numbers of a syntax tree by numbered slots.
+    Equations with the same template can be evaluated with one NumPy call.
+    """
+    kind = node[0]
+    if kind == "var":
+        slots.append(node[1])
+        return ("slot", len(slots) - 1)
+    if kind == "num":
+        consts.append(node[1])
+        return ("const", len(consts) - 1)
+    if kind in ("neg", "not"):
+        return (kind, _template(node[1], slots, consts))
+    if kind == "bin":
+        return ("bin", node[1], _template(node[2], slots, consts), _template(node[3], slots, consts))
+    if kind == "if":
+        return ("if",) + tuple(_template(child, slots, consts) for child in node[1:])
+    return ("call", node[1], tuple(_template(arg, slots, consts) for arg in node[2]))
+
+
+def _compile(node, slots, consts):
+    """
+    Turns a template into a function of (values, context). `slots` holds the
+    row (or array of rows) read for each slot, `consts` the value (or column
+    of values) for each constant.
+    """
+    kind = node[0]
+    if kind == "slot":
+        row = slots[node[1]]
+        return lambda v, c: v[row]
+    if kind == "const":
+        value = consts[node[1]]
+        return lambda v, c: value
+    if kind == "neg":
+        operand = _compile(node[1], slots, consts)
+        return lambda v, c: -operand(v, c)
+    if kind == "not":
+        operand = _compile(node[1], slots, consts)
+        return lambda v, c: np.logical_not(operand(v, c))
+    if kind == "bin":
+        op = _OPERATORS[node[1]]
+        left = _compile(node[2], slots, consts)
+        right = _compile(node[3], slots, consts)
+        return lambda v, c: op(left(v, c), right(v, c))
+    if kind == "if":
+        cond, then, other = (_compile(child, slots, consts) for child in node[1:])
+        return lambda v, c: np.where(cond(v, c), then(v, c), other(v, c))
+    func = FUNCTIONS[node[1]][0]
+    args = [_compile(arg, slots, consts) for arg in node[2]]
+    return lambda v, c: func(c, *[arg(v, c) for arg in args])
+
+
+def _check_calls(node, name):
+    """Raises EquationError for unknown functions or a wrong number of arguments."""
+    kind = node[0]
+    if kind == "call":
+        if node[1] not in FUNCTIONS:
+            raise EquationError(f"Unsupported function {node[1]} in the equation of {name!r}")
+        arity = FUNCTIONS[node[1]][1]
+        if arity is not None and arity != len(node[2]):
+            raise EquationError(f"{node[1]} expects {arity} argument(s) in the equation of {name!r}")
+        children = node[2]
+    elif kind in ("neg", "not"):
+        children = node[1:]
+    elif kind == "bin":
+        children = node[2:]
+    elif kind == "if":
+        children = node[1:]
+    else:
+        children = ()
+    for child in children:
+        _check_calls(child, name)
+
+
+def compile_model(model_data, cache=None):
+    """
+    Parses and orders the equations of model_data once, so that the result can
+    be simulated many times with run_model. Raises EquationError if an equation
+    cannot be parsed, refers to an unknown variable or is part of an algebraic loop.
+
+    `cache` is a KernelCache, "default" for the one in ~/.cache, or None
+    (the default) to compile every time. With a cache, a model with the same
+    equations, flows and connectors as an earlier one is loaded from it
+    instead of being compiled again.
+    """
+    model_data = to_model_data(model_data)
+    if cache == "default":
+        cache = KernelCache()
+    if cache is not None:
+        model_key = model_hash(model_data)
+        compiled = cache.get(model_key)
+        if compiled is not None:
+            return compiled
+
+    stocks = [s["name"] for s in model_data.get("stocks", [])]
+    flows = [f["name"] for f in model_data.get("flows", [])]
+    auxiliaries = [a["name"] for a in model_data.get("auxiliaries", [])]
+    names = stocks + flows + auxiliaries
+    stock_set = set(stocks)
+    index = {}
+    for i, name in enumerate(names):
+        if name in index:
+            raise EquationError(f"Variable {name!r} is defined more than once")
+        index[name] = i
+
+    # Parse every equation once
+    parse = compile_eqn_parser(names)
+    trees = {}
+    for category in ["stocks", "flows", "auxiliaries"]:
+        for item in model_data.get(category, []):
+            eqn = item.get("eqn")
+            if eqn is None or eqn == "":
+                raise EquationError(f"Variable {item['name']!r} has no equation")
+            try:
+                tree = parse(eqn)
+            except EquationError as e:
+                raise EquationError(f"{item['name']!r}: {e}") from None
+            undefined = sorted(ref for ref in references(tree) if ref not in index)
+            if undefined:
+                raise EquationError(f"Equation of {item['name']!r} refers to undefined name(s): {', '.join(undefined)}")
+            _check_calls(tree, item["name"])
+            trees[item["name"]] = tree
+    deps = {name: references(tree) for name, tree in trees.items()}
+
+    # Initialization order: stocks use their initial value equations, everything else its equation
+    init_order = topological_order(names, deps)
+    if len(init_order) < len(names):
+        loop = find_loops(names, deps)[0]
+        raise EquationError(f"The initial values of these variables depend on each other in a loop: {', '.join(loop)}")
+
+    # Order auxiliaries and flows from their equations; connectors between them add ordering hints
+    # unless they would create a loop that the equations themselves do not have.
+    computed = flows + auxiliaries
+    eqn_deps = {name: deps[name] - stock_set for name in computed}
+    hinted_deps = {name: set(eqn_deps[name]) for name in computed}
+    for conn in model_data.get("connectors", []):
+        src, tgt = conn.get("src"), conn.get("tgt")
+        if src in hinted_deps and tgt in hinted_deps and src != tgt:
+            hinted_deps[tgt].add(src)
+    order = topological_order(computed, hinted_deps)
+    if len(order) < len(computed):
+        order = topological_order(computed, eqn_deps)
+    if len(order) < len(computed):
+        loop = find_loops(computed, eqn_deps)[0]
+        raise EquationError(f"Algebraic loop involving: {', '.join(loop)}")
+
+    # A variable is dynamic if it depends on a stock or on time; the others are computed once
+    dynamic = set()
+    for name in order:
+        if uses_time(trees[name]) or any(dep in dynamic or dep in stock_set for dep in deps[name]):
+            dynamic.add(name)
+
+    # Level of each dynamic variable: variables of the same level do not depend on each other
+    # and can be evaluated together. Levels are assigned as late as possible, which puts all
+    # the flows that feed only stocks into the last level and keeps the groups large.
+    users = {name: [] for name in dynamic}
+    for name in dynamic:
+        for dep in eqn_deps[name]:
+            if dep in dynamic:
+                users[dep].append(name)
+    height = {}
+    for name in reversed(order):
+        if name in dynamic:
+            height[name] = 1 + max((height[user] for user in users[name]), default=0)
+    top = max(height.values(), default=0)
+    level = {name: top - h for name, h in height.items()}
+
+    groups = {}
+    for name in order:
+        if name in dynamic:
+            slots, consts = [], []
+            shape = _template(trees[name], slots, consts)
+            group = groups.setdefault((level[name], shape), ([], [], []))
+            group[0].append(index[name])
+            group[1].append([index[slot] for slot in slots])
+            group[2].append(consts)
+    kernel_specs = []
+    for (_, shape), (rows, slot_rows, const_values) in sorted(groups.items(), key=lambda g: g[0][0]):
+        slot_arrays = [np.array(col, dtype=np.intp) for col in zip(*slot_rows)]
+        const_arrays = [np.array(col, dtype=float) for col in zip(*const_values)]
+        kernel_specs.append((np.array(rows, dtype=np.intp), shape, slot_arrays, const_arrays))
+
+    # Initial values are evaluated one variable at a time, once per run
+    initializers = []
+    for name in init_order:
+        slots, consts = [], []
+        shape = _template(trees[name], slots, consts)
+        initializers.append((index[name], shape, [index[slot] for slot in slots], consts))
+
+    # Net flow into each stock: inflows add, outflows subtract
+    flow_lookup = {}
+    for flow in flows:
+        flow_lookup.setdefault(flow, flow)
+        flow_lookup.setdefault(flow.replace(" ", "_"), flow)
+    edges = []
+    for position, stock in enumerate(model_data.get("stocks", [])):
+        for key, sign in (("inflows", 1.0), ("outflows", -1.0)):
+            for flow in stock.get(key, []):
+                if flow not in flow_lookup:
+                    raise EquationError(f"Stock {stock['name']!r} lists unknown flow {flow!r} in its {key}")
+                edges.append((position, index[flow_lookup[flow]], sign))
+    edges.sort()
+    edge_stocks = np.array([e[0] for e in edges], dtype=np.intp)
+    starts = np.flatnonzero(np.r_[True, edge_stocks[1:] != edge_stocks[:-1]]) if edges else np.zeros(0, np.intp)
+
+    source, bindings, batch_bindings = kernel_source(kernel_specs, len(stocks), bool(edges))
+    if edges:
+        bindings["edge_flows"] = np.array([e[1] for e in edges], dtype=np.intp)
+        bindings["edge_starts"] = starts
+        bindings["fed_stocks"] = edge_stocks[starts]
+        batch_bindings["edge_signs"] = np.array([e[2] for e in edges], dtype=float)
+
+    compiled = {
+        "names": names,
+        "index": index,
+        "n_stocks": len(stocks),
+        "static": [name for name in order if name not in dynamic],
+        "dynamic": [name for name in order if name in dynamic],
+        "initializers": initializers,
+        "source": source,
+        "code": compile(source, "<sdmodel kernel>", "exec"),
+        "bindings": bindings,
+        "batch_bindings": batch_bindings,
+    }
+    if cache is not None:
+        cache.put(model_key, compiled)
+    return compiled
+
+
+def _make_derivative(compiled, context, batched):
+    """
+    Returns the generated function that updates auxiliaries and flows in place
+    and returns the stock derivatives. Batched values have one column per run;
+    a single run uses a flat array, which NumPy indexes noticeably faster.
+    """
+    functions = {name: func for name, (func, _) in FUNCTIONS.items()}
+    return build_kernel(compiled["code"], compiled["bindings"], compiled["batch_bindings"], context, functions,
+                        batched)
+
+
+def run_model(compiled, start=None, stop=None, dt=None, method="euler", overrides=None,
+              batch_size=None, save_every=1, record=None, output=None, flush_every=1024):
+    """
+    Simulates a model prepared by compile_model.
+
+    `overrides` maps variable names to values that replace their equations:
+    initial values for stocks, or values for auxiliaries and flows that do not
+    depend on stocks or time. A value may be a scalar or, for batched runs, an
+    array of `batch_size` values. `record` limits the saved output to a list of
+    variable names. Returns a dict with 'time' (n_saved,), 'values' (n_saved,
+    n_recorded) or (n_saved, batch_size, n_recorded), 'names' and 'index'.
+
+    With an `output` directory the results are written to a ResultStore
+    (sdmodel.store) every `flush_every` saved steps instead of being kept in
+    memory. 'values' is then a view of the memory-mapped store, which is
+    returned as 'store'.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown integration method {method!r}, expected one of {METHODS}")
+    start = SIM_SPECS["start"] if start is None else float(start)
+    stop = SIM_SPECS["stop"] if stop is None else float(stop)
+    dt = SIM_SPECS["dt"] if dt is None else float(dt)
+    if dt <= 0 or stop < start:
+        raise ValueError("The simulation needs dt > 0 and stop >= start")
+    n_steps = int(round((stop - start) / dt))
+    index = compiled["index"]
+    overrides = overrides or {}
+    dynamic = set(compiled["dynamic"])
+    for name in overrides:
+        if name not in index:
+            raise KeyError(f"Unknown variable {name!r}")
+        if name in dynamic:
+            raise ValueError(f"{name!r} depends on stocks or time and cannot be overridden")
+    recorded = compiled["names"] if record is None else list(record)
+    for name in recorded:
+        if name not in index:
+            raise KeyError(f"Unknown variable {name!r}")
+    rows = slice(None) if record is None else np.array([index[name] for name in recorded], dtype=np.intp)
+
+    # One row per variable and one column per run
+    values = np.zeros((len(compiled["names"]),) if batch_size is None else (len(compiled["names"]), batch_size))
+    context = [start, dt, start, stop]
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        for row, shape, slots, consts in compiled["initializers"]:
+            name = compiled["names"][row]
+            values[row] = overrides[name] if name in overrides else _compile(shape, slots, consts)(values, context)
+
+        derivative = _make_derivative(compiled, context, batch_size is not None)
+        stocks = values[:compiled["n_stocks"]]  # stocks come first, so this is a view
+        n_saved = n_steps // save_every + 1
+        times = start + np.arange(n_saved) * save_every * dt
+        if output is None:
+            store = None
+            saved = np.empty((n_saved, len(recorded)) + values.shape[1:])
+        else:
+            # Only one chunk of saved steps is kept in memory
+            store = ResultStore.create(output, recorded, times, batch_size)
+            saved = np.empty((min(n_saved, flush_every), len(recorded)) + values.shape[1:])
+        k = 0
+        first = 0
+        for step in range(n_steps + 1):
+            t = start + step * dt
+            k1 = derivative(values, t)
+            if step % save_every == 0:
+                saved[k - first] = values[rows]
+                k += 1
+                if store is not None and (k - first == len(saved) or k == n_saved):
+                    store.write(first, saved[:k - first])
+                    store.flush(complete=k == n_saved)
+                    first = k
+            if step == n_steps:
+                break
+            if method == "euler":
+                stocks += dt * k1
+            else:
+                initial = stocks.copy()
+                stocks[:] = initial + dt / 2 * k1
+                k2 = derivative(values, t + dt / 2)
+                stocks[:] = initial + dt / 2 * k2
+                k3 = derivative(values, t + dt / 2)
+                stocks[:] = initial + dt * k3
+                k4 = derivative(values, t + dt)
+                stocks[:] = initial + dt / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+
+    # Present the results as (time, run, variable), or (time, variable) for a single run
+    if store is not None:
+        saved = store.values.transpose(1, 2, 0) if batch_size is not None else store.values.T
+    elif batch_size is not None:
+        saved = np.moveaxis(saved, 1, 2)
+    result = {"time": times, "values": saved, "names": recorded,
+              "index": index if record is None else {name: i for i, name in enumerate(recorded)}}
+    if store is not None:
+        result["store"] = store
+    return result
+
+
+def simulate(model_data, cache=None, **kwargs):
+    """Compiles and runs model_data in one call. Keyword arguments are passed to run_model."""
+    return run_model(compile_model(model_data, cache), **kwargs)
@@ -0,0 +1,233 @@
+"""
+Columnar, memory-mapped store for simulation results.
+
+A store is a directory holding
+
+    values.npy   float64, (n_variables, n_saved) or (n_variables, n_saved, n_runs)
+    time.npy     (n_saved,)
+    meta.json    variable names, number of runs, rows written, extra attributes
+
+Every variable is one contiguous column, so reading one variable or a time
+range of it is a zero-copy view of the memory-mapped file, however large the
+store is. run_model (sdmodel.simulation) and run_sweep (sdmodel.sweep) write
+into a store chunk by chunk when given an `output` directory, so a long run
+never holds its whole time series in memory.
+
+    store = ResultStore.open("results.sdstore")
+    time, population = store.select("Population", start=10, stop=50)
+    store.to_csv("results.csv")
+
+    python -m sdmodel.store results.sdstore --csv results.csv --names Population
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+STORE_VERSION = 1
+
+# Values exported per chunk; the rows per chunk follow from the number of columns
+EXPORT_CHUNK_VALUES = 262144
+
+
+class ResultStore:
+    """
+    Results of one simulation or sweep, memory-mapped from `path`.
+    Use ResultStore.create to make a new store and ResultStore.open to read one.
+    """
+
+    def __init__(self, path, meta, values, time):
+        self.path = path
+        self.meta = meta
+        self.names = meta["names"]
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.n_runs = meta["n_runs"]
+        self.values = values
+        self.time = time
+
+    @classmethod
+    def create(cls, path, names, time, n_runs=None, attrs=None):
+        """
+        Preallocates a store for `names` over the given `time` points, with
+        one value per run when `n_runs` is set. `attrs` is saved in meta.json.
+        An existing store at `path` is replaced.
+        """
+        os.makedirs(path, exist_ok=True)
+        time = np.asarray(time, dtype=float)
+        shape = (len(names), len(time)) if n_runs is None else (len(names), len(time), n_runs)
+        values = np.lib.format.open_memmap(os.path.join(path, "values.npy"), mode="w+", dtype=np.float64,
+                                           shape=shape)
+        np.save(os.path.join(path, "time.npy"), time)
+        meta = {"version": STORE_VERSION, "names": list(names), "n_runs": n_runs, "rows_written": 0,
+                "complete": False, "attrs": attrs or {}}
+        store = cls(path, meta, values, np.load(os.path.join(path, "time.npy"), mmap_mode="r"))
+        store._write_meta()
+        return store
+
+    @classmethod
+    def open(cls, path, mode="r"):
+        """Opens an existing store; mode "r+" allows writing."""
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            meta = json.load(f)
+        if meta.get("version") != STORE_VERSION:
+            raise ValueError(f"Unsupported result store version {meta.get('version')!r} in {path!r}")
+        values = np.load(os.path.join(path, "values.npy"), mmap_mode=mode)
+        time = np.load(os.path.join(path, "time.npy"), mmap_mode="r")
+        return cls(path, meta, values, time)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.flush()
+
+    def _write_meta(self):
+        tmp_path = os.path.join(self.path, "meta.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.meta, f)
+        os.replace(tmp_path, os.path.join(self.path, "meta.json"))
+
+    def write(self, first_row, rows):
+        """
+        Writes consecutive saved steps starting at `first_row`. `rows` holds
+        one step per entry, shaped (k, n_variables) or (k, n_variables, n_runs).
+        """
+        rows = np.asarray(rows)
+        last = first_row + len(rows)
+        if rows.ndim == 2:
+            self.values[:, first_row:last] = rows.T
+        else:
+            self.values[:, first_row:last] = rows.transpose(1, 0, 2)
+        self.meta["rows_written"] = max(self.meta["rows_written"], last)
+
+    def write_runs(self, first_run, values):
+        """
+        Writes the whole time series of the runs from `first_run` on. `values`
+        has the layout of run_model's batched output: (n_saved, k, n_variables).
+        """
+        self.values[:, :, first_run:first_run + values.shape[1]] = np.asarray(values).transpose(2, 0, 1)
+        self.meta["rows_written"] = len(self.time)
+
+    def flush(self, complete=False):
+        """Writes buffered pages to disk and updates meta.json; `complete` marks the store as finished."""
+        if isinstance(self.values, np.memmap):
+            self.values.flush()
+        if complete:
+            self.meta["complete"] = True
+        self._write_meta()
+
+    def save_array(self, name, array):
+        """Saves an extra array, such as sweep parameters, next to the results."""
+        np.save(os.path.join(self.path, f"{name}.npy"), array)
+
+    def load_array(self, name):
+        return np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r")
+
+    def column(self, name):
+        """Returns the saved values of one variable, (n_saved,) or (n_saved, n_runs), without copying."""
+        return self.values[self.index[name]]
+
+    def _time_range(self, start, stop):
+        first = 0 if start is None else int(np.searchsorted(self.time, start, side="left"))
+        last = len(self.time) if stop is None else int(np.searchsorted(self.time, stop, side="right"))
+        return first, last
+
+    def select(self, names=None, start=None, stop=None):
+        """
+        Returns (time, values) between times `start` and `stop` (inclusive).
+        A single name gives that variable's values and None gives all variables
+        (n_variables first), both without copying; a list of names copies only
+        the selected columns.
+        """
+        first, last = self._time_range(start, stop)
+        if names is None:
+            values = self.values[:, first:last]
+        elif isinstance(names, str):
+            values = self.values[self.index[names], first:last]
+        else:
+            values = self.values[[self.index[name] for name in names], first:last]
+        return self.time[first:last], values
+
+    def iter_chunks(self, names=None, start=None, stop=None, chunk_rows=None):
+        """
+        Yields (time, rows) chunks of at most `chunk_rows` saved steps, with rows
+        shaped (k, n_selected) or (k, n_selected * n_runs), run by run per variable.
+        By default a chunk holds about EXPORT_CHUNK_VALUES values.
+        """
+        names = self.names if names is None else list(names)
+        columns = [self.index[name] for name in names]
+        first, last = self._time_range(start, stop)
+        if chunk_rows is None:
+            chunk_rows = max(1, EXPORT_CHUNK_VALUES // max(1, len(columns) * (self.n_runs or 1)))
+        for a in range(first, last, chunk_rows):
+            b = min(a + chunk_rows, last)
+            block = self.values[columns, a:b]
+            if block.ndim == 3:
+                block = block.transpose(1, 0, 2).reshape(b - a, -1)
+            else:
+                block = block.T
+            yield self.time[a:b], block
+
+    def column_labels(self, names=None):
+        names = self.names if names is None else list(names)
+        if self.n_runs is None:
+            return names
+        return [f"{name}[{run}]" for name in names for run in range(self.n_runs)]
+
+    def to_csv(self, path, names=None, start=None, stop=None, chunk_rows=None):
+        """Exports the selected variables and time range to CSV, one chunk of rows at a time."""
+        with open(path, "w") as f:
+            f.write(",".join(["time"] + [_csv_label(label) for label in self.column_labels(names)]) + "\n")
+            for time, rows in self.iter_chunks(names, start, stop, chunk_rows):
+                # repr is the shortest text that reads back as the same float
+                lines = np.column_stack([time, rows]).tolist()
+                f.write("".join(",".join(map(repr, line)) + "\n" for line in lines))
+
+    def to_parquet(self, path, names=None, start=None, stop=None, chunk_rows=None):
+        """Exports to Parquet with one row group per chunk. Needs pyarrow (pip install pyarrow)."""
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet export needs pyarrow: pip install pyarrow") from None
+
+        labels = ["time"] + self.column_labels(names)
+        schema = pa.schema([(label, pa.float64()) for label in labels])
+        with pq.ParquetWriter(path, schema) as writer:
+            for time, rows in self.iter_chunks(names, start, stop, chunk_rows):
+                arrays = [pa.array(np.ascontiguousarray(time))] + [pa.array(np.ascontiguousarray(col)) for col in rows.T]
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+
+def _csv_label(label):
+    if any(c in label for c in ',"\n'):
+        return '"' + label.replace('"', '""') + '"'
+    return label
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export simulation results from a result store.")
+    parser.add_argument("store", help="result store directory")
+    parser.add_argument("--csv", help="write CSV to this file")
+    parser.add_argument("--parquet", help="write Parquet to this file (needs pyarrow)")
+    parser.add_argument("--names", nargs="*", help="variables to export (default: all)")
+    parser.add_argument("--start", type=float, help="first time to export")
+    parser.add_argument("--stop", type=float, help="last time to export")
+    parser.add_argument("--chunk-rows", type=int, help="time steps written at a time (default: about 262144 values)")
+    args = parser.parse_args()
+
+    store = ResultStore.open(args.store)
+    print(f"{len(store.names)} variables, {len(store.time)} saved steps"
+          f"{'' if store.n_runs is None else f', {store.n_runs} runs'}"
+          f"{'' if store.meta['complete'] else ' (incomplete)'}")
+    if args.csv:
+        store.to_csv(args.csv, args.names, args.start, args.stop, args.chunk_rows)
+        print(f"CSV saved to '{args.csv}'")
+    if args.parquet:
+        store.to_parquet(args.parquet, args.names, args.start, args.stop, args.chunk_rows)
+        print(f"Parquet saved to '{args.parquet}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+Monte Carlo and parameter sweeps over the NumPy simulation engine.
+
+A sweep runs N parameter sets of the same model. Each set overrides auxiliary
+constants and/or stock initial values. The runs are integrated together as one
+batch, with one column per run. Sweeps that need more memory than
+`max_memory` are split into chunks, and chunks can be spread over worker
+processes:
+
+    python -m sdmodel.sweep model.json --runs 10000 --spread 0.1 --workers 8
+"""
+import argparse
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from sdmodel.model import to_model_data
+from sdmodel.simulation import METHODS, SIM_SPECS, compile_model, run_model
+from sdmodel.store import ResultStore
+
+# Default memory budget for one batch of runs
+MAX_MEMORY = 512 * 1024 * 1024
+
+
+def model_constants(model_data):
+    """
+    Returns {name: value} for the stock initial values and auxiliary constants
+    that are stored as plain numbers in the 'eqn' strings of model_data.
+    """
+    model_data = to_model_data(model_data)
+    constants = {}
+    for category in ["stocks", "auxiliaries"]:
+        for item in model_data.get(category, []):
+            try:
+                constants[item["name"]] = float(item.get("eqn"))
+            except (TypeError, ValueError):
+                continue
+    return constants
+
+
+def sample_parameters(base_values, n_runs, spread=0.1, distribution="uniform", seed=None):
+    """
+    Perturbs each base value by a relative `spread`: uniformly within
+    +/- spread, or normally with standard deviation `spread`.
+    Returns {name: array of n_runs values}.
+    """
+    rng = np.random.default_rng(seed)
+    samples = {}
+    for name, base in base_values.items():
+        if distribution == "uniform":
+            factors = rng.uniform(1 - spread, 1 + spread, n_runs)
+        elif distribution == "normal":
+            factors = rng.normal(1, spread, n_runs)
+        else:
+            raise ValueError(f"Unknown distribution {distribution!r}, expected 'uniform' or 'normal'")
+        samples[name] = base * factors
+    return samples
+
+
+# Compiled model of the current worker process, set by _init_worker
+_worker_model = None
+
+
+def _init_worker(model_data):
+    global _worker_model
+    _worker_model = compile_model(model_data)
+
+
+def _run_chunk(size, parameters, options):
+    result = run_model(_worker_model, batch_size=size, overrides=parameters, **options)
+    return result["time"], result["values"]
+
+
+def run_sweep(model_data, parameters, n_runs=None, outputs=None, start=None, stop=None, dt=None,
+              method="euler", save_every=1, workers=1, max_memory=MAX_MEMORY, output=None):
+    """
+    Simulates model_data once per parameter set.
+
+    `parameters` maps variable names to arrays of one value per run (see
+    sample_parameters); `n_runs` is only needed when it is empty. `outputs`
+    lists the variables to keep, by default the stocks. Runs are split into
+    chunks that fit in `max_memory` bytes, and into at least `workers` chunks,
+    which run in separate processes when workers > 1. With an `output`
+    directory each chunk is written to a ResultStore (sdmodel.store) as soon
+    as it finishes, together with the parameter values. 'values' is then a
+    view of the memory-mapped store, which is returned as 'store'.
+
+    Returns a dict with 'time', 'values' (n_saved, n_runs, n_outputs),
+    'names', 'parameters', 'elapsed' (seconds) and 'runs_per_second'.
+    """
+    parameters = {name: np.asarray(values, dtype=float) for name, values in parameters.items()}
+    sizes = {len(values) for values in parameters.values()}
+    if len(sizes) > 1:
+        raise ValueError("All parameters need the same number of values")
+    n_runs = sizes.pop() if sizes else n_runs
+    if not n_runs:
+        raise ValueError("A sweep needs parameter values or n_runs")
+
+    started = time.perf_counter()
+    compiled = compile_model(model_data)
+    if outputs is None:
+        outputs = compiled["names"][:compiled["n_stocks"]]
+    options = {"start": start, "stop": stop, "dt": dt, "method": method, "save_every": save_every,
+               "record": list(outputs)}
+
+    # Memory per run: the full state (a few copies during RK4) plus the saved outputs
+    start_time = SIM_SPECS["start"] if start is None else float(start)
+    stop_time = SIM_SPECS["stop"] if stop is None else float(stop)
+    step = SIM_SPECS["dt"] if dt is None else float(dt)
+    n_saved = int(round((stop_time - start_time) / step)) // save_every + 1
+    bytes_per_run = 8 * (6 * len(compiled["names"]) + n_saved * len(outputs))
+    chunk_size = max(1, min(n_runs, max_memory // bytes_per_run))
+    n_chunks = max(math.ceil(n_runs / chunk_size), min(workers, n_runs))
+    bounds = np.linspace(0, n_runs, n_chunks + 1).astype(int)
+
+    store = None
+    if output is not None:
+        saved_times = start_time + np.arange(n_saved) * save_every * step
+        store = ResultStore.create(output, list(outputs), saved_times, n_runs,
+                                   attrs={"parameters": list(parameters), "method": method})
+        if parameters:
+            store.save_array("parameters", np.array(list(parameters.values())))
+
+    def collect(parts):
+        # Chunks of runs in order: written to the store one by one, or concatenated in memory
+        kept = []
+        for a, (chunk_times, chunk_values) in zip(bounds[:-1], parts):
+            if store is not None:
+                store.write_runs(int(a), chunk_values)
+                store.flush()
+            else:
+                kept.append(chunk_values)
+        if store is not None:
+            store.flush(complete=True)
+            return chunk_times, store.values.transpose(1, 2, 0)
+        return chunk_times, np.concatenate(kept, axis=1)
+
+    chunks = [(int(b - a), {name: v[a:b] for name, v in parameters.items()}) for a, b in zip(bounds[:-1], bounds[1:])]
+    if workers > 1 and n_chunks > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(model_data,)) as pool:
+            futures = [pool.submit(_run_chunk, size, chunk_parameters, options) for size, chunk_parameters in chunks]
+
+            def finished():
+                # Drop each chunk once it has been collected
+                for i, future in enumerate(futures):
+                    futures[i] = None
+                    yield future.result()
+
+            times, values = collect(finished())
+    else:
+        def computed():
+            for size, chunk_parameters in chunks:
+                result = run_model(compiled, batch_size=size, overrides=chunk_parameters, **options)
+                yield result["time"], result["values"]
+
+        times, values = collect(computed())
+
+    elapsed = time.perf_counter() - started
+    result = {
+        "time": times,
+        "values": values,
+        "names": list(outputs),
+        "parameters": parameters,
+        "elapsed": elapsed,
+        "runs_per_second": n_runs / elapsed if elapsed > 0 else float("inf"),
+    }
+    if store is not None:
+        result["store"] = store
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a Monte Carlo sweep over a JSON stock and flow model.")
+    parser.add_argument("model", help="path to the model JSON file")
+    parser.add_argument("--runs", type=int, default=1000, help="number of parameter sets (default 1000)")
+    parser.add_argument("--spread", type=float, default=0.1, help="relative perturbation (default 0.1)")
+    parser.add_argument("--distribution", choices=["uniform", "normal"], default="uniform")
+    parser.add_argument("--params", nargs="*", help="variables to perturb (default: all numeric constants)")
+    parser.add_argument("--outputs", nargs="*", help="variables to save (default: all stocks)")
+    parser.add_argument("--method", choices=METHODS, default="euler")
+    parser.add_argument("--start", type=float)
+    parser.add_argument("--stop", type=float)
+    parser.add_argument("--dt", type=float)
+    parser.add_argument("--save-every", type=int, default=1, help="save every n-th step (default 1)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes (default: all cores)")
+    parser.add_argument("--max-memory", type=int, default=MAX_MEMORY // 2**20, help="MB per batch (default 512)")
+    parser.add_argument("--seed", type=int, help="random seed")
+    parser.add_argument("--output", default="sweep_results.npz", help="where to save the results (.npz)")
+    parser.add_argument("--store", help="write the results to this result store directory instead of .npz")
+    args = parser.parse_args()
+
+    with open(args.model, "r") as f:
+        model_data = json.load(f)
+
+    constants = model_constants(model_data)
+    if args.params:
+        missing = [name for name in args.params if name not in constants]
+        if missing:
+            parser.error(f"not numeric constants in the model: {', '.join(missing)}")
+        constants = {name: constants[name] for name in args.params}
+    parameters = sample_parameters(constants, args.runs, args.spread, args.distribution, args.seed)
+
+    results = run_sweep(model_data, parameters, n_runs=args.runs, outputs=args.outputs, start=args.start,
+                        stop=args.stop, dt=args.dt, method=args.method, save_every=args.save_every,
+                        workers=args.workers, max_memory=args.max_memory * 2**20, output=args.store)
+
+    if not args.store:
+        np.savez(args.output, time=results["time"], values=results["values"], names=np.array(results["names"]),
+                 parameter_names=np.array(list(parameters)),
+                 parameter_values=np.array(list(parameters.values())).reshape(len(parameters), args.runs))
+    print(f"Perturbed {len(parameters)} constants by {args.spread:.0%} ({args.distribution})")
+    print(f"{args.runs} runs in {results['elapsed']:.2f} s ({results['runs_per_second']:.0f} runs/s)")
+    print(f"Results saved to '{args.store or args.output}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Synthetic stock and flow models for benchmarks and examples.
+
+generate_model() builds a `model_data` dictionary with the requested numbers
+of stocks, flows, auxiliaries and connectors. Names are multi-word and
+overlap the way real ones do ("Urban Population", "Urban Population 2",
+"Urban Population Births"), and the equations use operators, MIN/MAX and
+IF_THEN_ELSE, so equation cleaning and parsing do realistic work. The model
+is valid and simulates without overflow: every reference is defined,
+auxiliaries only refer to stocks and earlier auxiliaries (no algebraic
+loops), and every flow drains a stock. The same arguments always give the
+same model.
+
+    from sdmodel.synthetic import generate_model
+    model_data = generate_model(stocks=250, flows=250, auxiliaries=500, seed=1)
+
+    python -m sdmodel.synthetic --variables 10000 -o model.json
+
+Only the standard library is used.
+"""
+import argparse
+import json
+import random
+
+_QUALIFIERS = [
+    "Urban", "Rural", "Regional", "Domestic", "Foreign", "Young", "Senior", "Public", "Private", "Northern",
+    "Southern", "Installed", "Potential", "Skilled", "Retail",
+]
+
+_STOCK_NOUNS = [
+    "Population", "Inventory", "Order Backlog", "Workforce", "Capital", "Housing Stock", "Customers", "Cash",
+    "Knowledge", "Pollution", "Water Reserve", "Infected People", "Energy Supply", "Savings", "Forest Area",
+]
+
+_FLOW_WORDS = [
+    "Births", "Deaths", "Hiring", "Attrition", "Production", "Shipments", "Investment", "Depreciation",
+    "Inflow", "Outflow", "Adoption", "Recovery", "Extraction", "Spending", "Growth",
+]
+
+_AUX_NOUNS = [
+    "Birth Rate", "Average Lifetime", "Adjustment Time", "Desired Level", "Capacity Utilization",
+    "Growth Fraction", "Effect of Crowding", "Price", "Demand", "Productivity", "Delay Time", "Target Level",
+    "Contact Rate", "Fraction Lost", "Normal Rate",
+]
+
+# Auxiliary equations over 1 to 3 earlier auxiliaries and a stock. Divisors are kept away from zero and
+# no template grows beyond its inputs, so long chains of auxiliaries stay between 0 and 1.
+_AUX_TEMPLATES = [
+    "{a} * {b}",
+    "{a} / MAX({b}, 1)",
+    "{a} * (1 - {b} / MAX({c}, 1))",
+    "MIN({a}, {b})",
+    "MAX(0, {a} - {b}) / MAX({c}, 1)",
+    "IF_THEN_ELSE({a} > {b}, {a}, {b})",
+    "({a} + {b}) * 0.5",
+    "SQRT(ABS({a}))",
+    "{a} * MIN(1, MAX(0, {stock}) / 1000)",
+]
+
+# Flow equations over a stock and one or two auxiliaries, draining at most half the stock per time unit
+_FLOW_TEMPLATES = [
+    "{stock} * {a}",
+    "{stock} / MAX({a}, 10)",
+    "MIN({stock}, {a})",
+    "{stock} * {a} * {b}",
+    "MAX(0, {stock} - {a}) * {b}",
+]
+
+# Share of auxiliaries that are plain constants
+_CONSTANT_SHARE = 0.3
+
+# Earlier auxiliaries an equation picks its references from, so chains form as in real models
+_WINDOW = 20
+
+
+def _unique(base, used):
+    # Repeated names get " 2", " 3", ... so they overlap the original word for word
+    name = base
+    count = 1
+    while name in used:
+        count += 1
+        name = f"{base} {count}"
+    used.add(name)
+    return name
+
+
+def _add_references(references, name, template, picks):
+    # The variables a template actually uses, each once, in order of appearance
+    used = []
+    for key, value in picks.items():
+        if "{" + key + "}" in template and value not in used:
+            used.append(value)
+    references[name] = used
+
+
+def generate_model(stocks=10, flows=None, auxiliaries=None, connectors=None, seed=0, positions=False):
+    """
+    Returns a synthetic model_data dict. `flows` defaults to the number of
+    stocks and `auxiliaries` to twice that. By default there is one connector
+    per reference in the equations; a `connectors` count drops the last ones
+    or adds connectors that no equation uses. With `positions`, every
+    variable gets 'x'/'y' on a grid, like an LLM that reports positions.
+    """
+    flows = stocks if flows is None else flows
+    auxiliaries = 2 * stocks if auxiliaries is None else auxiliaries
+    rng = random.Random(seed)
+    used = set()
+
+    stock_items = []
+    for i in range(stocks):
+        base = f"{_QUALIFIERS[i % len(_QUALIFIERS)]} {_STOCK_NOUNS[i // len(_QUALIFIERS) % len(_STOCK_NOUNS)]}"
+        stock_items.append({"name": _unique(base, used), "eqn": str(rng.choice([10, 50, 100, 250, 1000])),
+                            "inflows": [], "outflows": []})
+
+    aux_items = []
+    references = {}
+    for i in range(auxiliaries):
+        base = f"{_QUALIFIERS[i % len(_QUALIFIERS)]} {_AUX_NOUNS[i // len(_QUALIFIERS) % len(_AUX_NOUNS)]}"
+        name = _unique(base, used)
+        if i < 3 or rng.random() < _CONSTANT_SHARE:
+            eqn = str(rng.choice([0.01, 0.02, 0.05, 0.1, 0.2, 0.5]))
+        else:
+            candidates = [item["name"] for item in aux_items[-_WINDOW:]]
+            picks = {key: rng.choice(candidates) for key in ("a", "b", "c")}
+            templates = _AUX_TEMPLATES if stock_items else _AUX_TEMPLATES[:-1]
+            if stock_items:
+                picks["stock"] = rng.choice(stock_items)["name"]
+            template = rng.choice(templates)
+            eqn = template.format(**picks)
+            _add_references(references, name, template, picks)
+        aux_items.append({"name": name, "eqn": eqn})
+
+    flow_items = []
+    for i in range(flows):
+        stock = rng.choice(stock_items) if stock_items else None
+        base = f"{stock['name'] if stock else _QUALIFIERS[i % len(_QUALIFIERS)]} {_FLOW_WORDS[i % len(_FLOW_WORDS)]}"
+        name = _unique(base, used)
+        if stock and aux_items:
+            picks = {"stock": stock["name"], "a": rng.choice(aux_items)["name"], "b": rng.choice(aux_items)["name"]}
+            template = rng.choice(_FLOW_TEMPLATES)
+            eqn = template.format(**picks)
+            _add_references(references, name, template, picks)
+        elif stock:
+            eqn = f"{stock['name']} * 0.1"
+            references[name] = [stock["name"]]
+        else:
+            eqn = "1"
+        flow_items.append({"name": name, "eqn": eqn})
+        if stock:
+            # Drain the stock the flow depends on, and fill another one half of the time
+            stock["outflows"].append(name)
+            target = rng.choice(stock_items)
+            if target is not stock and rng.random() < 0.5:
+                target["inflows"].append(name)
+
+    connector_items = [{"src": src, "tgt": tgt} for tgt, sources in references.items() for src in sources]
+    if connectors is not None:
+        all_names = [item["name"] for item in stock_items + flow_items + aux_items]
+        del connector_items[connectors:]
+        while len(connector_items) < connectors and len(all_names) > 1:
+            src, tgt = rng.sample(all_names, 2)
+            connector_items.append({"src": src, "tgt": tgt})
+
+    if positions:
+        for i, item in enumerate(stock_items + flow_items + aux_items):
+            item["x"] = 100 + (i % 20) * 150
+            item["y"] = 100 + (i // 20) * 100
+    return {"stocks": stock_items, "flows": flow_items, "auxiliaries": aux_items, "connectors": connector_items}
+
+
+def model_of_size(variables, seed=0, positions=False):
+    """A model with `variables` variables: a quarter stocks, a quarter flows and half auxiliaries."""
+    stocks = max(1, variables // 4)
+    flows = max(0, min(variables - stocks, variables // 4))
+    return generate_model(stocks, flows, variables - stocks - flows, seed=seed, positions=positions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic stock and flow model as JSON.")
+    parser.add_argument("-o", "--output", required=True, help="JSON file to write")
+    parser.add_argument("--variables", type=int, help="total number of variables (a quarter stocks, a quarter flows)")
+    parser.add_argument("--stocks", type=int, default=10, help="number of stocks (default 10)")
+    parser.add_argument("--flows", type=int, help="number of flows (default: as many as stocks)")
+    parser.add_argument("--auxiliaries", type=int, help="number of auxiliaries (default: twice the stocks)")
+    parser.add_argument("--connectors", type=int, help="number of connectors (default: one per reference)")
+    parser.add_argument("--positions", action="store_true", help="give every variable x/y positions")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default 0)")
+    args = parser.parse_args()
+
+    if args.variables is not None:
+        model_data = model_of_size(args.variables, args.seed, args.positions)
+    else:
+        model_data = generate_model(args.stocks, args.flows, args.auxiliaries, args.connectors, args.seed,
+                                    args.positions)
+    with open(args.output, "w") as f:
+        json.dump(model_data, f, indent=2)
+    print(f"Wrote {len(model_data['stocks'])} stocks, {len(model_data['flows'])} flows, "
+          f"{len(model_data['auxiliaries'])} auxiliaries and {len(model_data['connectors'])} connectors "
+          f"to '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
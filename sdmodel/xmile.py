@@ -0,0 +1,802 @@
+"""
+Generation of XMILE files from model_data.
+
+This is the conversion core shared by "JSON to XMILE.py" and
+"SD Model Image Identification (API).py". It uses only the standard library,
+so importing it is fast and needs none of the provider SDKs.
+
+    from sdmodel.xmile import generate_xmile
+    generate_xmile(model_data, "model.xmile")
+
+read_xmile() goes the other way and loads an XMILE file back into
+model_data, so existing outputs can be re-simulated, compared or laid out
+again without another LLM call:
+
+    python -m sdmodel.xmile outputs/ -o models/
+
+IncrementalExporter re-exports a model that is being edited, rebuilding only
+the variables and view objects that changed since the previous export.
+
+write_xmile_from_json() converts JSON model files too large to load whole,
+reading them a block at a time (see sdmodel.jsonstream):
+
+    outline = write_xmile_from_json("merged_model.json", "merged_model.xmile")
+    print_summary(outline)
+
+Every function that takes model_data also takes a Model (sdmodel.model);
+dictionaries are loaded into one first.
+"""
+import contextlib
+import io
+import os
+import re
+import xml.etree.ElementTree as ET
+
+from sdmodel.model import CATEGORIES, Model, _variable, load_model, load_model_items
+
+
+def extract_variable_names(model_data):
+    """Extracts variable names from stocks, flows, and auxiliaries."""
+    if isinstance(model_data, Model):
+        return list(model_data.names)
+    names = []
+    for category in ["stocks", "flows", "auxiliaries"]:
+        for item in model_data.get(category, []):
+            names.append(item["name"])
+    return names
+
+
+# Variable names made of plain words separated by single spaces
+_PLAIN_NAME = re.compile(r"\w+(?: \w+)+")
+_WORD = re.compile(r"\w+")
+
+
+def _names_overlap(names):
+    """Returns True if the trailing words of one name are the leading words of another."""
+    prefixes = {}
+    for name in names:
+        words = name.split(" ")
+        for k in range(1, len(words)):
+            prefixes.setdefault(" ".join(words[:k]), set()).add(name)
+    for name in names:
+        words = name.split(" ")
+        for k in range(1, len(words)):
+            if prefixes.get(" ".join(words[k:]), set()) - {name}:
+                return True
+    return False
+
+
+def compile_eqn_cleaner(variable_names):
+    """
+    Builds a function that cleans equations for a fixed list of variable names.
+    Call it once per model and reuse the result for every equation: each equation
+    is then rewritten in a single scan instead of one re.sub per variable name.
+    The output is the same as applying the names one by one, longest first.
+    """
+    # Names without spaces are left unchanged, so only the spaced ones need rewriting.
+    # Sort by length (longest names first to avoid partial replacements)
+    spaced = sorted(dict.fromkeys(n for n in variable_names if " " in n), key=len, reverse=True)
+
+    if all(_PLAIN_NAME.fullmatch(n) for n in spaced) and not _names_overlap(spaced):
+        # Plain names can only collide when they start at the same word, where the
+        # longest wins. Store them in a word trie so each equation is scanned once.
+        trie = {}
+        for name in spaced:
+            node = trie
+            for word in name.split(" "):
+                node = node.setdefault(word, {})
+            node[None] = name.replace(" ", "_")
+
+        def clean(eqn):
+            words = list(_WORD.finditer(eqn))
+            parts = []
+            last = 0
+            i = 0
+            while i < len(words):
+                node = trie.get(words[i].group())
+                match = None
+                j = i
+                while node is not None:
+                    if None in node:
+                        match = (j, node[None])
+                    end = words[j].end()
+                    if j + 1 == len(words) or words[j + 1].start() != end + 1 or eqn[end] != " ":
+                        break
+                    j += 1
+                    node = node.get(words[j].group())
+                if match is None:
+                    i += 1
+                    continue
+                j, underscored = match
+                parts.append(eqn[last:words[i].start()])
+                parts.append(underscored)
+                last = words[j].end()
+                i = j + 1
+            if not parts:
+                return eqn
+            parts.append(eqn[last:])
+            return "".join(parts)
+
+        return clean
+
+    # Names with punctuation or overlapping words: keep the one-by-one replacement,
+    # but compile every pattern once per model instead of once per equation.
+    patterns = [(re.compile(r'\b' + re.escape(name) + r'\b'), name.replace(" ", "_")) for name in spaced]
+
+    def clean(eqn):
+        for pattern, underscored in patterns:
+            eqn = pattern.sub(underscored, eqn)
+        return eqn
+
+    return clean
+
+
+def clean_eqn(eqn, variable_names):
+    """
+    Replace spaces in known variable names with underscores in the given equation.
+    Ensures correct matching by sorting longer names first.
+    """
+    return compile_eqn_cleaner(variable_names)(eqn)
+
+
+def _header_elements():
+    """Yields the <header> and <sim_specs> elements."""
+    # Add header information
+    header = ET.Element("header")
+    model_name = ET.SubElement(header, "name")
+    model_name.text = "Converted System Dynamics Model"
+    yield header
+
+    # Simulation specifications - subject to change by users
+    sim_specs = ET.Element("sim_specs")
+    start = ET.SubElement(sim_specs, "start")
+    start.text = "0"
+    stop = ET.SubElement(sim_specs, "stop")
+    stop.text = "100"
+    dt = ET.SubElement(sim_specs, "dt")
+    dt.text = "1/4"
+    yield sim_specs
+
+
+def _stock_element(stock, identifier):
+    """Builds the <stock> variable element; `identifier` gives the XMILE name of a flow."""
+    stock_el = ET.Element("stock", {"name": stock.name})
+
+    if stock.description:
+        doc_el = ET.SubElement(stock_el, "doc")
+        doc_el.text = stock.description
+
+    if stock.eqn:
+        eqn_el = ET.SubElement(stock_el, "eqn")
+        eqn_el.text = stock.eqn
+
+    # Add corresponding flow tags if available
+    for inflow in stock.inflows:
+        ET.SubElement(stock_el, "inflow").text = identifier(inflow)
+    for outflow in stock.outflows:
+        ET.SubElement(stock_el, "outflow").text = identifier(outflow)
+
+    if stock.unit:
+        doc_el = ET.SubElement(stock_el, "units")
+        doc_el.text = stock.unit
+    return stock_el
+
+
+def _converter_element(tag, item, clean):
+    """Builds the <flow> or <aux> variable element; `clean` rewrites the equation."""
+    item_el = ET.Element(tag, {"name": item.name})
+
+    if item.description:
+        doc_el = ET.SubElement(item_el, "doc")
+        doc_el.text = item.description
+
+    if item.eqn:
+        eqn_el = ET.SubElement(item_el, "eqn")
+        eqn_el.text = clean(item.eqn)
+
+    if item.unit:
+        doc_el = ET.SubElement(item_el, "units")
+        doc_el.text = item.unit
+    return item_el
+
+
+def _variable_elements(model_data):
+    """Yields one <stock>, <flow> or <aux> element per model variable."""
+    model = load_model(model_data)
+    clean = compile_eqn_cleaner(model.names)
+
+    # Add stocks
+    for stock in model.stocks:
+        yield _stock_element(stock, model.identifier)
+
+    # Add flows
+    for flow in model.flows:
+        yield _converter_element("flow", flow, clean)
+
+    # Add auxiliary variables
+    for aux in model.auxiliaries:
+        yield _converter_element("aux", aux, clean)
+
+
+def _view_layout(model_data):
+    """
+    Lays out the single <view>. Yields one tuple per view object holding
+    everything its element is built from (see _view_element):
+
+        ("connector", uid, angle, src, tgt)
+        ("stock", name, x, y)
+        ("flow", name, x, y, first pt x, second pt x, pt y)
+        ("aux", name, x, y)
+    """
+    # Grid layout settings
+    grid_spacing_x = 300
+    grid_spacing_y = 200
+    stock_start_x = 400
+    stock_start_y = 400
+
+    model = load_model(model_data)
+
+    # Position trackers
+    stock_positions = {}
+    flow_positions = {}
+    aux_positions = {}
+    var_positions = {}
+
+    # Add connector elements in the view with sequential "uid" starting from 1
+    targets = {}
+    for i, (src, tgt, angle) in enumerate(model.connectors, start=1):
+        targets.setdefault(src, tgt)
+        yield ("connector", str(i), "0" if angle is None else str(angle), src, tgt)
+
+    # Output display objects for variables
+    for i, stock in enumerate(model.stocks):
+        x = stock_start_x + (i % 4) * grid_spacing_x
+        y = stock_start_y + (i // 4) * grid_spacing_y
+        stock_positions[stock.name] = (x, y)
+        var_positions[stock.name] = (x, y)
+        yield ("stock", stock.name, str(x if stock.x is None else stock.x), str(y if stock.y is None else stock.y))
+
+    stocks = model.stocks
+    for i, flow in enumerate(model.flows):
+        name = flow.name
+
+        # Try to find connected stocks
+        source = model.flow_source[i]
+        sink = model.flow_sink[i]
+        from_stock = stocks[source].name if source >= 0 else None
+        to_stock = stocks[sink].name if sink >= 0 else None
+
+        if from_stock and to_stock:
+            x1, y1 = stock_positions[from_stock]
+            x2, y2 = stock_positions[to_stock]
+            x = (x1 + x2) // 2
+            y = (y1 + y2) // 2
+        elif to_stock:
+            x, y = stock_positions[to_stock]
+            x -= 100
+        elif from_stock:
+            x, y = stock_positions[from_stock]
+            x += 100
+        else:
+            x = 100 + (i * 150)
+            y = 500
+
+        flow_positions[name] = (x, y)
+        var_positions[name] = (x, y)
+
+        # Generate <pts> in view as well using the same rule:
+        flow_x = x if flow.x is None else flow.x
+        flow_y = y if flow.y is None else flow.y
+        try:
+            pt_x = float(flow_x)
+        except ValueError:
+            pt_x = 0.0
+        yield ("flow", name, str(flow_x), str(flow_y), str(pt_x - 60), str(pt_x + 60), str(flow_y))
+
+    aux_indices = {}
+    for i, aux in enumerate(model.auxiliaries):
+        name = aux.name
+
+        # Find what this auxiliary connects to
+        target = targets.get(name)
+        base_x, base_y = var_positions.get(target, (100 + (i * 200), 700))
+
+        # Offset for visual clarity
+        offset = aux_indices.get(target, 0)
+        x = base_x
+        y = base_y - 100 - (offset * 30)
+        aux_indices[target] = offset + 1
+
+        aux_positions[name] = (x, y)
+        var_positions[name] = (x, y)
+        yield ("aux", name, str(x if aux.x is None else aux.x), str(y if aux.y is None else aux.y))
+
+
+def _view_element(entry):
+    """Builds the view element of one _view_layout entry."""
+    kind = entry[0]
+    if kind == "connector":
+        _, uid, angle, src, tgt = entry
+        connector_el = ET.Element("connector", attrib={"uid": uid, "angle": angle})
+        from_el = ET.SubElement(connector_el, "from")
+        from_el.text = src
+        to_el = ET.SubElement(connector_el, "to")
+        to_el.text = tgt
+        return connector_el
+    if kind == "flow":
+        _, name, x, y, pt_x1, pt_x2, pt_y = entry
+        flow_view = ET.Element("flow", attrib={"x": x, "y": y, "name": name})
+        pts_el = ET.SubElement(flow_view, "pts")
+        ET.SubElement(pts_el, "pt", attrib={"x": pt_x1, "y": pt_y})
+        ET.SubElement(pts_el, "pt", attrib={"x": pt_x2, "y": pt_y})
+        return flow_view
+    _, name, x, y = entry
+    return ET.Element(kind, attrib={"x": x, "y": y, "name": name})
+
+
+def _view_elements(model_data):
+    """Yields the connector and display objects of the single <view>."""
+    for entry in _view_layout(model_data):
+        yield _view_element(entry)
+
+
+@contextlib.contextmanager
+def _open_xmile(file):
+    """
+    Opens a file name or binary file object for text output, the same way
+    ElementTree.write does, so both writers produce identical bytes.
+    """
+    if hasattr(file, "write"):
+        text = io.TextIOWrapper(file, encoding="utf-8", errors="xmlcharrefreplace", newline="\n")
+        try:
+            yield text.write
+        finally:
+            text.flush()
+            text.detach()
+    else:
+        with open(file, "w", encoding="utf-8", errors="xmlcharrefreplace") as text:
+            yield text.write
+
+
+def _write_children(write, tag, fragments):
+    """Writes a container element around its serialized children."""
+    first = next(fragments, None)
+    if first is None:
+        write(f"<{tag} />")
+        return
+    write(f"<{tag}>")
+    write(first)
+    for fragment in fragments:
+        write(fragment)
+    write(f"</{tag}>")
+
+
+def _write_document(file, variable_fragments, view_fragments):
+    """Writes the XMILE document around serialized variable and view elements."""
+    with _open_xmile(file) as write:
+        write("<?xml version='1.0' encoding='utf-8'?>\n")
+        write('<xmile version="1.0">')
+        for el in _header_elements():
+            write(ET.tostring(el, encoding="unicode"))
+        write("<model>")
+        _write_children(write, "variables", iter(variable_fragments))
+        write("<views>")
+        _write_children(write, "view", iter(view_fragments))
+        write("</views></model></xmile>")
+
+
+def write_xmile_stream(model_data, file):
+    """
+    Writes the XMILE file incrementally: each variable and view object is
+    serialized and released as soon as it is produced, so memory use is much
+    lower than building the tree. The model itself is still held (as a
+    Model), since the view needs every name, position, flow link and
+    connector after the variables are written; that part grows with the
+    model. The output is byte-for-byte the same as the ElementTree path.
+    `file` is a file name or a binary file object.
+    """
+    model_data = load_model(model_data)
+    _write_document(file,
+                    (ET.tostring(el, encoding="unicode") for el in _variable_elements(model_data)),
+                    (ET.tostring(el, encoding="unicode") for el in _view_elements(model_data)))
+
+
+def write_xmile_from_json(json_filename, file):
+    """
+    Converts a JSON model file to XMILE without loading the JSON document,
+    in two passes over the file. The first keeps an outline of the model
+    (see sdmodel.model.read_model): the names for the equation cleaning, and
+    the positions, flow links and connectors for the view. The second
+    streams the stocks, flows and auxiliaries again and writes each element
+    as it is decoded. Memory grows with the number of names, not with the
+    equations and descriptions, and the file is the same as generate_xmile's.
+    Files that list auxiliaries before flows or stocks (not the usual order)
+    take one more pass per category. Returns the outline Model, which
+    print_summary accepts.
+    """
+    from sdmodel.jsonstream import stream_items
+
+    order = []
+
+    def record_order(items):
+        for category, item in items:
+            if category != "connectors" and (not order or order[-1] != category):
+                order.append(category)
+            yield category, item
+
+    outline = load_model_items(record_order(stream_items(json_filename)), outline=True)
+    variable_categories = [category for _, category in CATEGORIES]
+    if order == sorted(set(order), key=variable_categories.index):
+        passes = [variable_categories]
+    else:
+        passes = [[category] for category in variable_categories]
+
+    def variable_fragments():
+        clean = compile_eqn_cleaner(outline.names)
+        kinds = {category: kind for kind, category in CATEGORIES}
+
+        def intern(string, default):
+            # Each element is written and dropped, so its strings are not worth interning
+            return default
+
+        for categories in passes:
+            for category, item in stream_items(json_filename):
+                if category not in categories:
+                    continue
+                variable = _variable(kinds[category], item, intern)
+                if variable.kind == "stock":
+                    el = _stock_element(variable, outline.identifier)
+                else:
+                    el = _converter_element(variable.kind, variable, clean)
+                yield ET.tostring(el, encoding="unicode")
+
+    _write_document(file, variable_fragments(),
+                    (ET.tostring(el, encoding="unicode") for el in _view_elements(outline)))
+    return outline
+
+
+def generate_xmile(model_data, filename, streaming=False):
+    """
+    Converts the structured model data into an XMILE file.
+    Builds the required XML structure and writes it to the specified file.
+    With streaming=True the file is written incrementally (see write_xmile_stream).
+    """
+    model_data = load_model(model_data)
+    if streaming:
+        write_xmile_stream(model_data, filename)
+        return
+
+    # Create the root XMILE element
+    xmile = ET.Element("xmile", {"version": "1.0"})
+    xmile.extend(_header_elements())
+
+    # Model section
+    model = ET.SubElement(xmile, "model")
+    variables = ET.SubElement(model, "variables")
+    variables.extend(_variable_elements(model_data))
+
+    # Create views element and a single view element
+    views = ET.SubElement(model, "views")
+    view = ET.SubElement(views, "view")
+    view.extend(_view_elements(model_data))
+
+    # Write the XMILE file
+    tree = ET.ElementTree(xmile)
+    tree.write(filename, encoding="utf-8", xml_declaration=True)
+
+
+class IncrementalExporter:
+    """
+    Re-exports a model that changes a little between exports, such as a JSON
+    file being edited by hand. The serialized XML of every variable and view
+    object is kept together with the inputs it was built from; an export only
+    rebuilds the objects whose inputs changed. A changed equation or position
+    rebuilds one element; renaming, adding or removing a variable rebuilds the
+    flow and auxiliary equations, because the name cleaning depends on all the
+    names, and the view objects whose computed positions moved.
+    The file written is identical to generate_xmile's.
+
+    With a `state_file` the fragments are kept on disk between runs, so a
+    command line tool can export incrementally too. The file is JSON, never
+    unpickled, since it sits next to the output where others may write.
+
+        exporter = IncrementalExporter("model.xmile.fragments")
+        exporter.export(model_data, "model.xmile")
+    """
+
+    # Stored in the state file; bump when the element builders change
+    VERSION = 2
+
+    def __init__(self, state_file=None):
+        self.state_file = state_file
+        self.names = None
+        self.clean = None
+        self.fragments = {}
+        self.layout = None
+        self.view = None
+        self.stats = {"reused": 0, "rebuilt": 0}
+        if state_file and os.path.exists(state_file):
+            import json
+
+            try:
+                with open(state_file, "r", encoding="utf-8") as f:
+                    state = json.load(f)
+                if state.get("version") == self.VERSION:
+                    # JSON turns the tuples of the names, keys and layout into lists
+                    names = _as_tuples(state["names"])
+                    fragments = {_as_tuples(key): fragment for key, fragment in state["fragments"]}
+                    layout = _as_tuples(state["layout"])
+                    view = list(state["view"])
+                    self.names, self.fragments, self.layout, self.view = names, fragments, layout, view
+            except (OSError, ValueError, KeyError, TypeError, AttributeError):
+                # Unreadable or from an older version: the next export rebuilds everything
+                pass
+
+    def _fragment(self, key, build, fragments):
+        fragment = self.fragments.get(key)
+        if fragment is None:
+            fragment = ET.tostring(build(), encoding="unicode")
+            self.stats["rebuilt"] += 1
+        else:
+            self.stats["reused"] += 1
+        fragments[key] = fragment
+        return fragment
+
+    def export(self, model_data, filename):
+        """Writes model_data to `filename`, reusing the fragments of unchanged objects."""
+        self.stats = {"reused": 0, "rebuilt": 0}
+        model = load_model(model_data)
+        names = model.names
+        if names != self.names:
+            # Equations are cleaned against the full list of names
+            self.fragments = {key: fragment for key, fragment in self.fragments.items()
+                              if key[0] not in ("flow", "aux")}
+            self.names = names
+            self.clean = None
+        if self.clean is None:
+            self.clean = _LazyCleaner(names)
+        clean = self.clean
+        fragments = {}
+
+        # Keys hold every field the element is built from; empty fields are not written, so they key as None
+        variables = []
+        for stock in model.stocks:
+            key = ("stock", stock.name, stock.description or None, stock.eqn or None, stock.inflows,
+                   stock.outflows, stock.unit or None)
+            variables.append(self._fragment(key, lambda: _stock_element(stock, model.identifier), fragments))
+        for items in (model.flows, model.auxiliaries):
+            for item in items:
+                key = (item.kind, item.name, item.description or None, item.eqn or None, item.unit or None)
+                variables.append(self._fragment(key, lambda: _converter_element(item.kind, item, clean),
+                                                fragments))
+
+        # The layout does not depend on equations: when none of its inputs changed, the view is reused whole
+        layout = _layout_signature(model)
+        if layout == self.layout:
+            view = self.view
+            self.stats["reused"] += len(view)
+            fragments.update((key, fragment) for key, fragment in self.fragments.items() if key[0] == "view")
+        else:
+            # View keys are the layout entries themselves, tagged so they never collide with variable keys
+            view = [self._fragment(("view",) + entry, lambda: _view_element(entry), fragments)
+                    for entry in _view_layout(model)]
+            self.layout = layout
+            self.view = view
+
+        self.fragments = fragments
+        _write_document(filename, variables, view)
+        if self.state_file:
+            self.save()
+        return self.stats
+
+    def save(self, state_file=None):
+        """Writes the fragments to `state_file` (by default the one given at creation)."""
+        import json
+
+        path = state_file or self.state_file
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.VERSION, "names": self.names, "fragments": list(self.fragments.items()),
+                       "layout": self.layout, "view": self.view}, f)
+        os.replace(tmp_path, path)
+
+
+def _as_tuples(value):
+    return tuple(_as_tuples(part) for part in value) if isinstance(value, list) else value
+
+
+def _layout_signature(model):
+    # Everything _view_layout reads from the model
+    return (
+        model.connectors,
+        tuple((stock.name, stock.x, stock.y, stock.inflows, stock.outflows) for stock in model.stocks),
+        tuple((flow.name, flow.x, flow.y) for flow in model.flows),
+        tuple((aux.name, aux.x, aux.y) for aux in model.auxiliaries),
+    )
+
+
+class _LazyCleaner:
+    """Compiles the equation cleaner on first use, so exports that rebuild no equations skip it."""
+
+    def __init__(self, names):
+        self.names = names
+        self.clean = None
+
+    def __call__(self, eqn):
+        if self.clean is None:
+            self.clean = compile_eqn_cleaner(self.names)
+        return self.clean(eqn)
+
+
+# XMILE variable tags and the model_data lists and fields they map to
+_CATEGORIES = {"stock": "stocks", "flow": "flows", "aux": "auxiliaries"}
+_FIELDS = {"doc": "description", "eqn": "eqn", "units": "unit"}
+
+
+def _local_name(tag):
+    # Files saved by Stella and other tools put every tag in the XMILE namespace
+    return tag.rsplit("}", 1)[-1]
+
+
+def _coordinate(text):
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def read_xmile(file, positions=True):
+    """
+    Reads an XMILE file (a file name or binary file object) back into model_data.
+
+    The file is parsed with ET.iterparse and every variable, connector and
+    display object is released as soon as it has been read, so memory use is
+    that of the resulting model_data, not of the XML tree. Equations are kept
+    as written, with underscores in variable names, which the equation parser
+    and generate_xmile both accept. Stock inflows and outflows are matched back
+    to the flow names. With positions=True the x/y of the view objects are kept,
+    so writing the model again reproduces the same layout; with positions=False
+    they are dropped and generate_xmile lays the model out afresh.
+    """
+    model_data = {"stocks": [], "flows": [], "auxiliaries": [], "connectors": []}
+    items = {}
+    section = None
+    container = None
+    depth = 0
+    container_depth = None
+    for event, elem in ET.iterparse(file, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            tag = _local_name(elem.tag)
+            if tag in ("variables", "view") and container is None:
+                section, container, container_depth = tag, elem, depth
+            continue
+        depth -= 1
+        if container is None:
+            continue
+        if elem is container:
+            container.clear()
+            section = container = container_depth = None
+            continue
+        if depth != container_depth:
+            continue
+
+        # A direct child of <variables> or <view>
+        tag = _local_name(elem.tag)
+        name = elem.get("name")
+        if section == "variables" and tag in _CATEGORIES and name is not None:
+            item = {"name": name}
+            inflows, outflows = [], []
+            for child in elem:
+                child_tag = _local_name(child.tag)
+                if child_tag in _FIELDS and child.text:
+                    item[_FIELDS[child_tag]] = child.text
+                elif child_tag == "inflow" and child.text:
+                    inflows.append(child.text)
+                elif child_tag == "outflow" and child.text:
+                    outflows.append(child.text)
+            if tag == "stock":
+                item["inflows"] = inflows
+                item["outflows"] = outflows
+            model_data[_CATEGORIES[tag]].append(item)
+            items.setdefault(name, item)
+        elif section == "view" and tag == "connector":
+            ends = {_local_name(child.tag): child.text for child in elem}
+            if ends.get("from") and ends.get("to"):
+                conn = {"src": ends["from"], "tgt": ends["to"]}
+                angle = elem.get("angle")
+                if angle not in (None, "0"):
+                    conn["angle"] = _coordinate(angle)
+                model_data["connectors"].append(conn)
+        elif section == "view" and positions and tag in _CATEGORIES and name in items:
+            item = items[name]
+            for axis in ("x", "y"):
+                if elem.get(axis) is not None:
+                    item[axis] = _coordinate(elem.get(axis))
+        container.clear()
+
+    # Stocks list their flows with underscores in place of spaces
+    flow_names = {}
+    for flow in model_data["flows"]:
+        flow_names.setdefault(flow["name"].replace(" ", "_"), flow["name"])
+    for stock in model_data["stocks"]:
+        stock["inflows"] = [flow_names.get(flow, flow) for flow in stock["inflows"]]
+        stock["outflows"] = [flow_names.get(flow, flow) for flow in stock["outflows"]]
+    return model_data
+
+
+def print_summary(model_data):
+    """
+    Prints a summary of the model data, including the number of stocks, flows,
+    and auxiliary variables, as well as their names.
+    """
+    if isinstance(model_data, Model):
+        # The names are already collected in model order
+        n_stocks, n_flows = len(model_data.stocks), len(model_data.flows)
+        stocks = model_data.names[:n_stocks]
+        flows = model_data.names[n_stocks:n_stocks + n_flows]
+        auxiliaries = model_data.names[n_stocks + n_flows:]
+        connectors = model_data.connectors
+    else:
+        stocks = [stock["name"] for stock in model_data.get("stocks", [])]
+        flows = [flow["name"] for flow in model_data.get("flows", [])]
+        auxiliaries = [aux["name"] for aux in model_data.get("auxiliaries", [])]
+        connectors = model_data.get("connectors", [])
+
+    print("\nModel Summary:")
+    print(f"Number of stocks: {len(stocks)}")
+    print("Stocks:", ", ".join(stocks))
+
+    print(f"\nNumber of flows: {len(flows)}")
+    print("Flows:", ", ".join(flows))
+
+    print(f"\nNumber of auxiliary variables: {len(auxiliaries)}")
+    print("Auxiliaries:", ", ".join(auxiliaries))
+
+    print(f"\nNumber of connectors: {len(connectors)}")
+
+
+def main():
+    # Only the command line needs these; the library functions stay quick to import
+    import argparse
+    import glob
+    import json
+
+    parser = argparse.ArgumentParser(description="Convert XMILE files back into JSON model data.")
+    parser.add_argument("inputs", nargs="+", help="XMILE files, directories or glob patterns")
+    parser.add_argument("-o", "--output-dir", help="write JSON files here instead of next to the XMILE files")
+    parser.add_argument("--no-positions", action="store_true", help="drop the x/y positions of the view")
+    args = parser.parse_args()
+
+    files = set()
+    for item in args.inputs:
+        if os.path.isdir(item):
+            files.update(glob.glob(os.path.join(item, "*.xmile")))
+        else:
+            files.update(path for path in glob.glob(item, recursive=True) if os.path.isfile(path))
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    failed = 0
+    for path in sorted(files):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        json_path = os.path.join(args.output_dir or os.path.dirname(path), stem + ".json")
+        try:
+            model_data = read_xmile(path, positions=not args.no_positions)
+        except ET.ParseError as e:
+            failed += 1
+            print(f"FAILED  {path}: {e}")
+            continue
+        with open(json_path, "w") as f:
+            json.dump(model_data, f, indent=2)
+        print(f"ok      {path} -> {json_path}")
+    print(f"\nRead {len(files) - failed} XMILE files, {failed} failed")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()